@@ -3,7 +3,7 @@ Django settings for MelodyUnmixApp project.
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 from datetime import timedelta
 import sys
 import pymongo
@@ -172,6 +172,137 @@ MONGO_URI = config("MONGO_URI", default="")
 MONGO_DB = config("MONGO_DB", default="")
 MONGO_CLIENT = pymongo.MongoClient(MONGO_URI) if MONGO_URI else None
 
+# =========================
+# Demucs
+# =========================
+# Cómo se ejecuta Demucs (audios/services/demucs_service.py):
+#   "docker": `docker run --rm demucs:optimized` por canción
+#   "worker": worker persistente con el modelo cargado
+#             (docker_demucs/demucs_worker.py, ver docker_demucs/README.md)
+#             en DEMUCS_WORKER_ADDRESS: socket Unix o "host:puerto"
+#   "local":  el modelo DEMUCS_MODEL dentro del proceso de Django
+#             ("stub" = stems de prueba sin Demucs, para desarrollo)
+DEMUCS_BACKEND = config("DEMUCS_BACKEND", default="docker")
+DEMUCS_WORKER_ADDRESS = config("DEMUCS_WORKER_ADDRESS", default="/tmp/demucs/demucs.sock")
+DEMUCS_MODEL = config("DEMUCS_MODEL", default="mdx_extra_q")
+DEMUCS_DEVICE = config("DEMUCS_DEVICE", default="cpu")
+# Parámetros de rendimiento por deployment (vacío = default de Demucs);
+# procesar_cancion(opciones_demucs=...) los pisa por job. Se validan en
+# demucs_service.demucs_options y llegan al contenedor como -e DEMUCS_*
+#   SEGMENT: segundos por trozo (1-60, menos memoria)
+#   SHIFTS:  predicciones desplazadas (0-10, calidad x tiempo)
+#   OVERLAP: solapamiento entre trozos (0-0.99)
+#   JOBS:    procesos en paralelo (0-64, p.ej. 8 en nodos de 32 cores)
+#   THREADS: hilos de torch (1-256; el backend "local" lo ignora)
+DEMUCS_SEGMENT = config("DEMUCS_SEGMENT", default="") or None
+DEMUCS_SHIFTS = config("DEMUCS_SHIFTS", default="") or None
+DEMUCS_OVERLAP = config("DEMUCS_OVERLAP", default="") or None
+DEMUCS_JOBS = config("DEMUCS_JOBS", default="") or None
+DEMUCS_THREADS = config("DEMUCS_THREADS", default="") or None
+# Presets que se pueden pedir al subir un audio (campo "demucs_preset"),
+# aplicados sobre los DEMUCS_* de arriba (ver demucs_service.preset_options)
+#   rapido:  sin shifts y poco solapamiento (menos cómputo por canción)
+#   calidad: 2 shifts (promedia dos predicciones: ~2x tiempo, menos artefactos)
+DEMUCS_PRESETS = {
+    "rapido": {"shifts": 0, "overlap": 0.1},
+    "calidad": {"shifts": 2, "overlap": 0.25},
+}
+# Segundos mínimos entre actualizaciones de etapa/progreso en Postgres
+# (las barras de tqdm se redibujan cientos de veces por canción)
+DEMUCS_PROGRESS_INTERVAL = config("DEMUCS_PROGRESS_INTERVAL", default=2.0, cast=float)
+# Cancelación de jobs (audios/services/cancellation.py): en el mismo proceso
+# es inmediata; si el DELETE llega a otro worker, el job lo detecta
+# consultando Postgres como mucho cada CANCEL_DB_CHECK_INTERVAL segundos
+CANCEL_DB_CHECK_INTERVAL = config("CANCEL_DB_CHECK_INTERVAL", default=5.0, cast=float)
+
+# =========================
+# GuitarNet
+# =========================
+# Pesos dentro de models/: .pth o .safetensors (generado con
+# models/convert_weights.py). Ambos se cargan con mmap, así los procesos que
+# cargan el mismo archivo comparten las páginas vía page cache
+GUITARNET_MODEL_FILE = config("GUITARNET_MODEL_FILE", default="guitarnet_model.pth")
+
+# Audios de esta duración (s) o más se separan en streaming por bloques
+# (memoria constante). 0 = desactivado.
+GUITARNET_STREAM_MIN_DURATION = config("GUITARNET_STREAM_MIN_DURATION", default=600, cast=int)
+
+# Tamaño de chunk: 0 = automático según MemAvailable / límite del cgroup,
+# repartido entre los jobs de GuitarNet en curso (GUITARNET_MEMORY_FRACTION
+# de la memoria disponible); si la pista no entra se separa en streaming.
+# Cada decisión queda en el log "GuitarNet chunking".
+GUITARNET_CHUNK_DURATION = config("GUITARNET_CHUNK_DURATION", default=0, cast=int)
+GUITARNET_MAX_BATCH = config("GUITARNET_MAX_BATCH", default=4, cast=int)
+GUITARNET_MEMORY_FRACTION = config("GUITARNET_MEMORY_FRACTION", default=0.8, cast=float)
+# Carpeta compartida por los workers de gunicorn donde cada job de GuitarNet
+# en curso deja un archivo <pid>-<id>: el reparto de memoria cuenta los jobs
+# de todos los procesos (los de procesos muertos se descartan). Vacío =
+# sólo los jobs de este proceso.
+GUITARNET_JOBS_DIR = config("GUITARNET_JOBS_DIR", default="/tmp/melodyunmix/guitarnet_jobs")
+
+# BN folding + channels_last + inference_mode al cargar el modelo
+GUITARNET_OPTIMIZE = config("GUITARNET_OPTIMIZE", default=False, cast=bool)
+
+# Precisión de inferencia: "fp32" | "bf16" | "int8" (int8 requiere
+# models/guitarnet_model.int8.ts, generado con models/calibrate_guitarnet.py)
+GUITARNET_PRECISION = config("GUITARNET_PRECISION", default="fp32")
+
+# Motor de inferencia: "torch" | "onnx" (onnxruntime CPU; exporta
+# models/guitarnet_model.onnx la primera vez) | "remote" (los forwards van
+# al servidor models/guitarnet_server.py, que agrupa chunks de todos los
+# workers; los workers no cargan el modelo) y sus hilos intra-op (0 = default)
+GUITARNET_BACKEND = config("GUITARNET_BACKEND", default="torch")
+GUITARNET_THREADS = config("GUITARNET_THREADS", default=0, cast=int) or None
+GUITARNET_SERVER_SOCKET = config("GUITARNET_SERVER_SOCKET", default="/tmp/guitarnet.sock")
+
+# Chunks del stem 'other' con RMS bajo este umbral (dBFS) no pasan por el
+# modelo (guitarra en silencio). Se reportan en el log "GuitarNet completado".
+GUITARNET_SILENCE_DB = config("GUITARNET_SILENCE_DB", default=-70.0, cast=float)
+
+# Unión de chunks: "hann" (50% overlap, ~2x cómputo) | "context" (margen de
+# GUITARNET_CONTEXT_FRAMES frames STFT a cada lado + crossfade corto, ~1.1x).
+# Comparar calidad con: python models/benchmark_guitarnet.py --suite stitching
+GUITARNET_STITCH = config("GUITARNET_STITCH", default="hann")
+GUITARNET_CONTEXT_FRAMES = config("GUITARNET_CONTEXT_FRAMES", default=128, cast=int)
+
+# Calidad por defecto de los jobs: "full" | "fast" (el modelo corre sobre
+# frames agrupados de a GUITARNET_FAST_TIME_FACTOR y sólo bajo
+# GUITARNET_FAST_CUTOFF_HZ, ~4x menos cómputo; pensado para previews).
+# procesar_cancion(quality=...) la elige por job.
+GUITARNET_QUALITY = config("GUITARNET_QUALITY", default="full")
+GUITARNET_FAST_TIME_FACTOR = config("GUITARNET_FAST_TIME_FACTOR", default=2, cast=int)
+GUITARNET_FAST_CUTOFF_HZ = config("GUITARNET_FAST_CUTOFF_HZ", default=11025.0, cast=float)
+
+# Guardar la máscara cruda del modelo (uint8, guitar_mask.npz junto a los
+# stems) para re-renderizar con otros parámetros sin inferencia
+# (POST /api/audios/<id>/rerender). Los jobs en streaming no la guardan.
+GUITARNET_SAVE_MASK = config("GUITARNET_SAVE_MASK", default=True, cast=bool)
+
+# Entrega Demucs → GuitarNet en el pipeline:
+#   "memory": separación en memoria, guitar.wav / other.wav se escriben una
+#             sola vez (atómicamente) en la carpeta de Demucs
+#   "disk":   flujo anterior (carpeta _guitar_temp + copia de los stems)
+GUITARNET_HANDOFF = config("GUITARNET_HANDOFF", default="memory")
+
+# Dónde corre la inferencia: "thread" (en el hilo del job, dentro del
+# proceso de Django) | "process" (pool de procesos con el modelo precargado;
+# audio por shared memory; cada worker se recicla tras POOL_MAX_TASKS jobs).
+# POOL_WORKERS = 0 → cpu_count // GUITARNET_THREADS
+GUITARNET_EXECUTION = config("GUITARNET_EXECUTION", default="thread")
+GUITARNET_POOL_WORKERS = config("GUITARNET_POOL_WORKERS", default=0, cast=int)
+GUITARNET_POOL_MAX_TASKS = config("GUITARNET_POOL_MAX_TASKS", default=20, cast=int)
+
+# Precarga en producción: con GUITARNET_PRELOAD el modelo se carga en
+# AudiosConfig.ready(); con gunicorn + preload_app (gunicorn.conf.py) eso
+# ocurre en el master antes del fork y los workers comparten los pesos
+# (copy-on-write). El warm-up (forwards de prueba con chunks de
+# GUITARNET_WARMUP_CHUNKS segundos y lotes de GUITARNET_WARMUP_BATCHES)
+# corre en cada worker en post_fork. Estado en GET /api/audios/guitarnet/ready
+GUITARNET_PRELOAD = config("GUITARNET_PRELOAD", default=False, cast=bool)
+GUITARNET_WARMUP = config("GUITARNET_WARMUP", default=True, cast=bool)
+GUITARNET_WARMUP_CHUNKS = config("GUITARNET_WARMUP_CHUNKS", default="30", cast=Csv(float))
+GUITARNET_WARMUP_BATCHES = config("GUITARNET_WARMUP_BATCHES", default="1", cast=Csv(int))
+
 # =========================
 # Archivos estáticos / media
 # =========================
@@ -8,11 +8,16 @@ class AudiosConfig(AppConfig):
     def ready(self):
         """Precargar modelo GuitarNet al iniciar Django"""
         import os
-        # Evitar doble carga en dev con auto-reload
-        if os.environ.get('RUN_MAIN') == 'true':
+        from django.conf import settings
+
+        # Dev: sólo en el proceso hijo del auto-reload (evita doble carga).
+        # Producción: GUITARNET_PRELOAD; con gunicorn preload_app esto corre
+        # en el master y el warm-up queda para cada worker (post_fork).
+        dev_reload = os.environ.get('RUN_MAIN') == 'true'
+        if dev_reload or getattr(settings, 'GUITARNET_PRELOAD', False):
             try:
-                from .services.guitar_service import get_guitar_separator
-                get_guitar_separator()
-                print("GuitarNet precargado exitosamente")
+                from .services.guitar_service import preload_guitar_separator
+                if preload_guitar_separator(warmup=dev_reload):
+                    print("GuitarNet precargado exitosamente")
             except Exception as e:
                 print(f"No se pudo precargar GuitarNet: {e}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audios', '0003_remove_procesamientoaudio_bpm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procesamientoaudio',
+            name='metricas',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audios', '0004_procesamientoaudio_metricas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procesamientoaudio',
+            name='etapa',
+            field=models.CharField(blank=True, max_length=30, null=True),
+        ),
+        migrations.AddField(
+            model_name='procesamientoaudio',
+            name='progreso',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
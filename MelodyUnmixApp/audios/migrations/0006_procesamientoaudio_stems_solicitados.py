@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audios', '0005_procesamientoaudio_etapa_progreso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procesamientoaudio',
+            name='stems_solicitados',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -23,6 +23,16 @@ class ProcesamientoAudio(models.Model):
     title = models.CharField(max_length=500, blank=True, null=True)
     artist = models.CharField(max_length=500, blank=True, null=True)
     album = models.CharField(max_length=500, blank=True, null=True)
+    
+    # Tiempos del pipeline (Demucs, GuitarNet y sus etapas)
+    metricas = models.JSONField(blank=True, null=True)
+
+    # Progreso mientras estado == "procesando" (ver demucs_progress.py)
+    etapa = models.CharField(max_length=30, blank=True, null=True)
+    progreso = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    # Stems pedidos en el upload (None = todos, ver pipeline.normalizar_stems)
+    stems_solicitados = models.JSONField(blank=True, null=True)
 
     def __str__(self):
         return self.nombre_audio
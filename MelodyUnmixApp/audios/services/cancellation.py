@@ -0,0 +1,94 @@
+"""
+🛑 Cancelación de jobs - Registro en memoria con respaldo en la base
+Proyecto: Melody Unmix
+
+Antes cada línea de Demucs consultaba Postgres (`filter(id=...).exists()`)
+para saber si el usuario borró el audio. Ahora:
+- cada job registra un CancelToken (threading.Event) por audio_id
+- DeleteAudioView llama a cancel(audio_id): si el job corre en este
+  proceso se entera al instante, sin tocar la base
+- si el job corre en otro proceso (otro worker de gunicorn), el token
+  consulta `db_check` como mucho cada CANCEL_DB_CHECK_INTERVAL segundos
+
+Demucs (por línea) y GuitarNet (entre lotes de chunks) llaman al token,
+que en el caso común sólo lee el Event.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+_events = {}
+_events_lock = threading.Lock()
+
+
+class CancelToken:
+    """
+    Función sin argumentos que devuelve True si el job se canceló.
+
+    Args:
+        audio_id: id del ProcesamientoAudio del job
+        event: threading.Event que enciende cancel(audio_id)
+        db_check: función opcional (respaldo entre procesos) que devuelve
+                  True si el job se canceló desde otro proceso
+        db_interval: segundos mínimos entre llamadas a db_check
+        clock: reloj (inyectable en tests)
+    """
+
+    def __init__(self, audio_id, event, db_check=None, db_interval=5.0, clock=time.monotonic):
+        self.audio_id = audio_id
+        self.event = event
+        self.db_check = db_check
+        self.db_interval = db_interval
+        self.clock = clock
+        self._last_check = None
+
+    def __call__(self):
+        if self.event.is_set():
+            return True
+        if self.db_check is None:
+            return False
+        # La primera llamada consulta siempre (el DELETE pudo llegar antes
+        # de que el job se registrara)
+        now = self.clock()
+        if self._last_check is not None and now - self._last_check < self.db_interval:
+            return False
+        self._last_check = now
+        if self.db_check():
+            self.event.set()
+            return True
+        return False
+
+
+def register(audio_id, db_check=None):
+    """Registra el job de `audio_id` y devuelve su CancelToken"""
+    with _events_lock:
+        event = _events.setdefault(audio_id, threading.Event())
+    return CancelToken(
+        audio_id, event, db_check=db_check,
+        db_interval=getattr(settings, "CANCEL_DB_CHECK_INTERVAL", 5.0),
+    )
+
+
+def unregister(audio_id):
+    """Quita el job del registro (al terminar, con o sin error)"""
+    with _events_lock:
+        _events.pop(audio_id, None)
+
+
+def cancel(audio_id):
+    """
+    Pide cancelar el job de `audio_id`. Devuelve True si el job corre en
+    este proceso; si no, lo detecta su db_check.
+    """
+    with _events_lock:
+        event = _events.get(audio_id)
+    if event is None:
+        return False
+    event.set()
+    return True
+
+
+def is_registered(audio_id):
+    with _events_lock:
+        return audio_id in _events
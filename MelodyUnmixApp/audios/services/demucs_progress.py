@@ -0,0 +1,138 @@
+"""
+📊 Demucs Progress - Etapa y porcentaje a partir de la salida de Demucs
+Proyecto: Melody Unmix
+
+Demucs escribe barras de tqdm que se redibujan con '\\r' (cientos de
+actualizaciones por canción, una por barra y por modelo del bag). El
+parser:
+- separa la salida por '\\r' y '\\n' (admite líneas o fragmentos crudos)
+- extrae etapa y porcentaje global (las barras de los N modelos del bag
+  se combinan en un solo 0-100)
+- avisa a on_progress(etapa, progreso) como mucho cada `min_interval`
+  segundos (los cambios de etapa se avisan siempre)
+- guarda la salida cruda como documentos de log para insertarlos en
+  Mongo de una sola vez al terminar (write_logs_batch)
+"""
+import re
+import time
+from datetime import datetime
+
+from logs.services import log_document
+
+# Etapas de Demucs (ProcesamientoAudio.etapa); el pipeline agrega
+# "guitarnet" y la vista "completado"
+ETAPA_CARGANDO = "demucs_cargando"
+ETAPA_SEPARANDO = "demucs_separando"
+ETAPA_GUARDANDO = "demucs_guardando"
+ETAPA_GUITARNET = "guitarnet"
+ETAPA_COMPLETADO = "completado"
+
+_RE_PERCENT = re.compile(r"^\s*(\d{1,3})%\|")
+_RE_BAG = re.compile(r"bag of (\d+) models")
+_RE_SPLIT = re.compile(r"[\r\n]")
+
+
+class DemucsProgressParser:
+    """
+    Args:
+        on_progress: función opcional on_progress(etapa, progreso) con
+                     progreso entero 0-100 (o None si la etapa no lo tiene)
+        min_interval: segundos mínimos entre avisos de la misma etapa
+        user: usuario de los documentos de log
+        event: evento de los documentos de log (el mismo que antes se
+               escribía por línea)
+        clock: reloj (inyectable en tests)
+    """
+
+    def __init__(self, on_progress=None, min_interval=2.0, user=None,
+                 event="Demucs progreso", clock=time.monotonic):
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self.user = user
+        self.event = event
+        self.clock = clock
+
+        self.etapa = ETAPA_CARGANDO
+        self.progreso = 0
+        self.models = 1          # barras por canción (modelos del bag)
+        self.bar = 0             # barra actual
+        self._last_percent = None
+        self._last_emit = None
+        self._emitted = None
+        self._partial = ""
+        self.docs = []
+        self._emit(force=True)
+
+    # -------------------------------------------------
+    # Entrada
+    # -------------------------------------------------
+    def feed(self, text):
+        """Procesa salida cruda; un fragmento sin terminador queda pendiente"""
+        parts = _RE_SPLIT.split(self._partial + text)
+        self._partial = parts.pop()
+        for line in parts:
+            self.feed_line(line)
+
+    def close(self):
+        """Procesa lo pendiente y avisa el último estado"""
+        if self._partial:
+            line, self._partial = self._partial, ""
+            self.feed_line(line)
+        self._emit(force=True)
+
+    def feed_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        self.docs.append(log_document(self.event, self.user, {"line": line}, datetime.utcnow()))
+
+        match = _RE_PERCENT.match(line)
+        if match:
+            self._update_bar(min(int(match.group(1)), 100))
+            return
+
+        bag = _RE_BAG.search(line)
+        if bag:
+            self.models = max(1, int(bag.group(1)))
+        elif line.startswith("Separating track"):
+            self._set_etapa(ETAPA_SEPARANDO, 0)
+        elif "completada" in line.lower():
+            self._set_etapa(ETAPA_GUARDANDO, 100)
+
+    # -------------------------------------------------
+    # Estado
+    # -------------------------------------------------
+    def _update_bar(self, percent):
+        # tqdm vuelve a 0% al empezar la barra del siguiente modelo del bag
+        if self._last_percent is not None and percent < self._last_percent:
+            self.bar = min(self.bar + 1, self.models - 1)
+        self._last_percent = percent
+
+        progreso = int((self.bar * 100 + percent) / self.models)
+        if self.etapa != ETAPA_SEPARANDO:
+            self._set_etapa(ETAPA_SEPARANDO, progreso)
+        else:
+            self.progreso = max(self.progreso, progreso)
+            if self.bar == self.models - 1 and percent == 100:
+                self._set_etapa(ETAPA_GUARDANDO, 100)
+            else:
+                self._emit()
+
+    def _set_etapa(self, etapa, progreso):
+        changed = etapa != self.etapa
+        self.etapa = etapa
+        self.progreso = progreso
+        self._emit(force=changed)
+
+    def _emit(self, force=False):
+        if self.on_progress is None:
+            return
+        state = (self.etapa, self.progreso)
+        if state == self._emitted:
+            return
+        now = self.clock()
+        if not force and self._last_emit is not None and now - self._last_emit < self.min_interval:
+            return
+        self._last_emit = now
+        self._emitted = state
+        self.on_progress(*state)
@@ -1,17 +1,297 @@
 # audios/demucs_service.py
+"""
+🧠 Demucs Service - Backends de separación en 4 stems
+Proyecto: Melody Unmix
+
+DEMUCS_BACKEND elige cómo se ejecuta Demucs:
+- "docker": `docker run --rm demucs:optimized` por canción (comportamiento
+  original; cada job paga crear el contenedor y cargar el modelo)
+- "worker": worker persistente con el modelo residente
+  (docker_demucs/demucs_worker.py, en el contenedor o local) al que se le
+  envían los jobs por un socket en DEMUCS_WORKER_ADDRESS
+- "local": el mismo separador del worker, dentro del proceso de Django
+  (un job a la vez). Con DEMUCS_MODEL="stub" no necesita Demucs.
+
+Los parámetros de rendimiento (segment, shifts, overlap, jobs, threads)
+salen de settings y se pueden pisar por job (ver demucs_options).
+"""
 import subprocess
+import json
 import os
+import socket
 import sys
-from logs.services import write_log 
+import threading
+from pathlib import Path
+from django.conf import settings
+from logs.services import write_log, write_logs_batch
+from .demucs_progress import DemucsProgressParser
+
+# docker_demucs/ no es un paquete: se importa como models/ en guitar_service
+DEMUCS_DIR = Path(settings.BASE_DIR) / "docker_demucs"
+if str(DEMUCS_DIR) not in sys.path:
+    sys.path.insert(0, str(DEMUCS_DIR))
+
+import demucs_worker
+
+DEMUCS_BACKENDS = ("docker", "worker", "local")
+
+# Parámetro de Demucs → setting del deployment
+DEMUCS_OPTION_SETTINGS = {
+    key: f"DEMUCS_{key.upper()}" for key in (*demucs_worker.DEMUCS_OPTIONS, demucs_worker.TWO_STEMS)
+}
+
+
+class DemucsCancelled(Exception):
+    pass
+
+
+# =====================================================
+# Backends
+# =====================================================
+class DockerDemucsBackend:
+    """Un contenedor `docker run --rm` por canción"""
+
+    model = demucs_worker.DEFAULT_MODEL
+
+    def run(self, nombre_archivo, input_dir, output_dir, on_line, check_cancelled=None, options=None):
+        # Parámetros como variables de entorno (los lee entrypoint.sh)
+        env = []
+        for key, value in (options or {}).items():
+            env += ["-e", f"{DEMUCS_OPTION_SETTINGS[key]}={value}"]
+
+        comando = [
+            "docker", "run", "--rm",
+            "-v", f"{input_dir}:/input",
+            "-v", f"{output_dir}:/output",
+            "-v", "demucs_cache:/cache",
+            *env,
+            "demucs:optimized",
+            nombre_archivo
+        ]
+
+        proceso = subprocess.Popen(
+            comando,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        try:
+            for linea in iter(proceso.stdout.readline, ''):
+                # CHEQUEO DE CANCELACIÓN
+                if check_cancelled and check_cancelled():
+                    print(f" Cancelando proceso demucs para {nombre_archivo}...")
+                    proceso.terminate()
+                    # Esperar un poco a que muera gracefullmente o kill
+                    try:
+                        proceso.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        proceso.kill()
+                    raise DemucsCancelled()
+
+                on_line(linea)
+
+            proceso.wait()
+        except Exception:
+            # Asegurar que si explota algo (o cancelamos), el proceso muera
+            if proceso.poll() is None:
+                proceso.terminate()
+            raise
+
+        if proceso.returncode != 0:
+            raise RuntimeError("Error al ejecutar Demucs (ver logs arriba o en Mongo)")
+
+        # Demucs crea /output/mdx_extra_q/<nombre_sin_ext>/
+        return os.path.join(output_dir, self.model, os.path.splitext(nombre_archivo)[0])
+
+
+class WorkerDemucsBackend:
+    """
+    Cliente del worker persistente (demucs_worker.py). Las rutas viajan
+    relativas a input_root / output_root, que deben ser las carpetas
+    montadas en el worker como --input-root / --output-root.
+    """
+
+    # Cada cuánto se revisa check_cancelled mientras el job está en cola
+    # o corriendo sin emitir líneas (s)
+    poll_interval = 1.0
+
+    def __init__(self, address, input_root, output_root, connect_timeout=5.0):
+        self.address = address
+        self.input_root = os.path.abspath(input_root)
+        self.output_root = os.path.abspath(output_root)
+        self.connect_timeout = connect_timeout
+
+    def _relative(self, path, root):
+        relative = os.path.relpath(os.path.abspath(path), root)
+        if relative == ".." or relative.startswith(".." + os.sep):
+            raise ValueError(f"{path} no está dentro de {root} (volumen del worker)")
+        return "" if relative == "." else relative
+
+    def ping(self):
+        with demucs_worker.connect(self.address, timeout=self.connect_timeout) as sock:
+            sock.sendall(b'{"op": "ping"}\n')
+            return json.loads(sock.makefile("rb").readline())
+
+    def run(self, nombre_archivo, input_dir, output_dir, on_line, check_cancelled=None, options=None):
+        request = {
+            "op": "separate",
+            "file": self._relative(os.path.join(input_dir, nombre_archivo), self.input_root),
+            "output": self._relative(output_dir, self.output_root),
+            "options": options or {},
+        }
+        try:
+            sock = demucs_worker.connect(self.address, timeout=self.connect_timeout)
+        except OSError as e:
+            raise RuntimeError(f"Worker de Demucs no disponible en {self.address}: {e}") from e
 
-def ejecutar_demucs(nombre_archivo, usuario=None, output_dir=None, check_cancelled=None):
+        with sock:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            sock.settimeout(self.poll_interval)
+            buffer = b""
+            while True:
+                if check_cancelled and check_cancelled():
+                    # Cerrar la conexión descarta el job en el worker
+                    print(f" Cancelando job de demucs para {nombre_archivo}...")
+                    raise DemucsCancelled()
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise RuntimeError("El worker de Demucs cerró la conexión")
+                buffer += chunk
+                while b"\n" in buffer:
+                    raw, buffer = buffer.split(b"\n", 1)
+                    event = json.loads(raw)
+                    if event["event"] == "line":
+                        on_line(event["line"] + "\n")
+                    elif event["event"] == "done":
+                        return os.path.join(self.output_root, event["path"])
+                    else:
+                        raise RuntimeError(f"Error en el worker de Demucs: {event.get('error')}")
+
+
+class LocalDemucsBackend:
+    """
+    Separador residente en este proceso; los jobs se ejecutan de a uno.
+    Ignora `threads`: los hilos de torch son globales y cambiarlos por job
+    afectaría a GuitarNet y al resto de Django (usar DEMUCS_THREADS en el
+    worker o en Docker).
+    """
+
+    def __init__(self, model=demucs_worker.DEFAULT_MODEL, device="cpu"):
+        self.separator = demucs_worker.load_separator(model, device=device)
+        self._lock = threading.Lock()
+
+    def run(self, nombre_archivo, input_dir, output_dir, on_line, check_cancelled=None, options=None):
+        stem = os.path.splitext(nombre_archivo)[0]
+        destino = Path(output_dir) / self.separator.name / stem
+        cancelled = check_cancelled or (lambda: False)
+        options = dict(options or {})
+        if options.pop("threads", None) is not None:
+            print("Demucs local: se ignora 'threads' (hilos de torch compartidos con Django)")
+        with self._lock:
+            if cancelled():
+                raise DemucsCancelled()
+            done = self.separator.separate(
+                Path(input_dir) / nombre_archivo, destino, lambda line: on_line(line + "\n"), cancelled,
+                options
+            )
+        if not done:
+            raise DemucsCancelled()
+        return str(destino)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_demucs_backend():
+    """Backend según DEMUCS_BACKEND (se crea una vez por proceso)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = getattr(settings, "DEMUCS_BACKEND", "docker")
+            if name not in DEMUCS_BACKENDS:
+                raise ValueError(f"DEMUCS_BACKEND inválido: {name!r} (opciones: {DEMUCS_BACKENDS})")
+            demucs_options()  # falla al arrancar si DEMUCS_SHIFTS, ... son inválidos
+            base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+            if name == "worker":
+                _backend = WorkerDemucsBackend(
+                    getattr(settings, "DEMUCS_WORKER_ADDRESS", "/tmp/demucs.sock"),
+                    input_root=os.path.join(base_path, "input_audio"),
+                    output_root=os.path.join(base_path, "output_audio"),
+                )
+            elif name == "local":
+                _backend = LocalDemucsBackend(
+                    model=getattr(settings, "DEMUCS_MODEL", demucs_worker.DEFAULT_MODEL),
+                    device=getattr(settings, "DEMUCS_DEVICE", "cpu"),
+                )
+            else:
+                _backend = DockerDemucsBackend()
+            print(f"Backend de Demucs: {name}")
+        return _backend
+
+
+def demucs_options(overrides=None):
+    """
+    Parámetros de Demucs del job: los de settings (DEMUCS_SEGMENT,
+    DEMUCS_SHIFTS, ...) con `overrides` encima (None = el de settings).
+
+    Returns:
+        dict validado sólo con los parámetros fijados (el resto queda en el
+        default de Demucs)
+
+    Raises:
+        ValueError: parámetro desconocido o fuera de rango
+    """
+    options = {key: getattr(settings, name, None) for key, name in DEMUCS_OPTION_SETTINGS.items()}
+    for key, value in (overrides or {}).items():
+        if key not in options:
+            raise ValueError(f"Parámetro de Demucs desconocido: {key!r} (opciones: {tuple(options)})")
+        if value is not None:
+            options[key] = value
+    return demucs_worker.validate_options(options)
+
+
+def preset_options(preset=None):
     """
-    Llama al contenedor Docker de Demucs y muestra progreso en tiempo real.
-    También guarda el log completo en 'demucs_logs.txt' y en MongoDB.
+    Overrides de Demucs del preset `preset` (DEMUCS_PRESETS) para
+    procesar_cancion(opciones_demucs=...). None o "" = sin preset.
+
+    Raises:
+        ValueError: preset desconocido o con parámetros inválidos
+    """
+    if not preset:
+        return None
+    presets = getattr(settings, "DEMUCS_PRESETS", {})
+    if preset not in presets:
+        raise ValueError(f"Preset de Demucs desconocido: {preset!r} (opciones: {tuple(presets)})")
+    return demucs_worker.validate_options(presets[preset])
+
+
+# =====================================================
+# Servicio
+# =====================================================
+def ejecutar_demucs(nombre_archivo, usuario=None, output_dir=None, check_cancelled=None, backend=None,
+                    on_progress=None, opciones=None):
+    """
+    Ejecuta Demucs con el backend configurado (DEMUCS_BACKEND) y muestra
+    progreso en tiempo real.
+    También guarda el log completo en 'demucs_logs.txt' y en MongoDB (en un
+    solo insert al terminar, no uno por línea de tqdm).
 
     - input_dir: compartido para todos (input_audio)
     - output_dir: puede ser único por usuario/audio para no pisar resultados.
     - check_cancelled: función que devuelve True si el proceso debe abortarse.
+    - backend: backend explícito (default: get_demucs_backend())
+    - on_progress: función on_progress(etapa, progreso) llamada como mucho
+      cada DEMUCS_PROGRESS_INTERVAL segundos (ver demucs_progress.py)
+    - opciones: parámetros de rendimiento de este job, validados con
+      demucs_options (None = los de settings)
+
+    Returns:
+        Carpeta con los stems: <output_dir>/<modelo>/<nombre_sin_ext>/
     """
     # Subir dos niveles: services/ -> audios/ -> MelodyUnmixApp/
     base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
@@ -24,67 +304,48 @@ def ejecutar_demucs(nombre_archivo, usuario=None, output_dir=None, check_cancell
     os.makedirs(input_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
 
-    comando = [
-        "docker", "run", "--rm",
-        "-v", f"{input_dir}:/input",
-        "-v", f"{output_dir}:/output",
-        "-v", "demucs_cache:/cache",
-        "demucs:optimized",
-        nombre_archivo
-    ]
-
-    print(f"Ejecutando Demucs para: {nombre_archivo}")
-
-    proceso = subprocess.Popen(
-        comando,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True
-    )
+    opciones = demucs_options() if opciones is None else demucs_worker.validate_options(opciones)
+    backend = backend or get_demucs_backend()
+    print(f"Ejecutando Demucs para: {nombre_archivo} {opciones or ''}")
 
     log_path = os.path.join(base_path, "logs", "demucs_logs.txt")
     os.makedirs(os.path.dirname(log_path), exist_ok=True)
 
-    write_log(event="Inicio de separación", user=usuario, extra={"archivo": nombre_archivo})
-    try:
-        with open(log_path, "a") as log:
-            log.write(f"\n\n===== Procesando {nombre_archivo} =====\n")
+    parser = DemucsProgressParser(
+        on_progress,
+        min_interval=getattr(settings, "DEMUCS_PROGRESS_INTERVAL", 2.0),
+        user=usuario,
+    )
 
-            for linea in iter(proceso.stdout.readline, ''):
-                # CHEQUEO DE CANCELACIÓN
-                if check_cancelled and check_cancelled():
-                    print(f" Cancelando proceso demucs para {nombre_archivo}...")
-                    proceso.terminate()
-                    # Esperar un poco a que muera gracefullmente o kill
-                    try:
-                        proceso.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        proceso.kill()
-                    
-                    write_log(event="Separación cancelada", user=usuario, extra={"archivo": nombre_archivo})
-                    raise Exception("CANCELLED_BY_USER")
+    write_log(event="Inicio de separación", user=usuario, extra={"archivo": nombre_archivo, "opciones": opciones})
+    with open(log_path, "a") as log:
+        log.write(f"\n\n===== Procesando {nombre_archivo} =====\n")
 
-                sys.stdout.write(linea)
-                sys.stdout.flush()
+        def on_line(linea):
+            sys.stdout.write(linea)
+            sys.stdout.flush()
 
-                log.write(linea)
-                log.flush()
+            log.write(linea)
+            log.flush()
 
-                write_log(event="Demucs progreso", user=usuario, extra={"line": linea.strip()})
-        
-        proceso.wait()
-    except Exception as e:
-        # Asegurar que si explota algo (o cancelamos), el proceso muera
-        if proceso.poll() is None:
-            proceso.terminate()
-        raise e
+            parser.feed(linea)
 
-    if proceso.returncode != 0:
-        write_log(event="Error en separación", user=usuario, extra={"archivo": nombre_archivo})
-        raise Exception("Error al ejecutar Demucs (ver logs arriba o en Mongo)")
+        try:
+            ruta = backend.run(nombre_archivo, input_dir, output_dir, on_line, check_cancelled, opciones)
+        except DemucsCancelled:
+            write_log(event="Separación cancelada", user=usuario, extra={"archivo": nombre_archivo})
+            raise Exception("CANCELLED_BY_USER")
+        except Exception:
+            write_log(event="Error en separación", user=usuario, extra={"archivo": nombre_archivo})
+            raise
+        finally:
+            parser.close()
+            try:
+                write_logs_batch(parser.docs)
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar el log de Demucs en MongoDB: {e}")
 
     print("Demucs completado.")
     write_log(event="Separación completada", user=usuario, extra={"archivo": nombre_archivo})
 
-    # Demucs crea /output/mdx_extra_q/<nombre_sin_ext>/
-    return os.path.join(output_dir, "mdx_extra_q", os.path.splitext(nombre_archivo)[0])
+    return ruta
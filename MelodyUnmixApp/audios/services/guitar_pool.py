@@ -0,0 +1,277 @@
+"""
+🧵 GuitarNet Process Pool - Inferencia aislada en procesos worker
+Proyecto: Melody Unmix
+
+Modo GUITARNET_EXECUTION="process" de guitar_service: la separación corre
+en un ProcessPoolExecutor en lugar de en el hilo del job dentro del proceso
+de Django, así no compite por el GIL con las requests y un crash u OOM de
+inferencia no tira abajo el worker web.
+
+- Cada proceso worker carga GuitarSeparator una sola vez (initializer).
+- El audio de entrada y los stems de salida viajan por shared_memory (el
+  padre lee el WAV directo al bloque compartido); por la cola del pool
+  sólo pasan nombres, shapes y estadísticas.
+- Los workers se reciclan cada GUITARNET_POOL_MAX_TASKS jobs
+  (max_tasks_per_child) para acotar fragmentación de memoria.
+- Cancelación: un flag de 1 byte en memoria compartida que el padre
+  enciende y el worker consulta entre lotes de chunks.
+
+Este módulo se importa también en los procesos worker (contexto spawn),
+que no inicializan Django: las funciones del worker no deben tocar
+settings ni importar guitar_service.
+"""
+import math
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import soundfile as sf
+
+# Cada cuánto el padre revisa `cancelled` mientras espera al worker (s)
+CANCEL_POLL_INTERVAL = 0.5
+
+# =====================================================
+# Lado worker
+# =====================================================
+_worker_separator = None
+
+
+def _open_cancel_flag(name):
+    """(flag, cancelled) sobre el flag compartido `name` (None, None si no hay)"""
+    if name is None:
+        return None, None
+    flag = shared_memory.SharedMemory(name=name)
+    return flag, lambda: flag.buf[0] != 0
+
+
+def _init_worker(models_dir, model_path, separator_kwargs):
+    """Initializer del pool: carga el modelo una vez por proceso"""
+    global _worker_separator
+    if models_dir not in sys.path:
+        sys.path.insert(0, models_dir)
+    from guitarnet_inference import GuitarSeparator
+
+    _worker_separator = GuitarSeparator(model_path, **separator_kwargs)
+    print(f"Worker GuitarNet listo (pid {os.getpid()})")
+
+
+def _worker_separate(in_name, in_shape, sr, out_name, out_shape, chunk_duration, max_batch=None,
+                     quality=None, mask_path=None, cancel_name=None):
+    """
+    Separa el audio [N, C] del bloque `in_name` y escribe guitar/others en
+    el bloque `out_name` [2, C, N'] (y la máscara cruda en `mask_path`).
+    Si el flag `cancel_name` se enciende se lanza SeparationCancelled.
+    """
+    import torch
+
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    flag, cancelled = _open_cancel_flag(cancel_name)
+    try:
+        audio = np.ndarray(in_shape, dtype=np.float32, buffer=shm_in.buf)
+        out = np.ndarray(out_shape, dtype=np.float32, buffer=shm_out.buf)
+
+        from guitarnet_inference import StageProfiler
+
+        stats = {}
+        profiler = StageProfiler()
+        guitar, others, _ = _worker_separator.separate_array(
+            torch.from_numpy(audio).T, sr, chunk_duration, stats=stats, profiler=profiler,
+            max_batch=max_batch, quality=quality, mask_path=mask_path, cancelled=cancelled
+        )
+        out[0] = guitar.numpy()
+        out[1] = others.numpy()
+        del audio, out
+        stats["stages"] = profiler.as_dict()
+        return stats
+    finally:
+        shm_in.close()
+        shm_out.close()
+        if flag is not None:
+            flag.close()
+
+
+def _worker_separate_stream(input_path, output_dir, chunk_duration, max_batch=None, quality=None,
+                            cancel_name=None):
+    """Grabaciones largas: separate_stream de archivo a archivo"""
+    from guitarnet_inference import StageProfiler
+
+    stats = {}
+    flag, cancelled = _open_cancel_flag(cancel_name)
+    try:
+        guitar_path, others_path = _worker_separator.separate_stream(
+            input_path, output_dir, chunk_duration=chunk_duration, stats=stats,
+            profiler=StageProfiler(), max_batch=max_batch, quality=quality, cancelled=cancelled
+        )
+    finally:
+        if flag is not None:
+            flag.close()
+    return str(guitar_path), str(others_path), stats
+
+
+# =====================================================
+# Lado padre (Django)
+# =====================================================
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_guitar_pool(models_dir, model_path, separator_kwargs, workers, max_tasks_per_child):
+    """
+    Devuelve el ProcessPoolExecutor global (se crea al primer llamado).
+    Usa contexto spawn: max_tasks_per_child no admite fork y así los
+    workers no heredan el estado de Django ni de torch del padre.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            print(f"Iniciando pool GuitarNet: {workers} procesos, "
+                  f"reciclado cada {max_tasks_per_child} jobs")
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(str(models_dir), str(model_path), separator_kwargs),
+                max_tasks_per_child=max_tasks_per_child,
+            )
+        return _pool
+
+
+def shutdown_guitar_pool(wait=True):
+    """Cierra el pool global (p.ej. al apagar el proceso o en tests)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+            _pool = None
+
+
+class _CancelFlag:
+    """Flag de 1 byte en memoria compartida (lo lee _open_cancel_flag en el worker)"""
+
+    def __init__(self):
+        self.shm = shared_memory.SharedMemory(create=True, size=1)
+        self.shm.buf[0] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def set(self):
+        self.shm.buf[0] = 1
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _submit(pool, fn, *args, cancelled=None, flag=None):
+    """
+    Ejecuta en el pool; si un worker murió (OOM, segfault) descarta el pool.
+    Con `cancelled` se revisa cada CANCEL_POLL_INTERVAL: un job todavía en
+    cola se descarta y uno en curso recibe el aviso por `flag`.
+    """
+    global _pool
+    try:
+        future = pool.submit(fn, *args)
+        while True:
+            try:
+                return future.result(timeout=None if cancelled is None else CANCEL_POLL_INTERVAL)
+            except FutureTimeout:
+                if cancelled():
+                    if future.cancel():
+                        from guitarnet_inference import SeparationCancelled
+                        raise SeparationCancelled("Separación cancelada antes de empezar")
+                    flag.set()
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise RuntimeError("Un worker de GuitarNet terminó inesperadamente (¿OOM?)")
+
+
+def resampled_length(num_samples, sr, target_sr):
+    """Largo de salida de torchaudio.functional.resample"""
+    if sr == target_sr:
+        return num_samples
+    g = math.gcd(sr, target_sr)
+    return math.ceil((target_sr // g) * num_samples / (sr // g))
+
+
+def separate_in_pool(pool, input_path, guitar_path, others_path, target_sr,
+                     chunk_duration=None, stats=None, profiler=None, max_batch=None,
+                     quality=None, mask_path=None, cancelled=None):
+    """
+    Separa `input_path` en un worker y escribe los stems (atómicamente)
+    en guitar_path / others_path.
+    
+    Las etapas del worker vuelven en stats["stages"]; `profiler` (del
+    padre) mide sólo la lectura al bloque compartido y la escritura.
+    chunk_duration / max_batch None: el worker decide según la memoria.
+    mask_path: el worker guarda ahí la máscara cruda (ver save_mask).
+    cancelled: función del padre; al devolver True el worker se detiene
+    antes del siguiente lote de chunks (SeparationCancelled).
+    """
+    from guitarnet_inference import profile_stage, write_wav_atomic
+    import torch
+
+    info = sf.info(input_path)
+    in_shape = (info.frames, info.channels)
+    out_shape = (2, info.channels, resampled_length(info.frames, info.samplerate, target_sr))
+
+    shm_in = shared_memory.SharedMemory(create=True, size=max(1, 4 * math.prod(in_shape)))
+    shm_out = shared_memory.SharedMemory(create=True, size=max(1, 4 * math.prod(out_shape)))
+    flag = _CancelFlag() if cancelled is not None else None
+    try:
+        # Leer el WAV directo al bloque compartido (sin copia intermedia)
+        audio = np.ndarray(in_shape, dtype=np.float32, buffer=shm_in.buf)
+        with profile_stage(profiler, "decode"), sf.SoundFile(input_path) as src:
+            src.read(out=audio, dtype="float32", always_2d=True)
+        del audio
+
+        worker_stats = _submit(
+            pool, _worker_separate,
+            shm_in.name, in_shape, info.samplerate, shm_out.name, out_shape, chunk_duration,
+            max_batch, quality, None if mask_path is None else str(mask_path),
+            None if flag is None else flag.name,
+            cancelled=cancelled, flag=flag
+        )
+        if stats is not None:
+            stats.update(worker_stats)
+
+        out = np.ndarray(out_shape, dtype=np.float32, buffer=shm_out.buf)
+        with profile_stage(profiler, "save"):
+            write_wav_atomic(guitar_path, torch.from_numpy(out[0]), target_sr)
+            write_wav_atomic(others_path, torch.from_numpy(out[1]), target_sr)
+        del out
+    finally:
+        for shm in (shm_in, shm_out):
+            shm.close()
+            shm.unlink()
+        if flag is not None:
+            flag.close()
+
+    return str(guitar_path), str(others_path)
+
+
+def separate_stream_in_pool(pool, input_path, output_dir, chunk_duration=None, stats=None,
+                            max_batch=None, quality=None, cancelled=None):
+    """separate_stream en un worker; sólo viajan rutas (y el flag de cancelación)"""
+    flag = _CancelFlag() if cancelled is not None else None
+    try:
+        guitar_path, others_path, worker_stats = _submit(
+            pool, _worker_separate_stream, str(input_path), str(output_dir), chunk_duration,
+            max_batch, quality, None if flag is None else flag.name,
+            cancelled=cancelled, flag=flag
+        )
+    finally:
+        if flag is not None:
+            flag.close()
+    if stats is not None:
+        stats.update(worker_stats)
+    return guitar_path, others_path
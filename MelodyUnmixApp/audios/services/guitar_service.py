@@ -4,7 +4,13 @@ Proyecto: Melody Unmix
 """
 import os
 import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
+import soundfile as sf
+import torch
 from django.conf import settings
 
 # Agregar la carpeta 'models' al path para importar guitarnet_inference
@@ -12,13 +18,50 @@ MODELS_DIR = Path(settings.BASE_DIR) / "models"
 if str(MODELS_DIR) not in sys.path:
     sys.path.insert(0, str(MODELS_DIR))
 
-from guitarnet_inference import GuitarSeparator
+from guitarnet_inference import (
+    MASK_FILE,
+    TARGET_SR,
+    QUALITIES,
+    GuitarSeparator,
+    MaskRenderer,
+    SeparationCancelled,
+    StageProfiler,
+    enhance_params,
+    plan_chunking,
+    profile_stage,
+    write_wav_atomic,
+)
+
+from . import guitar_pool
 
 # =====================================================
 # Singleton global para el modelo
 # =====================================================
 _guitar_separator = None
 
+# Re-render desde máscaras guardadas: no necesita el modelo (ver rerender_guitar).
+# Un lock por máscara: dos re-renders del mismo audio no se pisan los stems
+_mask_renderer = None
+_rerender_locks = {}
+_rerender_locks_lock = threading.Lock()
+
+# Separaciones de GuitarNet en curso en este proceso; las de todos los
+# procesos se cuentan en GUITARNET_JOBS_DIR (ver running_guitarnet_jobs)
+_active_jobs = 0
+_active_jobs_lock = threading.Lock()
+
+# Bloque + contexto a cada lado que separate_stream tiene en memoria (s)
+STREAM_SEGMENT_SECONDS = 30 + 2 * 2.0
+
+# Estado de precarga / warm-up de este proceso (ver GuitarNetReadyView)
+guitarnet_status = {
+    "loaded": False,
+    "warmed_up": False,
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "pid": None,
+}
+
 
 def get_guitar_separator():
     """
@@ -30,24 +73,312 @@ def get_guitar_separator():
     """
     global _guitar_separator
     if _guitar_separator is None:
-        model_path = MODELS_DIR / "guitarnet_model.pth"
-        if not model_path.exists():
+        model_path = model_file()
+        backend = getattr(settings, "GUITARNET_BACKEND", "torch")
+        if backend == "remote":
+            # Cliente liviano: el modelo vive en el servidor de inferencia
+            print(f"Usando servidor GuitarNet: {getattr(settings, 'GUITARNET_SERVER_SOCKET', None)}")
+        elif not model_path.exists():
             raise FileNotFoundError(f"Modelo no encontrado: {model_path}")
-        
-        print(f"Cargando modelo GuitarNet desde: {model_path}")
-        _guitar_separator = GuitarSeparator(str(model_path))
+        else:
+            print(f"Cargando modelo GuitarNet desde: {model_path}")
+        t0 = time.perf_counter()
+        _guitar_separator = GuitarSeparator(str(model_path), **separator_kwargs())
+        guitarnet_status.update(
+            loaded=True, load_seconds=round(time.perf_counter() - t0, 3), pid=os.getpid()
+        )
         print("GuitarNet cargado exitosamente")
     
     return _guitar_separator
 
 
-def separate_guitar(input_others_path: str, output_dir: str) -> tuple:
+def warmup_guitar_separator() -> float:
+    """
+    Forwards de prueba en este proceso (GUITARNET_WARMUP_CHUNKS). Con
+    gunicorn se llama en post_fork: el modelo se carga en el master y cada
+    worker calienta sus propios kernels / allocator.
+    """
+    separator = get_guitar_separator()
+    seconds = 0.0
+    if getattr(settings, "GUITARNET_WARMUP", True):
+        seconds = separator.warmup(
+            chunk_durations=getattr(settings, "GUITARNET_WARMUP_CHUNKS", (30,)),
+            batch_sizes=getattr(settings, "GUITARNET_WARMUP_BATCHES", (1,)),
+        )
+    guitarnet_status.update(warmed_up=True, warmup_seconds=round(seconds, 3), pid=os.getpid())
+    return seconds
+
+
+def preload_guitar_separator(warmup=True) -> bool:
+    """
+    Precarga el modelo en este proceso (y opcionalmente el warm-up).
+    En los modos "process" (cada worker del pool carga el suyo) y
+    "remote" (el modelo vive en el servidor) no hay nada que precargar.
+    
+    Returns:
+        True si se precargó el modelo
+    """
+    if use_process_pool() or getattr(settings, "GUITARNET_BACKEND", "torch") == "remote":
+        guitarnet_status.update(loaded=True, warmed_up=True, pid=os.getpid())
+        return False
+    get_guitar_separator()
+    if warmup:
+        warmup_guitar_separator()
+    return True
+
+
+def guitarnet_ready() -> bool:
+    return guitarnet_status["loaded"] and guitarnet_status["warmed_up"]
+
+
+def model_file() -> Path:
+    """Pesos de GuitarNet en models/ (GUITARNET_MODEL_FILE)"""
+    return MODELS_DIR / getattr(settings, "GUITARNET_MODEL_FILE", "guitarnet_model.pth")
+
+
+def separator_kwargs(num_threads=None) -> dict:
+    """Opciones de GuitarSeparator según settings (hilo local o workers del pool)"""
+    return {
+        "max_batch": getattr(settings, "GUITARNET_MAX_BATCH", 4),
+        "optimize": getattr(settings, "GUITARNET_OPTIMIZE", False),
+        "precision": getattr(settings, "GUITARNET_PRECISION", "fp32"),
+        "backend": getattr(settings, "GUITARNET_BACKEND", "torch"),
+        "num_threads": num_threads or getattr(settings, "GUITARNET_THREADS", None),
+        "silence_threshold_db": getattr(settings, "GUITARNET_SILENCE_DB", -70.0),
+        "stitch": getattr(settings, "GUITARNET_STITCH", "hann"),
+        "context_frames": getattr(settings, "GUITARNET_CONTEXT_FRAMES", 128),
+        "server_address": getattr(settings, "GUITARNET_SERVER_SOCKET", None),
+        "fast_time_factor": getattr(settings, "GUITARNET_FAST_TIME_FACTOR", 2),
+        "fast_cutoff_hz": getattr(settings, "GUITARNET_FAST_CUTOFF_HZ", 11025.0) or None,
+    }
+
+
+def guitar_quality(quality=None) -> str:
+    """Calidad del job ("full" | "fast"); por defecto GUITARNET_QUALITY"""
+    quality = quality or getattr(settings, "GUITARNET_QUALITY", "full")
+    if quality not in QUALITIES:
+        raise ValueError(f"Calidad de GuitarNet inválida: {quality!r} (opciones: {QUALITIES})")
+    return quality
+
+
+# =====================================================
+# Tamaño de chunk según memoria y carga
+# =====================================================
+def _jobs_dir():
+    """Carpeta de marcas de jobs compartida entre procesos (None = sin compartir)"""
+    path = getattr(settings, "GUITARNET_JOBS_DIR", "")
+    if not path:
+        return None
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        print(f"GUITARNET_JOBS_DIR no disponible ({e}): se cuentan sólo los jobs de este proceso")
+        return None
+    return path
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _guitarnet_job():
+    """
+    Cuenta la separación como job en curso mientras dura: en este proceso
+    y con un archivo <pid>-<id> en GUITARNET_JOBS_DIR para los demás
+    workers de gunicorn.
+    """
+    global _active_jobs
+    with _active_jobs_lock:
+        _active_jobs += 1
+    marker = None
+    jobs_dir = _jobs_dir()
+    if jobs_dir:
+        marker = os.path.join(jobs_dir, f"{os.getpid()}-{uuid.uuid4().hex}")
+        try:
+            open(marker, "w").close()
+        except OSError:
+            marker = None
+    try:
+        yield
+    finally:
+        if marker:
+            try:
+                os.remove(marker)
+            except OSError:
+                pass
+        with _active_jobs_lock:
+            _active_jobs -= 1
+
+
+def active_guitarnet_jobs() -> int:
+    """Jobs de GuitarNet en curso en este proceso"""
+    return _active_jobs
+
+
+def running_guitarnet_jobs() -> tuple:
+    """
+    Jobs de GuitarNet en curso en todos los procesos que comparten
+    GUITARNET_JOBS_DIR; las marcas de procesos que ya no existen (p.ej. un
+    worker reciclado o muerto por OOM) se borran.
+    
+    Returns:
+        (jobs, fuente): fuente "procesos" (GUITARNET_JOBS_DIR) o "proceso"
+        (sólo este proceso, si la carpeta no está configurada / disponible)
+    """
+    jobs_dir = _jobs_dir()
+    if not jobs_dir:
+        return _active_jobs, "proceso"
+    try:
+        names = os.listdir(jobs_dir)
+    except OSError:
+        return _active_jobs, "proceso"
+    count = 0
+    for name in names:
+        try:
+            pid = int(name.split("-", 1)[0])
+        except ValueError:
+            continue
+        if _pid_alive(pid):
+            count += 1
+        else:
+            try:
+                os.remove(os.path.join(jobs_dir, name))
+            except OSError:
+                pass
+    # Nunca menos que los de este proceso (p.ej. si no se pudo crear la marca)
+    return max(count, _active_jobs), "procesos"
+
+
+def plan_guitar_chunking(input_path) -> dict:
+    """
+    Decide cómo separar `input_path` con la memoria disponible ahora
+    (MemAvailable / límite del cgroup, ver plan_chunking) repartida entre
+    los jobs de GuitarNet en curso en todos los workers (ver
+    running_guitarnet_jobs) más éste.
+    
+    - chunk_duration / max_batch: mayor chunk y lote que entran en el
+      presupuesto del job (GUITARNET_CHUNK_DURATION > 0 fija la duración)
+    - stream: separar por bloques con separate_stream; además de las
+      grabaciones largas, se usa cuando la pista completa no entra en
+      memoria (en lugar de arriesgar un OOM kill)
+    
+    Returns:
+        dict con la decisión y los datos usados (para write_log / métricas)
+    """
+    info = sf.info(input_path)
+    num_samples = guitar_pool.resampled_length(info.frames, info.samplerate, TARGET_SR)
+    running, jobs_source = running_guitarnet_jobs()
+    jobs = running + 1
+    max_batch = getattr(settings, "GUITARNET_MAX_BATCH", 4)
+    memory_fraction = getattr(settings, "GUITARNET_MEMORY_FRACTION", 0.8)
+    
+    stream = _is_long_recording(input_path)
+    plan = None
+    if not stream:
+        plan = plan_chunking(num_samples, info.channels, jobs=jobs, max_batch=max_batch,
+                             memory_fraction=memory_fraction)
+        stream = not plan["fits"]
+    if stream:
+        plan = plan_chunking(int(STREAM_SEGMENT_SECONDS * TARGET_SR), info.channels, jobs=jobs,
+                             max_batch=max_batch, memory_fraction=memory_fraction)
+    
+    fixed = getattr(settings, "GUITARNET_CHUNK_DURATION", 0)
+    if fixed:
+        plan["chunk_duration"] = fixed
+    plan["stream"] = stream
+    plan["duration_s"] = round(info.duration, 2)
+    plan["jobs_source"] = jobs_source
+    print(f"GuitarNet: chunks de {plan['chunk_duration']}s × {plan['max_batch']}, "
+          f"{'streaming' if stream else 'en memoria'} "
+          f"(disponible {plan['available_mb']} MB, {jobs} job(s) en {jobs_source})")
+    return plan
+
+
+# =====================================================
+# Modo process pool (GUITARNET_EXECUTION="process")
+# =====================================================
+def use_process_pool() -> bool:
+    return getattr(settings, "GUITARNET_EXECUTION", "thread") == "process"
+
+
+def get_pool():
+    """
+    Pool de procesos con el modelo precargado en cada worker (ver
+    guitar_pool). Sin GUITARNET_POOL_WORKERS se usan todos los cores:
+    cpu_count // hilos por worker (GUITARNET_THREADS, default 1).
+    """
+    threads = getattr(settings, "GUITARNET_THREADS", None) or 1
+    workers = getattr(settings, "GUITARNET_POOL_WORKERS", 0) or max(1, (os.cpu_count() or 1) // threads)
+    return guitar_pool.get_guitar_pool(
+        MODELS_DIR,
+        model_file(),
+        separator_kwargs(num_threads=threads),
+        workers=workers,
+        max_tasks_per_child=getattr(settings, "GUITARNET_POOL_MAX_TASKS", 20),
+    )
+
+
+def _is_long_recording(input_path) -> bool:
+    """Grabaciones largas: streaming por bloques para no cargar la pista completa"""
+    stream_min = getattr(settings, "GUITARNET_STREAM_MIN_DURATION", 600)
+    return bool(stream_min) and sf.info(input_path).duration >= stream_min
+
+
+def _separate_stream(input_path, output_dir, plan, stats=None, profiler=None, quality=None,
+                     cancelled=None):
+    if use_process_pool():
+        return guitar_pool.separate_stream_in_pool(
+            get_pool(), input_path, output_dir, chunk_duration=plan["chunk_duration"],
+            stats=stats, max_batch=plan["max_batch"], quality=quality, cancelled=cancelled
+        )
+    return get_guitar_separator().separate_stream(
+        input_path, output_dir, chunk_duration=plan["chunk_duration"], stats=stats,
+        profiler=profiler, max_batch=plan["max_batch"], quality=quality, cancelled=cancelled
+    )
+
+
+def _store_stages(stats, profiler):
+    """
+    Deja en stats["stages"] los tiempos por etapa. En modo process las
+    etapas de inferencia vienen del worker y se les suman las del padre
+    (lectura al bloque compartido y escritura).
+    """
+    if stats is None:
+        return
+    stages = dict(stats.get("stages") or {})
+    stages.update(profiler.as_dict())
+    stats["stages"] = stages
+
+
+def separate_guitar(input_others_path: str, output_dir: str, stats: dict = None,
+                    plan: dict = None, quality: str = None, mask_path: str = None,
+                    cancelled=None) -> tuple:
     """
     Separa guitarra del stem 'others'.
     
     Args:
         input_others_path: Ruta al archivo others.wav de Demucs
         output_dir: Directorio donde guardar guitar.wav y others.wav
+        stats: Dict opcional que se llena con estadísticas de la inferencia
+               (chunks_total, chunks_skipped, model_skipped), los tiempos
+               por etapa en stats["stages"] (ver StageProfiler) y la
+               decisión de chunking en stats["chunking"]
+        plan: resultado de plan_guitar_chunking (se calcula si es None)
+        quality: "full" | "fast" (None = GUITARNET_QUALITY); "fast" corre el
+                 modelo a resolución reducida (previews, ~4x menos cómputo)
+        mask_path: si se da, se guarda ahí la máscara cruda del modelo para
+                   re-renderizar después sin inferencia (ver rerender_guitar).
+                   En streaming no se guarda.
+        cancelled: función barata (p.ej. un CancelToken) que se consulta
+                   entre lotes de chunks; si devuelve True se lanza
+                   SeparationCancelled
     
     Returns:
         Tuple con rutas (guitar_path, others_clean_path)
@@ -59,7 +390,176 @@ def separate_guitar(input_others_path: str, output_dir: str) -> tuple:
     if not os.path.exists(input_others_path):
         raise FileNotFoundError(f"Archivo de entrada no encontrado: {input_others_path}")
     
-    separator = get_guitar_separator()
-    guitar_path, others_path = separator.separate(input_others_path, output_dir)
+    quality = guitar_quality(quality)
+    plan = plan or plan_guitar_chunking(input_others_path)
+    if stats is not None:
+        stats["chunking"] = plan
+        stats["quality"] = quality
+    
+    with _guitarnet_job():
+        profiler = StageProfiler()
+        if plan["stream"]:
+            guitar_path, others_path = _separate_stream(
+                input_others_path, output_dir, plan, stats=stats, profiler=profiler,
+                quality=quality, cancelled=cancelled
+            )
+        elif use_process_pool():
+            os.makedirs(output_dir, exist_ok=True)
+            guitar_path, others_path = guitar_pool.separate_in_pool(
+                get_pool(), input_others_path,
+                os.path.join(output_dir, "guitar.wav"), os.path.join(output_dir, "others.wav"),
+                TARGET_SR, chunk_duration=plan["chunk_duration"], stats=stats,
+                profiler=profiler, max_batch=plan["max_batch"], quality=quality,
+                mask_path=mask_path, cancelled=cancelled
+            )
+        else:
+            separator = get_guitar_separator()
+            guitar_path, others_path = separator.separate(
+                input_others_path, output_dir, chunk_duration=plan["chunk_duration"],
+                stats=stats, profiler=profiler, max_batch=plan["max_batch"], quality=quality,
+                mask_path=mask_path, cancelled=cancelled
+            )
+        _store_stages(stats, profiler)
     
     return str(guitar_path), str(others_path)
+
+
+def separate_guitar_in_place(input_others_path: str, guitar_path: str, others_path: str,
+                             stats: dict = None, plan: dict = None, quality: str = None,
+                             mask_path: str = None, cancelled=None) -> tuple:
+    """
+    Separa guitarra y escribe cada stem UNA sola vez, directo en su ruta final.
+    
+    El audio se separa en memoria (GuitarSeparator.separate_array) y cada
+    stem se guarda de forma atómica (.tmp.wav + os.replace), así que
+    `others_path` puede ser el mismo `input_others_path` (el other.wav de
+    Demucs se reemplaza sólo si la separación terminó bien). Las grabaciones
+    largas (o que no entran en memoria, ver plan_guitar_chunking) usan
+    separate_stream en la carpeta de destino y se renombran.
+    
+    Args:
+        input_others_path: Ruta al archivo other.wav de Demucs
+        guitar_path: Ruta final de guitar.wav
+        others_path: Ruta final de others sin guitarra
+        stats: Dict opcional (ver separate_guitar)
+        plan: resultado de plan_guitar_chunking (se calcula si es None)
+        quality: "full" | "fast" (ver separate_guitar)
+        mask_path: máscara cruda para rerender_guitar (ver separate_guitar)
+        cancelled: ver separate_guitar (al cancelar no se toca others_path)
+    
+    Returns:
+        Tuple con rutas (guitar_path, others_path)
+    """
+    if not os.path.exists(input_others_path):
+        raise FileNotFoundError(f"Archivo de entrada no encontrado: {input_others_path}")
+    
+    quality = guitar_quality(quality)
+    plan = plan or plan_guitar_chunking(input_others_path)
+    if stats is not None:
+        stats["chunking"] = plan
+        stats["quality"] = quality
+    
+    with _guitarnet_job():
+        profiler = StageProfiler()
+        if plan["stream"]:
+            stream_guitar, stream_others = _separate_stream(
+                input_others_path, os.path.dirname(guitar_path), plan, stats=stats,
+                profiler=profiler, quality=quality, cancelled=cancelled
+            )
+            if str(stream_guitar) != str(guitar_path):
+                os.replace(stream_guitar, guitar_path)
+            if str(stream_others) != str(others_path):
+                os.replace(stream_others, others_path)
+            _store_stages(stats, profiler)
+            return str(guitar_path), str(others_path)
+        
+        if use_process_pool():
+            paths = guitar_pool.separate_in_pool(
+                get_pool(), input_others_path, guitar_path, others_path, TARGET_SR,
+                chunk_duration=plan["chunk_duration"], stats=stats, profiler=profiler,
+                max_batch=plan["max_batch"], quality=quality, mask_path=mask_path,
+                cancelled=cancelled
+            )
+            _store_stages(stats, profiler)
+            return paths
+        
+        separator = get_guitar_separator()
+        with profile_stage(profiler, "decode"):
+            data, sr = sf.read(input_others_path, dtype="float32", always_2d=True)
+            waveform = torch.from_numpy(data.T.copy())
+            del data
+        
+        guitar_audio, others_audio, sr = separator.separate_array(
+            waveform, sr, plan["chunk_duration"], stats=stats, profiler=profiler,
+            max_batch=plan["max_batch"], quality=quality, mask_path=mask_path,
+            cancelled=cancelled
+        )
+        with profile_stage(profiler, "save"):
+            write_wav_atomic(guitar_path, guitar_audio, sr)
+            write_wav_atomic(others_path, others_audio, sr)
+        _store_stages(stats, profiler)
+    
+    return str(guitar_path), str(others_path)
+
+
+# =====================================================
+# Re-render desde la máscara guardada
+# =====================================================
+def get_mask_renderer():
+    """MaskRenderer único del proceso (sin pesos, se crea al primer llamado)"""
+    global _mask_renderer
+    if _mask_renderer is None:
+        _mask_renderer = MaskRenderer()
+    return _mask_renderer
+
+
+def _rerender_lock(mask_path):
+    with _rerender_locks_lock:
+        return _rerender_locks.setdefault(os.path.abspath(mask_path), threading.Lock())
+
+
+def mask_file(stems_dir) -> str:
+    """Ruta de la máscara cruda junto a los stems (MASK_FILE)"""
+    return os.path.join(stems_dir, MASK_FILE)
+
+
+def others_file(stems_dir) -> str:
+    """
+    Ruta de other.wav junto a los stems: GuitarNet lo reescribe aunque
+    "other" no se haya pedido (ver pipeline.procesar_cancion)
+    """
+    return os.path.join(stems_dir, "other.wav")
+
+
+def rerender_guitar(guitar_path: str, others_path: str, mask_path: str,
+                    gamma: float = None, high_start_ratio: float = None,
+                    high_boost_db: float = None) -> dict:
+    """
+    Reescribe guitar / others aplicando otros parámetros de
+    enhance_guitar_mask a la máscara guardada en la separación, sin correr
+    GuitarNet (STFT + iSTFT de la pista: segundos en CPU).
+    
+    Args:
+        gamma, high_start_ratio, high_boost_db: None = default
+                                                (ver enhance_params)
+    
+    Returns:
+        Dict con los parámetros aplicados (enhance), las ganancias de
+        normalización y los tiempos por etapa (stages)
+    
+    Raises:
+        FileNotFoundError: Si falta la máscara o algún stem
+        ValueError: Si los parámetros están fuera de rango
+    """
+    enhance = enhance_params(gamma, high_start_ratio, high_boost_db)
+    for path in (guitar_path, others_path, mask_path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Archivo no encontrado: {path}")
+    
+    profiler = StageProfiler()
+    with _rerender_lock(mask_path):
+        result = get_mask_renderer().rerender(
+            guitar_path, others_path, mask_path, enhance=enhance, profiler=profiler
+        )
+    result["stages"] = profiler.as_dict()
+    return result
@@ -4,32 +4,106 @@ Proyecto: Melody Unmix
 """
 import os
 import shutil
+import time
 from pathlib import Path
-from .demucs_service import ejecutar_demucs
-from .guitar_service import separate_guitar
+from django.conf import settings
+from .demucs_service import demucs_options, ejecutar_demucs
+from .demucs_progress import ETAPA_GUITARNET
+from .guitar_service import (
+    SeparationCancelled,
+    mask_file,
+    plan_guitar_chunking,
+    separate_guitar,
+    separate_guitar_in_place,
+)
 from logs.services import write_log
 
+# Stems que se pueden pedir ("other" es el others sin guitarra si también se
+# pidió guitar). "instrumental" (no_vocals) sólo junto a vocals: esos dos
+# salen de Demucs en modo --two-stems=vocals, sin GuitarNet
+STEMS = ("vocals", "drums", "bass", "guitar", "other")
+STEMS_DOS = ("vocals", "instrumental")
+
+
+def normalizar_stems(stems=None) -> tuple:
+    """
+    Valida los stems pedidos: lista y/o strings separados por comas
+    (None / vacío = todos los STEMS). Devuelve una tupla en orden canónico.
+    
+    Raises:
+        ValueError: stem desconocido o "instrumental" junto a stems de 4
+    """
+    if isinstance(stems, str):
+        stems = [stems]
+    pedidos = {
+        parte.strip().lower()
+        for stem in (stems or ()) for parte in str(stem).split(",") if parte.strip()
+    }
+    if not pedidos:
+        return STEMS
+    
+    desconocidos = pedidos - set(STEMS) - set(STEMS_DOS)
+    if desconocidos:
+        raise ValueError(f"Stems desconocidos: {sorted(desconocidos)} (opciones: {STEMS + STEMS_DOS[1:]})")
+    if "instrumental" in pedidos and not pedidos <= set(STEMS_DOS):
+        raise ValueError("'instrumental' sólo se puede pedir junto a 'vocals'")
+    
+    orden = STEMS_DOS if pedidos <= set(STEMS_DOS) else STEMS
+    return tuple(stem for stem in orden if stem in pedidos)
+
+
+def _solo_pedidos(stems_paths: dict, stems: tuple) -> dict:
+    """Deja sólo los stems pedidos (la clave de "other" es "others")"""
+    claves = {"others" if stem == "other" else stem for stem in stems}
+    return {clave: ruta for clave, ruta in stems_paths.items() if clave in claves}
+
 
 def procesar_cancion(
     nombre_archivo: str,
     output_dir: str,
     usuario: str = None,
-    check_cancelled=None
+    check_cancelled=None,
+    metricas: dict = None,
+    quality: str = None,
+    on_progress=None,
+    opciones_demucs: dict = None,
+    stems=None
 ) -> dict:
     """
     Pipeline completo de separación de audio.
     
     1. Ejecuta Demucs (Docker) → vocals, drums, bass, others
-    2. Ejecuta GuitarNet sobre others → guitar, others_clean
+    2. Ejecuta GuitarNet sobre others → guitar, others_clean (y la máscara
+       cruda en guitar_mask.npz para re-renderizar sin el modelo, ver
+       guitar_service.rerender_guitar; GUITARNET_SAVE_MASK)
+    
+    Con `stems` se separa sólo lo pedido:
+    - sólo vocals / instrumental: Demucs con --two-stems=vocals (vocals.wav
+      y no_vocals.wav), sin GuitarNet
+    - sin guitar: se omite GuitarNet ("other" queda como lo deja Demucs)
     
     Args:
         nombre_archivo: Nombre del archivo en input_audio/
         output_dir: Directorio base de salida
         usuario: Username para logging
-        check_cancelled: Función que retorna True si hay que cancelar
+        check_cancelled: Función que retorna True si hay que cancelar; se
+                         consulta por línea de Demucs y entre lotes de chunks
+                         de GuitarNet, así que debe ser barata (ver
+                         cancellation.CancelToken)
+        metricas: Dict opcional que se llena con los tiempos del job
+                  (demucs_s, guitarnet_s y guitarnet: estadísticas de la
+                  inferencia con los tiempos por etapa en "stages")
+        quality: Calidad de GuitarNet, "full" | "fast" (None =
+                 GUITARNET_QUALITY); "fast" para previews / plan gratuito
+        on_progress: Función opcional on_progress(etapa, progreso) con la
+                     etapa del job (demucs_progress.ETAPA_*)
+        opciones_demucs: Parámetros de Demucs de este job (segment, shifts,
+                         overlap, jobs, threads) sobre los de settings; los
+                         usados quedan en metricas["demucs_opciones"]
+        stems: Stems pedidos (ver normalizar_stems; None = todos)
     
     Returns:
-        Dict con rutas de todos los stems:
+        Dict con rutas de los stems pedidos (todos por defecto):
         {
             "vocals": "/path/to/vocals.wav",
             "drums": "/path/to/drums.wav", 
@@ -37,21 +111,50 @@ def procesar_cancion(
             "guitar": "/path/to/guitar.wav",
             "others": "/path/to/others.wav",  # others sin guitarra
         }
+        En modo dos stems: {"vocals": ..., "instrumental": ".../no_vocals.wav"}
     
     Raises:
+        ValueError: Si opciones_demucs o stems no son válidos
         Exception: Si Demucs falla o el proceso es cancelado
     """
-    write_log(event="Pipeline iniciado", user=usuario, extra={"archivo": nombre_archivo})
+    stems = normalizar_stems(stems)
+    dos_stems = set(stems) <= set(STEMS_DOS)
+    write_log(event="Pipeline iniciado", user=usuario, extra={"archivo": nombre_archivo, "stems": list(stems)})
+    if metricas is None:
+        metricas = {}
+    if dos_stems:
+        opciones_demucs = {**(opciones_demucs or {}), "two_stems": "vocals"}
+    opciones = demucs_options(opciones_demucs)
+    metricas["demucs_opciones"] = opciones
+    metricas["stems"] = list(stems)
     
     # =====================================================
     # 1) Ejecutar Demucs (Docker)
     # =====================================================
+    t0 = time.perf_counter()
     ruta_demucs = ejecutar_demucs(
         nombre_archivo=nombre_archivo,
         usuario=usuario,
         output_dir=output_dir,
-        check_cancelled=check_cancelled
+        check_cancelled=check_cancelled,
+        on_progress=on_progress,
+        opciones=opciones
     )
+    metricas["demucs_s"] = round(time.perf_counter() - t0, 3)
+    if check_cancelled and check_cancelled():
+        raise Exception("CANCELLED_BY_USER")
+    
+    if dos_stems:
+        stems_paths = _solo_pedidos({
+            "vocals": os.path.join(ruta_demucs, "vocals.wav"),
+            "instrumental": os.path.join(ruta_demucs, "no_vocals.wav"),
+        }, stems)
+        write_log(
+            event="Pipeline completado",
+            user=usuario,
+            extra={"archivo": nombre_archivo, "stems": list(stems_paths.keys())}
+        )
+        return stems_paths
     
     # Definir rutas de stems de Demucs
     stems_paths = {
@@ -65,6 +168,21 @@ def procesar_cancion(
     # =====================================================
     others_original = os.path.join(ruta_demucs, "other.wav")
     
+    if "guitar" not in stems:
+        write_log(
+            event="GuitarNet omitido - guitar no solicitado",
+            user=usuario,
+            extra={"archivo": nombre_archivo}
+        )
+        stems_paths["others"] = others_original
+        stems_paths = _solo_pedidos(stems_paths, stems)
+        write_log(
+            event="Pipeline completado",
+            user=usuario,
+            extra={"archivo": nombre_archivo, "stems": list(stems_paths.keys())}
+        )
+        return stems_paths
+    
     if not os.path.exists(others_original):
         write_log(
             event="GuitarNet omitido - other.wav no existe", 
@@ -74,49 +192,95 @@ def procesar_cancion(
         # Si no hay other.wav, devolver lo que tenemos
         stems_paths["others"] = others_original
         stems_paths["guitar"] = None
-        return stems_paths
+        return _solo_pedidos(stems_paths, stems)
     
-    # Crear directorio temporal para la separación de guitarra
+    final_guitar = os.path.join(ruta_demucs, "guitar.wav")
+    final_others = os.path.join(ruta_demucs, "other.wav")  # Reemplaza el original
+    handoff = getattr(settings, "GUITARNET_HANDOFF", "memory")
+    mask_path = mask_file(ruta_demucs) if getattr(settings, "GUITARNET_SAVE_MASK", True) else None
+    
+    # Modo "disk": directorio temporal para la separación de guitarra
     guitar_output_dir = os.path.join(output_dir, "_guitar_temp")
-    os.makedirs(guitar_output_dir, exist_ok=True)
     
+    if on_progress:
+        on_progress(ETAPA_GUITARNET, None)
+
     try:
         write_log(
             event="GuitarNet iniciado", 
             user=usuario, 
-            extra={"input": others_original}
+            extra={"input": others_original, "handoff": handoff, "quality": quality}
         )
         
-        # Ejecutar separación de guitarra
-        guitar_path, others_clean_path = separate_guitar(
-            input_others_path=others_original,
-            output_dir=guitar_output_dir
+        # Chunk / lote / streaming según memoria libre y jobs en curso
+        plan = plan_guitar_chunking(others_original)
+        write_log(
+            event="GuitarNet chunking",
+            user=usuario,
+            extra={"archivo": nombre_archivo, **plan}
         )
         
-        # Mover archivos finales al directorio de Demucs
-        final_guitar = os.path.join(ruta_demucs, "guitar.wav")
-        final_others = os.path.join(ruta_demucs, "other.wav")  # Reemplaza el original
-        
-        # Copiar resultados (guitar.wav nuevo, others.wav sin guitarra)
-        shutil.copy2(guitar_path, final_guitar)
-        shutil.copy2(others_clean_path, final_others)
+        guitar_stats = {}
+        t0 = time.perf_counter()
+        if handoff == "memory":
+            # Separación en memoria: cada stem se escribe una sola vez en su
+            # ruta final; other.wav sólo se reemplaza si todo salió bien
+            separate_guitar_in_place(
+                input_others_path=others_original,
+                guitar_path=final_guitar,
+                others_path=final_others,
+                stats=guitar_stats,
+                plan=plan,
+                quality=quality,
+                mask_path=mask_path,
+                cancelled=check_cancelled
+            )
+        else:
+            os.makedirs(guitar_output_dir, exist_ok=True)
+            
+            # Ejecutar separación de guitarra
+            guitar_path, others_clean_path = separate_guitar(
+                input_others_path=others_original,
+                output_dir=guitar_output_dir,
+                stats=guitar_stats,
+                plan=plan,
+                quality=quality,
+                mask_path=mask_path,
+                cancelled=check_cancelled
+            )
+            
+            # Copiar resultados (guitar.wav nuevo, others.wav sin guitarra)
+            shutil.copy2(guitar_path, final_guitar)
+            shutil.copy2(others_clean_path, final_others)
         
         stems_paths["guitar"] = final_guitar
         stems_paths["others"] = final_others
+        metricas["guitarnet_s"] = round(time.perf_counter() - t0, 3)
+        metricas["guitarnet"] = guitar_stats
         
         write_log(
             event="GuitarNet completado", 
             user=usuario, 
-            extra={"guitar": final_guitar, "others": final_others}
+            extra={"guitar": final_guitar, "others": final_others, **guitar_stats}
         )
         
+    except SeparationCancelled:
+        # Cancelado entre chunks: no hay fallback, el job se descarta
+        write_log(event="GuitarNet cancelado", user=usuario, extra={"archivo": nombre_archivo})
+        raise Exception("CANCELLED_BY_USER")
+        
     except Exception as e:
-        # Si falla GuitarNet, mantener el others original
+        # Si falla GuitarNet, mantener el others original (y no dejar un
+        # guitar.wav huérfano si alcanzó a escribirse)
         write_log(
             event="GuitarNet error - usando others original", 
             user=usuario, 
             extra={"error": str(e)}
         )
+        if handoff == "memory" and os.path.exists(final_guitar):
+            os.remove(final_guitar)
+        if mask_path and os.path.exists(mask_path):
+            os.remove(mask_path)
         stems_paths["others"] = others_original
         stems_paths["guitar"] = None
         print(f"GuitarNet falló, usando others original: {e}")
@@ -126,6 +290,7 @@ def procesar_cancion(
         if os.path.exists(guitar_output_dir):
             shutil.rmtree(guitar_output_dir, ignore_errors=True)
     
+    stems_paths = _solo_pedidos(stems_paths, stems)
     write_log(
         event="Pipeline completado", 
         user=usuario, 
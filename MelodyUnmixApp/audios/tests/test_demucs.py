@@ -0,0 +1,490 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import soundfile as sf
+from django.test import SimpleTestCase, override_settings
+
+from audios.services import cancellation, demucs_service
+from audios.services.demucs_service import (
+    DemucsCancelled,
+    LocalDemucsBackend,
+    WorkerDemucsBackend,
+    demucs_worker,
+)
+from audios.services.demucs_progress import (
+    ETAPA_CARGANDO,
+    ETAPA_GUARDANDO,
+    ETAPA_SEPARANDO,
+    DemucsProgressParser,
+)
+
+
+class DemucsWorkerTests(SimpleTestCase):
+    """Backend "worker" contra el worker persistente con el separador stub (sin Docker)"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_root = os.path.join(self.tmp.name, "input_audio")
+        self.output_root = os.path.join(self.tmp.name, "output_audio")
+        os.makedirs(self.input_root)
+        os.makedirs(self.output_root)
+        self.audio = (0.2 * np.random.RandomState(0).randn(22050, 2)).astype(np.float32)
+        sf.write(os.path.join(self.input_root, "cancion.wav"), self.audio, 22050)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def iniciar_worker(self, delay=0.0):
+        socket_path = os.path.join(self.tmp.name, "demucs.sock")
+        server = demucs_worker.create_server(
+            socket_path, demucs_worker.StubSeparator(delay=delay), self.input_root, self.output_root
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(demucs_worker.close_server, server)
+        self.addCleanup(server.shutdown)
+        return WorkerDemucsBackend(socket_path, self.input_root, self.output_root)
+
+    def test_worker_separa_jobs_con_el_modelo_residente(self):
+        # Dos jobs contra el mismo worker: stems en <output>/stub/<nombre>/,
+        # progreso reenviado línea por línea
+        backend = self.iniciar_worker()
+        lineas = []
+
+        for audio_id in (1, 2):
+            output_dir = os.path.join(self.output_root, "user_1", f"audio_{audio_id}")
+            ruta = backend.run("cancion.wav", self.input_root, output_dir, lineas.append)
+            self.assertEqual(ruta, os.path.join(output_dir, "stub", "cancion"))
+            self.assertEqual(sorted(os.listdir(ruta)), ["bass.wav", "drums.wav", "other.wav", "vocals.wav"])
+
+        suma = sum(sf.read(os.path.join(ruta, f"{s}.wav"), dtype="float32")[0]
+                   for s in demucs_worker.SOURCES)
+        self.assertTrue(np.allclose(suma, self.audio, atol=1e-3))
+        self.assertTrue(any("Separación completada" in linea for linea in lineas))
+        self.assertEqual(backend.ping()["jobs"], 2)
+
+        # Rutas fuera de los volúmenes del worker se rechazan antes de enviar
+        with self.assertRaises(ValueError):
+            backend.run("cancion.wav", self.input_root, self.tmp.name, lineas.append)
+
+    def test_worker_reenvia_porcentaje_intermedio_al_parser(self):
+        # Las barras de tqdm del worker llegan al parser: el progreso no se
+        # queda en 0 hasta "completada"
+        backend = self.iniciar_worker()
+        eventos = []
+        parser = DemucsProgressParser(lambda etapa, p: eventos.append((etapa, p)), min_interval=0)
+        output_dir = os.path.join(self.output_root, "user_1", "audio_4")
+
+        backend.run("cancion.wav", self.input_root, output_dir, parser.feed)
+
+        self.assertTrue(any(etapa == ETAPA_SEPARANDO and 0 < p < 100 for etapa, p in eventos))
+        self.assertEqual(eventos[-1], (ETAPA_GUARDANDO, 100))
+
+    def test_progress_writer_separa_redibujados_de_tqdm(self):
+        lineas = []
+        writer = demucs_worker.ProgressWriter(lineas.append)
+        writer.write("\r  0%|          | 0/10")
+        writer.write("\r 40%|████      | 4/10\r 10")
+        writer.write("0%|██████████| 10/10\n")
+        writer.flush()
+        self.assertEqual(lineas, ["0%|          | 0/10", "40%|████      | 4/10", "100%|██████████| 10/10"])
+
+    def test_captura_de_stderr_solo_del_hilo_del_job(self):
+        # Con el backend local Demucs corre dentro de Django: el stderr de
+        # otros hilos no entra al log del job ni se pierde
+        import io
+        import sys
+
+        lineas = []
+        en_captura = threading.Event()
+        escrito = threading.Event()
+
+        def job():
+            with demucs_worker.capture_stderr(demucs_worker.ProgressWriter(lineas.append)):
+                en_captura.set()
+                escrito.wait(5)
+                sys.stderr.write("\r 50%|█████     |\n")
+
+        with mock.patch("sys.stderr", io.StringIO()) as real:
+            hilo = threading.Thread(target=job)
+            hilo.start()
+            en_captura.wait(5)
+            sys.stderr.write("Traceback de otro request\n")
+            escrito.set()
+            hilo.join()
+            sys.stderr.write("después del job\n")
+
+        self.assertEqual(lineas, ["50%|█████     |"])
+        self.assertEqual(real.getvalue(), "Traceback de otro request\ndespués del job\n")
+
+    def test_worker_descarta_job_cancelado(self):
+        # Cancelar cierra la conexión: el worker no guarda los stems
+        backend = self.iniciar_worker(delay=1.0)
+        backend.poll_interval = 0.1
+        output_dir = os.path.join(self.output_root, "user_1", "audio_3")
+        inicio = time.monotonic()
+
+        with self.assertRaises(DemucsCancelled):
+            backend.run("cancion.wav", self.input_root, output_dir, lambda linea: None,
+                        check_cancelled=lambda: time.monotonic() - inicio > 0.3)
+
+        time.sleep(1.5)
+        self.assertFalse(os.path.exists(os.path.join(output_dir, "stub")))
+        stats = backend.ping()
+        self.assertEqual((stats["jobs"], stats["cancelled"]), (0, 1))
+
+    def test_contadores_del_runner_con_conexiones_concurrentes(self):
+        # Varias conexiones encolan a la vez mientras el runner descarta jobs
+        # cancelados: los contadores cierran sin perder incrementos
+        runner = demucs_worker.JobRunner(demucs_worker.StubSeparator(), self.input_root, self.output_root)
+
+        def encolar():
+            for _ in range(200):
+                runner.submit("cancion.wav", "x").cancelled.set()
+
+        hilos = [threading.Thread(target=encolar) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        inicio = time.monotonic()
+        while time.monotonic() - inicio < 10:
+            stats = runner.snapshot()
+            if not stats["queued"] and stats["cancelled"] + stats["jobs"] + stats["failed"] == 1600:
+                break
+            time.sleep(0.01)
+
+        stats = runner.snapshot()
+        self.assertEqual(stats["queued"], 0)
+        # Un job pudo empezar antes de marcarse cancelado
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(stats["cancelled"] + stats["jobs"], 1600)
+
+    def test_opciones_de_rendimiento_por_deployment_y_por_job(self):
+        # settings + overrides del job, validados; llegan al worker y al
+        # contenedor (-e DEMUCS_*) y quedan en las métricas del job
+        with override_settings(DEMUCS_SHIFTS="2", DEMUCS_THREADS="4", DEMUCS_OVERLAP=None):
+            self.assertEqual(demucs_service.demucs_options(), {"shifts": 2, "threads": 4})
+            opciones = demucs_service.demucs_options({"shifts": 0, "overlap": 0.5, "jobs": None})
+            self.assertEqual(opciones, {"shifts": 0, "overlap": 0.5, "threads": 4})
+            for invalida in ({"shifts": 1.5}, {"overlap": 1}, {"jobs": -1}, {"calidad": 1}):
+                with self.assertRaises(ValueError):
+                    demucs_service.demucs_options(invalida)
+
+        backend = self.iniciar_worker()
+        recibidas = []
+        separar = demucs_worker.StubSeparator.separate
+
+        def separar_registrando(separador, *args):
+            recibidas.append(args[-1])
+            return separar(separador, *args)
+
+        with mock.patch.object(demucs_worker.StubSeparator, "separate", separar_registrando):
+            backend.run("cancion.wav", self.input_root, os.path.join(self.output_root, "a"),
+                        lambda linea: None, options=opciones)
+        self.assertEqual(recibidas, [opciones])
+        with self.assertRaises(RuntimeError):
+            backend.run("cancion.wav", self.input_root, self.output_root, lambda linea: None,
+                        options={"threads": 0})
+
+        proceso = mock.Mock(returncode=0)
+        proceso.stdout.readline.return_value = ""
+        with mock.patch.object(demucs_service.subprocess, "Popen", return_value=proceso) as popen:
+            demucs_service.DockerDemucsBackend().run(
+                "cancion.wav", self.input_root, self.output_root, lambda linea: None, options=opciones
+            )
+        comando = popen.call_args[0][0]
+        imagen = comando.index("demucs:optimized")
+        self.assertIn("DEMUCS_SHIFTS=0", comando[:imagen])
+        self.assertIn("DEMUCS_THREADS=4", comando[:imagen])
+
+    def test_preset_de_demucs_por_upload(self):
+        # El upload sólo acepta presets de DEMUCS_PRESETS; el preset pisa
+        # los settings del deployment en procesar_cancion
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from audios import views
+
+        presets = {"rapido": {"shifts": 0, "overlap": 0.1}, "roto": {"shifts": 99}}
+        with override_settings(DEMUCS_PRESETS=presets, DEMUCS_SHIFTS="2", DEMUCS_THREADS="4"):
+            self.assertIsNone(demucs_service.preset_options(None))
+            opciones = demucs_service.preset_options("rapido")
+            self.assertEqual(demucs_service.demucs_options(opciones),
+                             {"shifts": 0, "overlap": 0.1, "threads": 4})
+            for invalido in ("roto", "ultra"):
+                with self.assertRaises(ValueError):
+                    demucs_service.preset_options(invalido)
+
+            archivo = SimpleUploadedFile("cancion.wav", b"RIFF", content_type="audio/wav")
+            request = APIRequestFactory().post(
+                "/api/audios/upload", {"archivo": archivo, "demucs_preset": "ultra"}, format="multipart"
+            )
+            force_authenticate(request, user=mock.Mock(is_authenticated=True, pk=1))
+            with mock.patch.object(views, "lanzar_procesamiento_asincrono") as lanzar:
+                response = views.AudioUploadView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Preset de Demucs desconocido", response.data["error"])
+        lanzar.assert_not_called()
+
+    def test_hilos_de_torch_no_se_filtran_al_proceso(self):
+        # El worker fija los hilos por job y los restaura; el backend local
+        # (dentro de Django) ignora `threads`
+        import torch
+        from types import SimpleNamespace
+
+        antes = torch.get_num_threads()
+        separador = SimpleNamespace(torch=torch, threads=antes)
+        with demucs_worker.DemucsSeparator.num_threads(separador, antes + 1):
+            self.assertEqual(torch.get_num_threads(), antes + 1)
+        self.assertEqual(torch.get_num_threads(), antes)
+
+        backend = LocalDemucsBackend(model="stub")
+        with mock.patch.object(backend.separator, "separate", return_value=True) as separar, \
+             mock.patch("builtins.print"):
+            backend.run("cancion.wav", self.input_root, self.output_root, lambda linea: None,
+                        options={"threads": 8, "shifts": 0})
+        self.assertEqual(separar.call_args[0][-1], {"shifts": 0})
+
+    def test_backend_segun_settings(self):
+        with mock.patch.object(demucs_service, "_backend", None), \
+             override_settings(DEMUCS_BACKEND="local", DEMUCS_MODEL="stub"):
+            backend = demucs_service.get_demucs_backend()
+            self.assertIsInstance(backend, LocalDemucsBackend)
+            ruta = backend.run("cancion.wav", self.input_root, self.output_root, lambda linea: None)
+            self.assertTrue(os.path.exists(os.path.join(ruta, "other.wav")))
+
+        with mock.patch.object(demucs_service, "_backend", None), \
+             override_settings(DEMUCS_BACKEND="kubernetes"):
+            with self.assertRaises(ValueError):
+                demucs_service.get_demucs_backend()
+
+
+class DemucsProgressTests(SimpleTestCase):
+    """Etapa/porcentaje desde la salida de tqdm y log en un solo insert"""
+
+    SALIDA = (
+        "Procesando cancion.mp3 con Demucs (mdx_extra_q)...\n"
+        "Selected model is a bag of 4 models. You will see that many progress bars per track.\n"
+        "Separated tracks will be stored in /output/mdx_extra_q\n"
+        "Separating track /input/cancion.mp3\n"
+    )
+
+    def barras(self, modelos=4):
+        # Una barra por modelo del bag, redibujada con '\r' como hace tqdm
+        return "".join(
+            "".join(f"\r{p:3d}%|{'█' * (p // 10):<10}| {p}/100 [00:0{p // 20}<00:05]" for p in range(0, 101, 5)) + "\n"
+            for _ in range(modelos)
+        )
+
+    def test_parser_combina_barras_del_bag_y_limita_avisos(self):
+        avisos = []
+        reloj = [0.0]
+
+        def on_progress(etapa, progreso):
+            avisos.append((reloj[0], etapa, progreso))
+
+        parser = DemucsProgressParser(on_progress, min_interval=2.0, user="ana", clock=lambda: reloj[0])
+        parser.feed(self.SALIDA)
+        self.assertEqual(parser.models, 4)
+        self.assertEqual(avisos[-1][1:], (ETAPA_SEPARANDO, 0))
+
+        # La salida llega en fragmentos arbitrarios; 0.1 s entre fragmentos
+        texto = self.barras()
+        for i in range(0, len(texto), 37):
+            reloj[0] += 0.1
+            parser.feed(texto[i:i + 37])
+        parser.feed("Separación completada. Archivos en: /output\n")
+        parser.close()
+
+        self.assertEqual(avisos[0][1:], (ETAPA_CARGANDO, 0))
+        self.assertEqual(avisos[-1][1:], (ETAPA_GUARDANDO, 100))
+        separando = [p for _, etapa, p in avisos if etapa == ETAPA_SEPARANDO]
+        self.assertEqual(separando, sorted(separando))
+        self.assertTrue(any(40 <= p <= 60 for p in separando))   # barras 2-3 de 4
+
+        # Dentro de una etapa, como mucho un aviso cada min_interval
+        tiempos = [t for t, etapa, _ in avisos if etapa == ETAPA_SEPARANDO][1:]
+        self.assertTrue(all(b - a >= 2.0 - 1e-9 for a, b in zip(tiempos, tiempos[1:])))
+        self.assertLess(len(avisos), 20)
+
+        # Cada redibujado queda como documento de log (4 líneas + 4x21 + 1)
+        self.assertEqual(len(parser.docs), 4 + 4 * 21 + 1)
+        self.assertEqual(parser.docs[0]["user"], "ana")
+
+    def test_ejecutar_demucs_escribe_log_en_un_solo_insert(self):
+        class BackendFalso:
+            def run(backend, nombre_archivo, input_dir, output_dir, on_line, check_cancelled=None, options=None):
+                for linea in (self.SALIDA + self.barras()).splitlines(keepends=True):
+                    on_line(linea)
+                return os.path.join(output_dir, "mdx_extra_q", "cancion")
+
+        avisos = []
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.object(demucs_service, "write_log") as write_log, \
+             mock.patch.object(demucs_service, "write_logs_batch") as write_logs_batch, \
+             mock.patch("builtins.open", mock.mock_open()), \
+             mock.patch("sys.stdout"), \
+             override_settings(DEMUCS_PROGRESS_INTERVAL=0):
+            demucs_service.ejecutar_demucs(
+                "cancion.mp3", usuario="ana", output_dir=tmp, backend=BackendFalso(),
+                on_progress=lambda etapa, progreso: avisos.append((etapa, progreso)),
+            )
+
+        write_logs_batch.assert_called_once()
+        self.assertEqual(len(write_logs_batch.call_args[0][0]), 4 + 4 * 21)
+        eventos = [c.kwargs["event"] for c in write_log.call_args_list]
+        self.assertNotIn("Demucs progreso", eventos)
+        self.assertEqual(avisos[-1], (ETAPA_GUARDANDO, 100))
+
+
+class CancellationTests(SimpleTestCase):
+    """Registro de cancelación: Event en el proceso, respaldo en DB con intervalo"""
+
+    def test_token_evento_inmediato_y_respaldo_en_db_con_intervalo(self):
+        consultas = []
+        borrado = [False]
+        reloj = [0.0]
+
+        def db_check():
+            consultas.append(reloj[0])
+            return borrado[0]
+
+        with override_settings(CANCEL_DB_CHECK_INTERVAL=5.0):
+            token = cancellation.register(901, db_check=db_check)
+        token.clock = lambda: reloj[0]
+        self.addCleanup(cancellation.unregister, 901)
+
+        # Muchas llamadas (una por línea de Demucs): una consulta por intervalo
+        for _ in range(900):
+            reloj[0] += 0.01
+            self.assertFalse(token())
+        self.assertEqual(len(consultas), 2)   # t=0.01 y t=5.01
+
+        # Cancelación desde otro proceso: se detecta en la siguiente consulta
+        borrado[0] = True
+        reloj[0] += 5.0
+        self.assertTrue(token())
+        self.assertTrue(token())
+        self.assertEqual(len(consultas), 3)
+
+        # En el mismo proceso: cancel() enciende el Event sin tocar la DB
+        otro = cancellation.register(902, db_check=lambda: self.fail("no debe consultar la DB"))
+        otro.db_interval = float("inf")
+        otro._last_check = 0.0
+        self.addCleanup(cancellation.unregister, 902)
+        self.assertTrue(cancellation.cancel(902))
+        self.assertTrue(otro())
+        cancellation.unregister(902)
+        self.assertFalse(cancellation.cancel(902))
+
+    def test_backend_de_demucs_respeta_el_token(self):
+        backend = LocalDemucsBackend(model=demucs_worker.STUB_MODEL)
+        token = cancellation.register(903)
+        self.addCleanup(cancellation.unregister, 903)
+        cancellation.cancel(903)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(DemucsCancelled):
+                backend.run("cancion.wav", tmp, tmp, lambda linea: None, check_cancelled=token)
+
+
+class StemsSolicitadosTests(SimpleTestCase):
+    """procesar_cancion sólo con los stems pedidos (Demucs stub, sin GuitarNet real)"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.audio = (0.2 * np.random.RandomState(1).randn(22050, 2)).astype(np.float32)
+        self.input_path = os.path.join(self.tmp.name, "cancion.wav")
+        sf.write(self.input_path, self.audio, 22050)
+        self.opciones = []
+
+    def ejecutar_demucs_stub(self, nombre_archivo, output_dir, opciones, **kwargs):
+        # Mismo layout que ejecutar_demucs: <output_dir>/<modelo>/<nombre>/
+        self.opciones.append(opciones)
+        destino = Path(output_dir) / demucs_worker.STUB_MODEL / "cancion"
+        demucs_worker.StubSeparator().separate(self.input_path, destino, lambda linea: None,
+                                               lambda: False, opciones)
+        return str(destino)
+
+    def procesar(self, stems):
+        from audios.services import pipeline
+
+        with mock.patch.object(pipeline, "ejecutar_demucs", side_effect=self.ejecutar_demucs_stub), \
+             mock.patch.object(pipeline, "write_log"), \
+             mock.patch.object(pipeline, "separate_guitar_in_place") as guitarnet:
+            metricas = {}
+            rutas = pipeline.procesar_cancion("cancion.wav", self.tmp.name, metricas=metricas, stems=stems)
+        return rutas, metricas, guitarnet
+
+    def test_solo_vocals_usa_dos_stems_sin_guitarnet(self):
+        rutas, metricas, guitarnet = self.procesar("vocals,instrumental")
+
+        self.assertEqual(set(rutas), {"vocals", "instrumental"})
+        self.assertTrue(rutas["instrumental"].endswith("no_vocals.wav"))
+        self.assertEqual(self.opciones[-1]["two_stems"], "vocals")
+        self.assertEqual(metricas["stems"], ["vocals", "instrumental"])
+        guitarnet.assert_not_called()
+
+        vocals, _ = sf.read(rutas["vocals"], dtype="float32")
+        instrumental, _ = sf.read(rutas["instrumental"], dtype="float32")
+        self.assertTrue(np.allclose(vocals + instrumental, self.audio, atol=1e-3))
+
+    def test_sin_guitar_omite_guitarnet_y_devuelve_solo_lo_pedido(self):
+        rutas, _, guitarnet = self.procesar(["drums", "other"])
+
+        self.assertEqual(set(rutas), {"drums", "others"})
+        self.assertTrue(rutas["others"].endswith("other.wav"))
+        self.assertNotIn("two_stems", self.opciones[-1])
+        guitarnet.assert_not_called()
+
+        rutas, _, guitarnet = self.procesar(None)
+        self.assertEqual(set(rutas), {"vocals", "drums", "bass", "guitar", "others"})
+        guitarnet.assert_called_once()
+
+    def test_rerender_con_solo_guitar(self):
+        # Sólo "guitar" registra la pista de guitarra; el re-render usa el
+        # other.wav que queda en la misma carpeta
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from audios import views
+
+        rutas, _, guitarnet = self.procesar(["guitar"])
+        self.assertEqual(set(rutas), {"guitar"})
+        guitarnet.assert_called_once()
+        stems_dir = os.path.dirname(rutas["guitar"])
+        self.assertTrue(os.path.exists(os.path.join(stems_dir, "other.wav")))
+        open(os.path.join(stems_dir, "guitar_mask.npz"), "wb").close()
+
+        archivo = mock.MagicMock()
+        archivo.audio_in.estado = "procesado"
+        archivo.pistas.filter.return_value = [
+            mock.Mock(instrumento="guitar", ruta_pista_out=rutas["guitar"])
+        ]
+        request = APIRequestFactory().post("/api/audios/7/rerender", {"gamma": 0.6}, format="json")
+        force_authenticate(request, user=mock.Mock(is_authenticated=True, pk=1))
+
+        with mock.patch.object(views.ArchivoAudio, "objects") as objects, \
+             mock.patch("audios.services.guitar_service.rerender_guitar",
+                        return_value={"enhance": {}}) as rerender:
+            objects.select_related.return_value.get.return_value = archivo
+            response = views.RerenderGuitarView.as_view()(request, audio_id=7)
+
+        self.assertEqual(response.status_code, 200)
+        args, kwargs = rerender.call_args
+        self.assertEqual(args, (rutas["guitar"], os.path.join(stems_dir, "other.wav"),
+                                os.path.join(stems_dir, "guitar_mask.npz")))
+        self.assertEqual(kwargs["gamma"], 0.6)
+
+    def test_stems_invalidos(self):
+        from audios.services.pipeline import STEMS, normalizar_stems
+
+        self.assertEqual(normalizar_stems(None), STEMS)
+        self.assertEqual(normalizar_stems(["guitar,Vocals"]), ("vocals", "guitar"))
+        self.assertEqual(normalizar_stems("vocals"), ("vocals",))
+        for invalido in ("piano", ["instrumental", "drums"]):
+            with self.assertRaises(ValueError):
+                normalizar_stems(invalido)
@@ -0,0 +1,817 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import soundfile as sf
+import torch
+from django.conf import settings
+from django.test import SimpleTestCase
+
+MODELS_DIR = Path(settings.BASE_DIR) / "models"
+if str(MODELS_DIR) not in sys.path:
+    sys.path.insert(0, str(MODELS_DIR))
+
+from guitarnet_inference import (
+    EfficientGuitarNet,
+    GuitarSeparator,
+    SeparationCancelled,
+    StageProfiler,
+    TORCHSCRIPT_SUFFIX,
+    collect_batch_inputs,
+    export_torchscript,
+    int8_artifact_path,
+    load_mask,
+    plan_chunking,
+    quantize_int8,
+    separate_batch,
+)
+from guitarnet_server import GuitarNetServer
+from convert_weights import convert_weights
+
+
+ONNX_DISPONIBLE = all(
+    importlib.util.find_spec(mod) is not None for mod in ("onnx", "onnxruntime")
+)
+SAFETENSORS_DISPONIBLE = importlib.util.find_spec("safetensors") is not None
+
+
+def crear_modelo_aleatorio():
+    """EfficientGuitarNet con pesos y estadísticas de BatchNorm no triviales"""
+    torch.manual_seed(0)
+    model = EfficientGuitarNet()
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    return model
+
+
+def crear_separador(**kwargs):
+    """GuitarSeparator en CPU con pesos aleatorios (no requiere el checkpoint real)"""
+    fd, model_path = tempfile.mkstemp(suffix=".pth")
+    os.close(fd)
+    try:
+        torch.save(crear_modelo_aleatorio().state_dict(), model_path)
+        return GuitarSeparator(model_path, device="cpu", **kwargs)
+    finally:
+        os.remove(model_path)
+
+
+class GuitarNetInferenceTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.separator = crear_separador()
+
+    def magnitud_sintetica(self, frames=200, bins=64):
+        gen = torch.Generator().manual_seed(1)
+        return torch.rand(1, bins, frames, generator=gen)
+
+    def test_batch_equivale_a_loop_secuencial(self):
+        # El modo por lotes debe producir la misma máscara que un chunk por forward
+        magnitude = self.magnitud_sintetica()
+        mask_seq = self.separator.process_long_audio_mask(magnitude, 48, max_batch=1)
+        mask_batch = self.separator.process_long_audio_mask(magnitude, 48, max_batch=4)
+
+        self.assertEqual(mask_seq.shape, (64, 200))
+        self.assertTrue(torch.allclose(mask_seq, mask_batch, atol=1e-5))
+
+    def test_arena_reutiliza_buffers_entre_chunks_y_jobs(self):
+        # Con la arena, las asignaciones del tamaño de un chunk no crecen con
+        # la cantidad de chunks (0 por chunk) y un segundo "job" no crea
+        # buffers nuevos; sin ella cada llamada arma su entrada desde cero
+        from torch.profiler import ProfilerActivity, profile
+
+        separator = crear_separador()
+        salida = torch.full((2, 1, 64, 64), 0.5)
+
+        def asignaciones(frames):
+            magnitude = torch.rand(1, 64, frames, generator=torch.Generator().manual_seed(6))
+            with mock.patch.object(separator, "run_model", side_effect=lambda x: salida[:x.shape[0]]):
+                separator.process_long_audio_mask(magnitude, 60, max_batch=2)
+                with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+                    separator.process_long_audio_mask(magnitude, 60, max_batch=2)
+            # Tensores de al menos un cuarto de chunk (no escalares)
+            return sum(1 for e in prof.events() if e.self_cpu_memory_usage >= 64 * 15 * 4)
+
+        self.assertEqual(asignaciones(300), asignaciones(600))
+        creados = separator.arena.allocations
+        asignaciones(300)
+        self.assertEqual(separator.arena.allocations, creados)
+
+        sin_arena = crear_separador(reuse_buffers=False)
+        chunk = torch.rand(64, 60)
+        for _ in range(3):
+            separator.process_chunk_batch([chunk])
+            sin_arena.process_chunk_batch([chunk])
+        self.assertEqual(separator.arena.allocations, creados)
+        self.assertEqual(sin_arena.arena.allocations, 3)
+
+    def test_max_batch_acotado(self):
+        # Nunca menos de 1 ni más que el máximo configurado
+        n = self.separator.max_batch_for_memory(1025, 2583)
+        self.assertGreaterEqual(n, 1)
+        self.assertLessEqual(n, self.separator.max_batch)
+
+    def test_separate_estereo_conserva_longitud(self):
+        # Una sola iSTFT por lotes debe devolver C canales con la longitud original
+        sr = self.separator.target_sr
+        gen = np.random.RandomState(0)
+        audio = (0.1 * gen.randn(sr, 2)).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, "other.wav")
+            sf.write(input_path, audio, sr)
+            guitar_path, others_path = self.separator.separate(input_path, tmp, chunk_duration=30)
+
+            for path in (guitar_path, others_path):
+                data, file_sr = sf.read(str(path))
+                self.assertEqual(file_sr, sr)
+                self.assertEqual(data.shape, audio.shape)
+
+    def test_separate_array_coincide_con_separate(self):
+        # La API en memoria devuelve los mismos stems que separate() escribe
+        sr = self.separator.target_sr
+        audio = (0.1 * np.random.RandomState(2).randn(sr, 2)).astype(np.float32)
+
+        guitar, others, out_sr = self.separator.separate_array(torch.from_numpy(audio.T.copy()), sr)
+        self.assertEqual(out_sr, sr)
+        self.assertEqual(guitar.shape, (2, sr))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, "other.wav")
+            sf.write(input_path, audio, sr, subtype="FLOAT")
+            guitar_path, others_path = self.separator.separate(input_path, tmp)
+            for tensor, path in ((guitar, guitar_path), (others, others_path)):
+                data, _ = sf.read(str(path), dtype="float32")
+                self.assertLess(np.abs(data.T - tensor.numpy()).max(), 1e-5)
+
+    def test_lote_separa_carpeta_y_manifest_con_resumen(self):
+        # Modo lote: un solo separador para todos los archivos, salida en
+        # subcarpetas espejo, fallos registrados sin cortar el lote y
+        # skip_existing para retomar
+        sr = self.separator.target_sr
+        gen = np.random.RandomState(8)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            catalogo = os.path.join(tmp, "catalogo")
+            for sub in ("a", "b"):
+                os.makedirs(os.path.join(catalogo, sub))
+            audios = {}
+            for rel in ("a/tema.wav", "b/tema.wav"):
+                audios[rel] = (0.1 * gen.randn(sr // 2, 2)).astype(np.float32)
+                sf.write(os.path.join(catalogo, rel), audios[rel], sr, subtype="FLOAT")
+            with open(os.path.join(catalogo, "b", "roto.wav"), "w") as f:
+                f.write("no es audio")
+
+            entradas = collect_batch_inputs(catalogo)
+            self.assertEqual([p.name for p in entradas], ["tema.wav", "roto.wav", "tema.wav"])
+            manifest = os.path.join(tmp, "lista.txt")
+            with open(manifest, "w") as f:
+                f.write("# backfill\ncatalogo/a/tema.wav\n\ncatalogo/b/tema.wav\n")
+            self.assertEqual(len(collect_batch_inputs(manifest)), 2)
+
+            salida = os.path.join(tmp, "salida")
+            resumen = separate_batch(self.separator, entradas, salida, io_workers=2, prefetch=1)
+            self.assertEqual((resumen["ok"], resumen["failed"]), (2, 1))
+            self.assertEqual(resumen["failures"][0]["stage"], "decode")
+            self.assertTrue(os.path.exists(os.path.join(salida, "batch_summary.json")))
+
+            guitar, _, _ = self.separator.separate_array(torch.from_numpy(audios["b/tema.wav"].T.copy()), sr)
+            data, _ = sf.read(os.path.join(salida, "b", "tema", "guitar.wav"), dtype="float32")
+            self.assertLess(np.abs(data.T - guitar.numpy()).max(), 1e-5)
+            for record in resumen["results"]:
+                if record["status"] == "ok":
+                    self.assertGreater(record["separate_s"], 0.0)
+
+            otra = separate_batch(self.separator, entradas, salida, skip_existing=True)
+            self.assertEqual((otra["ok"], otra["skipped"], otra["failed"]), (0, 2, 1))
+
+    def test_profiler_registra_etapas_de_separate(self):
+        # Cada etapa queda con tiempo de reloj / CPU / memoria, el callback
+        # recibe cada ejecución y los totales vuelven en stats["stages"]
+        sr = 22050
+        audio = (0.1 * np.random.RandomState(4).randn(sr, 2)).astype(np.float32)
+        llamadas = []
+        profiler = StageProfiler(callback=lambda name, record: llamadas.append(name))
+        stats = {}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, "other.wav")
+            sf.write(input_path, audio, sr)
+            self.separator.separate(input_path, tmp, stats=stats, profiler=profiler)
+
+        etapas = ["decode", "resample", "stft", "model", "enhance_mask", "istft", "normalize", "save"]
+        self.assertEqual(llamadas, etapas)
+        self.assertEqual(list(stats["stages"]), etapas)
+        for record in stats["stages"].values():
+            self.assertEqual(record["calls"], 1)
+            self.assertGreaterEqual(record["wall_s"], 0.0)
+            self.assertGreaterEqual(record["cpu_s"], 0.0)
+            self.assertGreater(record["peak_mem_mb"], 0.0)
+
+        # Sin profiler los tiempos también vuelven en stats (separate y stream)
+        for metodo in (self.separator.separate, self.separator.separate_stream):
+            stats = {}
+            with tempfile.TemporaryDirectory() as tmp:
+                input_path = os.path.join(tmp, "other.wav")
+                sf.write(input_path, audio, sr)
+                metodo(input_path, tmp, stats=stats)
+            self.assertIn("model", stats["stages"])
+            self.assertIn("save", stats["stages"])
+
+    def test_chunking_se_adapta_a_memoria_y_jobs(self):
+        # Menos memoria o más jobs en curso → chunks más cortos / lotes más
+        # chicos; si ni el chunk mínimo entra se marca fits=False
+        def memoria(mb, cgroup_mb=None):
+            return {"available": mb * 2**20, "meminfo": mb * 2**20,
+                    "cgroup_limit": cgroup_mb and cgroup_mb * 2**20, "cgroup_usage": 0}
+
+        pista = 44100 * 60
+        holgada = plan_chunking(pista, 2, memory=memoria(64000))
+        self.assertEqual((holgada["chunk_duration"], holgada["max_batch"]), (30, 4))
+        self.assertTrue(holgada["fits"])
+
+        tres_jobs = plan_chunking(pista, 2, jobs=3, memory=memoria(8000))
+        un_job = plan_chunking(pista, 2, jobs=1, memory=memoria(8000))
+        self.assertLess(tres_jobs["chunk_duration"], un_job["chunk_duration"])
+
+        sin_memoria = plan_chunking(pista, 2, memory=memoria(500))
+        self.assertEqual((sin_memoria["chunk_duration"], sin_memoria["max_batch"]), (5, 1))
+        self.assertFalse(sin_memoria["fits"])
+
+    def test_chunking_sin_memoria_separa_en_streaming(self):
+        # Si la pista completa no entra, el servicio usa separate_stream
+        from audios.services import guitar_service
+        import guitarnet_inference
+
+        sr = self.separator.target_sr
+        audio = (0.1 * np.random.RandomState(5).randn(sr // 2, 2)).astype(np.float32)
+        poca = {"available": 10 * 2**20, "meminfo": 4000 * 2**20,
+                "cgroup_limit": 1000 * 2**20, "cgroup_usage": 990 * 2**20}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            other_path = os.path.join(tmp, "other.wav")
+            sf.write(other_path, audio, sr)
+            stats = {}
+            with mock.patch.object(guitarnet_inference, "available_memory", return_value=poca), \
+                 mock.patch.object(guitar_service, "get_guitar_separator", return_value=self.separator), \
+                 mock.patch.object(self.separator, "separate_stream",
+                                   wraps=self.separator.separate_stream) as stream:
+                guitar_service.separate_guitar_in_place(
+                    other_path, os.path.join(tmp, "guitar.wav"), other_path, stats=stats
+                )
+
+            self.assertTrue(stream.called)
+            self.assertTrue(stats["chunking"]["stream"])
+            self.assertEqual(stats["chunking"]["cgroup_limit_mb"], 1000.0)
+            self.assertEqual(sorted(os.listdir(tmp)), ["guitar.wav", "other.wav"])
+            self.assertEqual(guitar_service.active_guitarnet_jobs(), 0)
+
+    def test_jobs_en_curso_se_cuentan_entre_procesos(self):
+        # Cada job deja una marca <pid>-<id> en GUITARNET_JOBS_DIR: el plan
+        # reparte la memoria también con los jobs de otros workers de
+        # gunicorn; las marcas de procesos muertos se descartan
+        import subprocess
+        from django.test import override_settings
+        from audios.services import guitar_service
+
+        muerto = subprocess.Popen([sys.executable, "-c", "pass"])
+        muerto.wait()
+        sr = self.separator.target_sr
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(GUITARNET_JOBS_DIR=tmp):
+            otro_worker = os.path.join(tmp, f"{os.getppid()}-a")
+            huerfana = os.path.join(tmp, f"{muerto.pid}-b")
+            for marca in (otro_worker, huerfana):
+                open(marca, "w").close()
+            other_path = os.path.join(tmp, "other.wav")
+            sf.write(other_path, np.zeros((sr, 2), dtype=np.float32), sr)
+
+            self.assertEqual(guitar_service.running_guitarnet_jobs(), (1, "procesos"))
+            self.assertFalse(os.path.exists(huerfana))
+            with guitar_service._guitarnet_job():
+                self.assertEqual(guitar_service.running_guitarnet_jobs(), (2, "procesos"))
+            self.assertEqual(guitar_service.running_guitarnet_jobs(), (1, "procesos"))
+
+            plan = guitar_service.plan_guitar_chunking(other_path)
+            self.assertEqual((plan["jobs"], plan["jobs_source"]), (2, "procesos"))
+
+        with override_settings(GUITARNET_JOBS_DIR=""):
+            self.assertEqual(guitar_service.running_guitarnet_jobs(), (0, "proceso"))
+
+    def test_separacion_in_place_reemplaza_other_sin_temporales(self):
+        # Modo "memory" del pipeline: other.wav se reemplaza de forma atómica
+        # y en la carpeta sólo quedan los stems finales
+        from audios.services import guitar_service
+
+        sr = self.separator.target_sr
+        audio = (0.1 * np.random.RandomState(3).randn(sr // 2, 2)).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            other_path = os.path.join(tmp, "other.wav")
+            guitar_path = os.path.join(tmp, "guitar.wav")
+            sf.write(other_path, audio, sr)
+
+            with mock.patch.object(guitar_service, "get_guitar_separator", return_value=self.separator):
+                guitar_service.separate_guitar_in_place(other_path, guitar_path, other_path)
+
+            self.assertEqual(sorted(os.listdir(tmp)), ["guitar.wav", "other.wav"])
+            nuevo, _ = sf.read(other_path, dtype="float32")
+            self.assertEqual(nuevo.shape, audio.shape)
+            self.assertFalse(np.allclose(nuevo, audio))
+
+    def test_cancelacion_entre_lotes_de_chunks(self):
+        # `cancelled` se consulta antes de cada lote: al cancelar se corta el
+        # modelo y other.wav queda intacto (sin guitar.wav a medio escribir)
+        from audios.services import guitar_service
+
+        separator = crear_separador()
+        sr = separator.target_sr
+        audio = (0.1 * np.random.RandomState(7).randn(3 * sr, 2)).astype(np.float32)
+        forwards = []
+        original = separator.run_model
+
+        def run_model(x):
+            forwards.append(x.shape[0])
+            return original(x)
+
+        with mock.patch.object(separator, "run_model", side_effect=run_model):
+            with self.assertRaises(SeparationCancelled):
+                separator.separate_array(
+                    torch.from_numpy(audio.T.copy()), sr, chunk_duration=0.25, max_batch=1,
+                    cancelled=lambda: len(forwards) >= 2
+                )
+        self.assertEqual(len(forwards), 2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            other_path = os.path.join(tmp, "other.wav")
+            guitar_path = os.path.join(tmp, "guitar.wav")
+            sf.write(other_path, audio, sr)
+
+            with mock.patch.object(guitar_service, "get_guitar_separator", return_value=separator):
+                with self.assertRaises(SeparationCancelled):
+                    guitar_service.separate_guitar_in_place(
+                        other_path, guitar_path, other_path, cancelled=lambda: True
+                    )
+            self.assertEqual(os.listdir(tmp), ["other.wav"])
+            intacto, _ = sf.read(other_path, dtype="float32")
+            self.assertTrue(np.allclose(intacto, audio, atol=1e-4))
+
+            with self.assertRaises(SeparationCancelled):
+                separator.separate_stream(other_path, os.path.join(tmp, "stream"),
+                                          cancelled=lambda: True)
+
+    def test_rerender_desde_mascara_guardada_sin_modelo(self):
+        # La máscara cruda (uint8) queda junto a los stems; re-renderizar con
+        # los parámetros por defecto reproduce los stems y con otros los
+        # cambia, sin cargar ni ejecutar el modelo
+        from audios.services import guitar_service
+
+        sr = self.separator.target_sr
+        audio = (0.1 * np.random.RandomState(11).randn(sr, 2)).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            other_path = os.path.join(tmp, "other.wav")
+            guitar_path = os.path.join(tmp, "guitar.wav")
+            mask_path = guitar_service.mask_file(tmp)
+            sf.write(other_path, audio, sr)
+
+            with mock.patch.object(guitar_service, "get_guitar_separator", return_value=self.separator):
+                guitar_service.separate_guitar_in_place(
+                    other_path, guitar_path, other_path, mask_path=mask_path
+                )
+            self.assertEqual(sorted(os.listdir(tmp)), ["guitar.wav", "guitar_mask.npz", "other.wav"])
+            guitar, _ = sf.read(guitar_path, dtype="float32")
+            others, _ = sf.read(other_path, dtype="float32")
+
+            with mock.patch.object(guitar_service, "get_guitar_separator", side_effect=AssertionError), \
+                 mock.patch.object(GuitarSeparator, "run_model", side_effect=AssertionError):
+                result = guitar_service.rerender_guitar(guitar_path, other_path, mask_path)
+                igual, _ = sf.read(guitar_path, dtype="float32")
+                self.assertTrue(np.allclose(igual, guitar, atol=1e-3))
+
+                guitar_service.rerender_guitar(guitar_path, other_path, mask_path, gamma=0.4,
+                                               high_boost_db=9)
+                with self.assertRaises(ValueError):
+                    guitar_service.rerender_guitar(guitar_path, other_path, mask_path, gamma=0)
+
+            self.assertEqual(result["enhance"]["high_boost_db"], 5.0)
+            agresiva, _ = sf.read(guitar_path, dtype="float32")
+            resto, _ = sf.read(other_path, dtype="float32")
+            self.assertFalse(np.allclose(agresiva, guitar, atol=5e-3))
+            # La suma (sin normalizar) sigue siendo la entrada
+            gains = load_mask(mask_path)["gains"]
+            self.assertTrue(np.allclose(agresiva / gains[0] + resto / gains[1], audio, atol=1e-4))
+            self.assertEqual(sorted(os.listdir(tmp)), ["guitar.wav", "guitar_mask.npz", "other.wav"])
+
+    def test_process_pool_coincide_con_separate_array(self):
+        # Worker en otro proceso (audio por shared memory, reciclado tras
+        # cada job): mismo resultado que la separación en el proceso actual
+        from audios.services import guitar_pool
+
+        sr = 22050  # fuerza resampling dentro del worker
+        audio = (0.1 * np.random.RandomState(4).randn(sr, 2)).astype(np.float32)
+        guitar, others, _ = self.separator.separate_array(torch.from_numpy(audio.T.copy()), sr)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, "guitarnet_model.pth")
+            torch.save(crear_modelo_aleatorio().state_dict(), model_path)
+            input_path = os.path.join(tmp, "other.wav")
+            sf.write(input_path, audio, sr, subtype="FLOAT")
+
+            pool = guitar_pool.get_guitar_pool(
+                MODELS_DIR, model_path, {"device": "cpu"}, workers=1, max_tasks_per_child=1
+            )
+            try:
+                for _ in range(2):
+                    stats = {}
+                    guitar_path, others_path = guitar_pool.separate_in_pool(
+                        pool, input_path, os.path.join(tmp, "guitar.wav"),
+                        os.path.join(tmp, "others.wav"), self.separator.target_sr, stats=stats
+                    )
+                    self.assertIn("chunks_total", stats)
+                    for tensor, path in ((guitar, guitar_path), (others, others_path)):
+                        data, _ = sf.read(path, dtype="float32", always_2d=True)
+                        self.assertEqual(data.T.shape, tuple(tensor.shape))
+                        self.assertLess(np.abs(data.T - tensor.numpy()).max(), 1e-5)
+            finally:
+                guitar_pool.shutdown_guitar_pool()
+
+    def test_warmup_ejecuta_forwards_de_prueba(self):
+        llamadas = []
+        original = self.separator.run_model
+        with mock.patch.object(self.separator, "run_model",
+                               side_effect=lambda x: llamadas.append(x.shape) or original(x)):
+            segundos = self.separator.warmup(chunk_durations=(0.5,), batch_sizes=(1, 2))
+
+        self.assertGreaterEqual(segundos, 0)
+        self.assertEqual([shape[0] for shape in llamadas], [1, 2])
+        self.assertEqual(llamadas[0][2], 1040)  # 1025 bins con padding a múltiplo de 16
+
+    def test_peso_por_frecuencia_cacheado(self):
+        w1 = self.separator.frequency_weight(1025, 0.4, 5, "cpu")
+        w2 = self.separator.frequency_weight(1025, 0.4, 5, "cpu")
+        self.assertIs(w1, w2)
+        self.assertEqual(w1.shape, (1025, 1))
+
+    def test_stream_equivale_a_separate_con_misma_mascara(self):
+        # Con una máscara fija (sin modelo ni re-normalización global), el
+        # streaming por bloques debe reconstruir lo mismo que la pista completa
+        separator = crear_separador()
+        separator.predict_mask = lambda mag, chunk_duration=30, **kwargs: (
+            torch.linspace(0, 1, mag.shape[-2]).view(-1, 1).expand(mag.shape[-2], mag.shape[-1])
+        )
+        separator.enhance_guitar_mask = lambda mask, **kwargs: mask
+
+        for sr in (44100, 48000):
+            audio = (0.1 * np.random.RandomState(0).randn(int(sr * 4.3), 2)).astype(np.float32)
+            with tempfile.TemporaryDirectory() as tmp:
+                input_path = os.path.join(tmp, "other.wav")
+                sf.write(input_path, audio, sr)
+                completo = separator.separate(input_path, os.path.join(tmp, "completo"))
+                stream = separator.separate_stream(
+                    input_path, os.path.join(tmp, "stream"),
+                    block_duration=1, context_duration=0.2,
+                )
+                for path_a, path_b in zip(completo, stream):
+                    a, _ = sf.read(str(path_a))
+                    b, _ = sf.read(str(path_b))
+                    self.assertEqual(a.shape, b.shape)
+                    self.assertLess(np.abs(a - b).max(), 1e-4)
+
+    def test_stream_usa_los_parametros_de_enhance(self):
+        # Mismos defaults que separate_array (ENHANCE_DEFAULTS) y el mismo
+        # dict `enhance` validado; la cota fija sigue al boost pedido
+        from guitarnet_inference import ENHANCE_DEFAULTS
+
+        separator = crear_separador()
+        separator.predict_mask = lambda mag, chunk_duration=30, **kwargs: torch.full(mag.shape[-2:], 0.5)
+        llamadas = []
+        separator.enhance_guitar_mask = lambda mask, **kwargs: llamadas.append(kwargs) or mask
+
+        audio = (0.1 * np.random.RandomState(1).randn(44100, 2)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, "other.wav")
+            sf.write(input_path, audio, 44100)
+            separator.separate_stream(input_path, os.path.join(tmp, "a"), chunk_duration=1)
+            separator.separate_stream(input_path, os.path.join(tmp, "b"), chunk_duration=1,
+                                      enhance={"gamma": 0.5, "high_boost_db": -3})
+            with self.assertRaises(ValueError):
+                separator.separate_stream(input_path, os.path.join(tmp, "c"), enhance={"gamma": 0})
+
+        por_defecto, pedido = llamadas[0], llamadas[-1]
+        self.assertEqual({k: por_defecto[k] for k in ENHANCE_DEFAULTS}, ENHANCE_DEFAULTS)
+        self.assertAlmostEqual(por_defecto["bounds"][1], 10 ** (5 / 20))
+        self.assertEqual((pedido["gamma"], pedido["high_start_ratio"], pedido["high_boost_db"]),
+                         (0.5, 0.4, -3.0))
+        self.assertEqual(pedido["bounds"], (0.0, 1.0))
+
+    def test_modo_optimizado_coincide_con_eager(self):
+        # BN folding + channels_last (+ TorchScript) dentro de tolerancia
+        optimizado = crear_separador(optimize=True)
+        magnitude = self.magnitud_sintetica(frames=150, bins=100)
+
+        mask_eager = self.separator.process_long_audio_mask(magnitude, 64)
+        mask_opt = optimizado.process_long_audio_mask(magnitude, 64)
+        self.assertTrue(torch.allclose(mask_eager, mask_opt, atol=1e-4))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ts_path = os.path.join(tmp, "guitarnet" + TORCHSCRIPT_SUFFIX)
+            optimizado.export_torchscript(ts_path)
+            scripted = GuitarSeparator(ts_path, device="cpu")
+            mask_ts = scripted.process_long_audio_mask(magnitude, 64)
+        self.assertTrue(scripted.optimized)
+        self.assertTrue(torch.allclose(mask_eager, mask_ts, atol=1e-4))
+
+    def test_int8_calibrado_dentro_de_tolerancia(self):
+        # Cuantización estática: la máscara int8 se mantiene cerca de fp32
+        magnitude = self.magnitud_sintetica(frames=64, bins=100).squeeze(0)
+        inputs = [self.separator.prepare_chunk(magnitude).unsqueeze(0).unsqueeze(0)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, "guitarnet_model.pth")
+            torch.save(crear_modelo_aleatorio().state_dict(), model_path)
+
+            with self.assertRaises(FileNotFoundError):
+                GuitarSeparator(model_path, device="cpu", precision="int8")
+
+            quantized = quantize_int8(crear_modelo_aleatorio(), inputs)
+            export_torchscript(quantized, int8_artifact_path(model_path))
+            int8 = GuitarSeparator(model_path, device="cpu", precision="int8")
+
+        mask_fp32 = self.separator.run_model(inputs[0])
+        mask_int8 = int8.run_model(inputs[0])
+        self.assertEqual(mask_int8.dtype, torch.float32)
+        self.assertLess((mask_fp32 - mask_int8).abs().mean().item(), 0.05)
+
+    def test_calidad_fast_reduce_computo_del_modelo(self):
+        # "fast": el modelo ve frames agrupados de a 2 y sólo los bins bajo
+        # el corte (~4x menos elementos); la máscara vuelve a [F, T] y sobre
+        # el corte sigue la política fija
+        magnitude = torch.rand(1, 1025, 400, generator=torch.Generator().manual_seed(7))
+        elementos = {"full": 0, "fast": 0}
+        run_model = self.separator.run_model
+
+        for quality in elementos:
+            def contar(x, quality=quality):
+                elementos[quality] += x.numel()
+                return run_model(x)
+            with mock.patch.object(self.separator, "run_model", side_effect=contar):
+                mask = self.separator.predict_mask(magnitude, 3, quality=quality)
+            self.assertEqual(mask.shape, (1025, 400))
+
+        self.assertLessEqual(elementos["fast"] * 3.5, elementos["full"])
+        corte = self.separator.fast_cutoff_bin(1025)
+        self.assertEqual(corte, 512)
+        self.assertTrue(torch.equal(mask[corte:], mask[corte:corte + 1].expand(1025 - corte, -1)))
+
+        fijo = crear_separador(quality="fast", fast_high_mask=0.3)
+        self.assertTrue(torch.all(fijo.predict_mask(magnitude, 3)[corte:] == 0.3))
+        with self.assertRaises(ValueError):
+            self.separator.predict_mask(magnitude, 3, quality="draft")
+
+    def test_precision_invalida(self):
+        with self.assertRaises(ValueError):
+            crear_separador(precision="fp8")
+
+    @unittest.skipUnless(ONNX_DISPONIBLE, "onnx/onnxruntime no instalados")
+    def test_backend_onnx_paridad_con_torch(self):
+        magnitude = self.magnitud_sintetica(frames=150, bins=100)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, "guitarnet_model.pth")
+            torch.save(crear_modelo_aleatorio().state_dict(), model_path)
+            onnx_sep = GuitarSeparator(model_path, backend="onnx", num_threads=1)
+            self.assertTrue(os.path.exists(os.path.join(tmp, "guitarnet_model.onnx")))
+
+        mask_torch = self.separator.process_long_audio_mask(magnitude, 64)
+        mask_onnx = onnx_sep.process_long_audio_mask(magnitude, 64)
+        self.assertTrue(torch.allclose(mask_torch, mask_onnx, atol=1e-4))
+
+    def test_backend_remoto_agrupa_chunks_de_varios_jobs(self):
+        # Dos "jobs" concurrentes contra el servidor: mismas máscaras que en
+        # local y sus chunks comparten forwards (batching dinámico)
+        magnitudes = [self.magnitud_sintetica(frames=100), self.magnitud_sintetica(frames=100) * 0.5]
+        esperadas = [self.separator.process_long_audio_mask(m, 64, max_batch=1) for m in magnitudes]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            socket_path = os.path.join(tmp, "guitarnet.sock")
+            server = GuitarNetServer(socket_path, self.separator, max_batch=8, window_ms=500)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                remoto = GuitarSeparator(None, backend="remote", server_address=socket_path)
+                resultados = [None, None]
+
+                def job(i):
+                    resultados[i] = remoto.process_long_audio_mask(magnitudes[i], 64, max_batch=1)
+
+                hilos = [threading.Thread(target=job, args=(i,)) for i in range(2)]
+                for hilo in hilos:
+                    hilo.start()
+                for hilo in hilos:
+                    hilo.join()
+                stats = remoto.client.ping()
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        for esperada, resultado in zip(esperadas, resultados):
+            self.assertTrue(torch.allclose(esperada, resultado, atol=1e-5))
+        self.assertEqual(stats["requests"], 2 * self.separator.num_chunks(100, 64))
+        self.assertLess(stats["forwards"], stats["requests"])
+
+    def test_cliente_reintenta_solo_conexion_caida(self):
+        # Conexión reutilizada y cerrada por el servidor: se reconecta una
+        # vez; un timeout esperando la respuesta no repite el forward
+        import socket
+        import guitarnet_server
+
+        with tempfile.TemporaryDirectory() as tmp:
+            socket_path = os.path.join(tmp, "guitarnet.sock")
+            server = GuitarNetServer(socket_path, self.separator)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                client = guitarnet_server.GuitarNetClient(socket_path)
+                caida, extremo = socket.socketpair(socket.AF_UNIX)
+                extremo.close()
+                client._local.sock = caida
+                self.assertIn("requests", client.ping())
+            finally:
+                server.shutdown()
+                server.server_close()
+
+            mudo_path = os.path.join(tmp, "mudo.sock")
+            mudo = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            mudo.bind(mudo_path)
+            mudo.listen()
+            try:
+                client = guitarnet_server.GuitarNetClient(mudo_path, timeout=0.2)
+                with mock.patch.object(guitarnet_server, "send_message",
+                                       wraps=guitarnet_server.send_message) as send, \
+                     self.assertRaises(socket.timeout):
+                    client.forward(torch.zeros(1, 1, 4, 4))
+                self.assertEqual(send.call_count, 1)
+            finally:
+                mudo.close()
+
+    def test_pesos_convertidos_cargan_con_mmap_y_coinciden(self):
+        # .pth re-guardado (y .safetensors si está instalado): misma máscara
+        magnitude = self.magnitud_sintetica(frames=64, bins=100)
+        esperada = self.separator.process_long_audio_mask(magnitude, 64)
+        formatos = [("pth", ".mmap.pth")]
+        if SAFETENSORS_DISPONIBLE:
+            formatos.append(("safetensors", ".safetensors"))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, "guitarnet_model.pth")
+            torch.save(crear_modelo_aleatorio().state_dict(), model_path)
+            for fmt, suffix in formatos:
+                output_path = os.path.join(tmp, "guitarnet_model" + suffix)
+                convert_weights(model_path, output_path, fmt)
+                separador = GuitarSeparator(output_path, device="cpu")
+                mask = separador.process_long_audio_mask(magnitude, 64)
+                self.assertTrue(torch.allclose(esperada, mask, atol=1e-6), fmt)
+
+    def test_carga_checkpoints_legacy_y_con_objetos_de_python(self):
+        # weights_only rechaza objetos arbitrarios (UnpicklingError) y mmap
+        # el formato legacy (RuntimeError): ambos caen a la carga completa
+        from collections import Counter
+        from guitarnet_inference import load_state_dict_file
+
+        pesos = {"w": torch.arange(4.0)}
+        with tempfile.TemporaryDirectory() as tmp:
+            con_objetos = os.path.join(tmp, "con_objetos.pth")
+            legacy = os.path.join(tmp, "legacy.pth")
+            torch.save({**pesos, "meta": Counter(epocas=3)}, con_objetos)
+            torch.save(pesos, legacy, _use_new_zipfile_serialization=False)
+
+            cargado = load_state_dict_file(con_objetos)
+            self.assertEqual(cargado["meta"], Counter(epocas=3))
+            self.assertTrue(torch.equal(cargado["w"], pesos["w"]))
+            self.assertTrue(torch.equal(load_state_dict_file(legacy)["w"], pesos["w"]))
+
+    def test_compuerta_de_energia_omite_chunks_en_silencio(self):
+        # Primera mitad con señal, segunda mitad en silencio digital
+        magnitude = self.magnitud_sintetica(frames=400, bins=64)
+        magnitude[..., 200:] = 0
+        stats = {}
+        mask = self.separator.process_long_audio_mask(magnitude, 64, stats=stats)
+
+        self.assertEqual(stats["chunks_total"], self.separator.num_chunks(400, 64))
+        self.assertGreater(stats["chunks_skipped"], 0)
+        # Los chunks que empiezan en el frame 224 o después están en silencio
+        self.assertEqual(mask[:, 256:].abs().max().item(), 0.0)
+
+    def test_stitch_context_cubre_la_pista_con_menos_forwards(self):
+        # Las ventanas trapezoidales suman 1 en cada frame (sin huecos ni
+        # doble peso) y se necesitan menos chunks que con 50% de overlap
+        separator = crear_separador(stitch="context", context_frames=8, crossfade_frames=4)
+        for total in (40, 64, 333):
+            peso = torch.zeros(total)
+            for start, end, window in separator.stitch_plan(total, 64):
+                self.assertLessEqual(end - start, 64)
+                peso[start:end] += window
+            self.assertTrue(torch.allclose(peso, torch.ones(total), atol=1e-6))
+
+        stats = {}
+        mask = separator.process_long_audio_mask(self.magnitud_sintetica(frames=333), 64, stats=stats)
+        self.assertEqual(mask.shape, (64, 333))
+        self.assertEqual(stats["chunks_total"], separator.num_chunks(333, 64))
+        self.assertLess(stats["chunks_total"], self.separator.num_chunks(333, 64))
+
+        # Con overrides por llamada el conteo sigue al plan efectivo
+        for kwargs in ({"stitch": "hann", "overlap": 0.75}, {"context_frames": 2}, {"overlap": 0.25}):
+            self.assertEqual(separator.num_chunks(333, 64, **kwargs),
+                             len(separator.stitch_plan(333, 64, **kwargs)), kwargs)
+            self.assertEqual(self.separator.num_chunks(333, 64, **kwargs),
+                             len(self.separator.stitch_plan(333, 64, **kwargs)), kwargs)
+
+        with self.assertRaises(ValueError):
+            crear_separador(stitch="lineal")
+
+    def test_stem_en_silencio_omite_el_modelo(self):
+        sr = self.separator.target_sr
+        audio = np.zeros((sr, 2), dtype=np.float32)
+        audio[::100] = 1e-6  # ~ -100 dBFS
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, "other.wav")
+            sf.write(input_path, audio, sr)
+            stats = {}
+            guitar_path, _ = self.separator.separate(input_path, tmp, stats=stats)
+            guitar, _ = sf.read(str(guitar_path))
+
+        self.assertTrue(stats["model_skipped"])
+        self.assertEqual(stats["chunks_skipped"], stats["chunks_total"])
+        self.assertEqual(np.abs(guitar).max(), 0.0)
+
+
+class GuitarNetReadyViewTests(SimpleTestCase):
+    def test_readiness_refleja_carga_y_warmup(self):
+        from audios.services import guitar_service
+
+        estado = {"loaded": True, "warmed_up": False, "load_seconds": 1.5,
+                  "warmup_seconds": None, "pid": os.getpid()}
+        with mock.patch.dict(guitar_service.guitarnet_status, estado):
+            response = self.client.get("/api/audios/guitarnet/ready")
+            self.assertEqual(response.status_code, 503)
+            self.assertFalse(response.json()["ready"])
+
+            guitar_service.guitarnet_status.update(warmed_up=True, warmup_seconds=0.8)
+            response = self.client.get("/api/audios/guitarnet/ready")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["load_seconds"], 1.5)
+
+
+class RerenderGuitarViewTests(SimpleTestCase):
+    def test_parametros_que_no_son_numeros_responden_400(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from audios import views
+
+        archivo = mock.MagicMock()
+        archivo.audio_in.estado = "procesado"
+        archivo.pistas.filter.return_value = [
+            mock.Mock(instrumento="guitar", ruta_pista_out="/tmp/no_existe/guitar.wav")
+        ]
+        with mock.patch.object(views.ArchivoAudio, "objects") as objects, \
+             mock.patch("audios.views.os.path.exists", return_value=True):
+            objects.select_related.return_value.get.return_value = archivo
+            for body in ({"gamma": [1]}, {"high_boost_db": {"db": 3}}, {"gamma": "mucho"}, {"gamma": 9}):
+                request = APIRequestFactory().post("/api/audios/7/rerender", body, format="json")
+                force_authenticate(request, user=mock.Mock(is_authenticated=True, pk=1))
+                response = views.RerenderGuitarView.as_view()(request, audio_id=7)
+                self.assertEqual(response.status_code, 400, body)
+                self.assertIn("Parámetros inválidos", response.data["error"])
+
+
+class CalidadPorUploadTests(SimpleTestCase):
+    def test_upload_valida_quality_y_la_pasa_al_job(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from audios import views
+
+        archivo = SimpleUploadedFile("cancion.wav", b"RIFF", content_type="audio/wav")
+        request = APIRequestFactory().post(
+            "/api/audios/upload", {"archivo": archivo, "quality": "ultra"}, format="multipart"
+        )
+        force_authenticate(request, user=mock.Mock(is_authenticated=True, pk=1))
+        with mock.patch.object(views, "lanzar_procesamiento_asincrono") as lanzar:
+            response = views.AudioUploadView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Calidad de GuitarNet inválida", response.data["error"])
+        lanzar.assert_not_called()
+
+        # El hilo en background recibe la calidad y la pasa a procesar_cancion
+        with mock.patch.object(views.threading, "Thread") as thread:
+            views.lanzar_procesamiento_asincrono(1, 2, "cancion.wav", "/tmp/cancion.wav", 3, "ana",
+                                                 quality="fast")
+        self.assertEqual(thread.call_args.kwargs["args"][-1], "fast")
@@ -2,7 +2,8 @@
 from django.urls import path
 from .views import (
     AudioUploadView, AgregarPistaView, ObtenerAudioMongoView, ObtenerAudioPostgresView,
-    AudioStatusView, DownloadStemView, MyUploadsView, DeleteAudioView
+    AudioStatusView, DownloadStemView, MyUploadsView, DeleteAudioView, GuitarNetReadyView,
+    RerenderGuitarView
 )
 
 urlpatterns = [
@@ -14,11 +15,15 @@ urlpatterns = [
     # nuevos:
     path("<int:audio_id>/status",               AudioStatusView.as_view()),
     path("<int:audio_id>/download/<str:stem>",  DownloadStemView.as_view()),
+    path("<int:audio_id>/rerender",             RerenderGuitarView.as_view(), name="rerender-guitar"),
 
     # archivos que ya se han subido 
     path("mine/", MyUploadsView.as_view(), name="my-uploads"),
 
     # eliminar audios
     path("<int:audio_id>/", DeleteAudioView.as_view(), name="delete-audio"),
+
+    # readiness de GuitarNet (precarga + warm-up)
+    path("guitarnet/ready", GuitarNetReadyView.as_view(), name="guitarnet-ready"),
     
 ]
@@ -4,6 +4,7 @@ from rest_framework import status, permissions
 from .mongo_services import guardar_audio, agregar_pista, obtener_audio
 from .models import ProcesamientoAudio, ArchivoAudio, PistaSeparada
 from .metadata_utils import extraer_metadatos
+from .services import cancellation
 from django.http import JsonResponse, FileResponse, Http404
 from django.shortcuts import get_object_or_404
 from .mongo_services import get_collection
@@ -35,6 +36,28 @@ def safe_rmtree(path):
         print("No se pudo borrar carpeta", path, e)
 
 
+# -----------------
+# Estado de GuitarNet
+# -----------------
+
+class GuitarNetReadyView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        """
+        GET /api/audios/guitarnet/ready
+        Readiness del proceso: 200 si el modelo está cargado y con warm-up,
+        503 si no. Incluye tiempos de carga y warm-up.
+        """
+        from .services.guitar_service import guitarnet_ready, guitarnet_status
+
+        ready = guitarnet_ready()
+        return Response(
+            {"ready": ready, **guitarnet_status},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+
 # -----------------
 # Audios Subidos
 # -----------------
@@ -90,6 +113,34 @@ class AudioUploadView(APIView):
             nombre_audio = archivo_subido.name
             formato = nombre_audio.split(".")[-1]
 
+            # Stems pedidos (opcional): "stems=vocals" o "stems=vocals,guitar";
+            # sólo vocals usa Demucs en dos stems y sin guitar no corre GuitarNet
+            from .services.pipeline import STEMS, normalizar_stems
+            try:
+                stems_param = (request.data.getlist("stems") if hasattr(request.data, "getlist")
+                               else request.data.get("stems"))
+                stems = normalizar_stems(stems_param)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+
+            # Preset de Demucs (opcional): "demucs_preset=rapido" | "calidad"
+            # (DEMUCS_PRESETS); sólo se aceptan presets, no parámetros sueltos
+            from .services.demucs_service import preset_options
+            try:
+                opciones_demucs = preset_options(request.data.get("demucs_preset"))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+
+            # Calidad de GuitarNet (opcional): "quality=fast" para previews /
+            # plan gratuito; sin el campo se usa GUITARNET_QUALITY
+            from .services.guitar_service import guitar_quality
+            quality = request.data.get("quality") or None
+            try:
+                if quality is not None:
+                    guitar_quality(quality)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+
             base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
             input_dir = os.path.join(base_path, "input_audio")
             os.makedirs(input_dir, exist_ok=True)
@@ -122,6 +173,7 @@ class AudioUploadView(APIView):
                 title=metadata.get("title"),
                 artist=metadata.get("artist"),
                 album=metadata.get("album"),
+                stems_solicitados=None if stems == STEMS else list(stems),
             )
 
             archivo_pg = ArchivoAudio.objects.create(
@@ -138,6 +190,9 @@ class AudioUploadView(APIView):
                 user_id=request.user.id,
                 username=request.user.username,
                 audio_id_mongo=audio_id_mongo,
+                opciones_demucs=opciones_demucs,
+                stems=stems,
+                quality=quality,
             )
 
             # Responder rápido al frontend
@@ -146,6 +201,7 @@ class AudioUploadView(APIView):
                 "audio_id_mongo": audio_id_mongo,
                 "audio_id_postgres": audio_pg.id,
                 "archivo_id_postgres": archivo_pg.id,
+                "stems": list(stems),
             }, status=201)
 
         except Exception as e:
@@ -259,6 +315,10 @@ class AudioStatusView(APIView):
         return Response({
             "id": audio.id,
             "status": audio.estado,   # "procesando" | "procesado" | "error"
+            # Mientras procesa: demucs_cargando | demucs_separando | demucs_guardando | guitarnet
+            "etapa": audio.etapa,
+            "progreso": audio.progreso,  # 0-100 (None en guitarnet)
+            "stems_solicitados": audio.stems_solicitados,  # None = todos
             "title": audio.nombre_audio,
             "tamano_mb": float(audio.tamano_mb) if audio.tamano_mb is not None else None,
             "duracion": audio.duracion,
@@ -277,7 +337,9 @@ class DownloadStemView(APIView):
     def get(self, request, audio_id, stem):
         """
         GET /api/audios/<audio_id>/download/<stem>
-        - <stem> puede ser 'vocals', 'drums', 'bass', 'other' o 'all'
+        - <stem> puede ser 'vocals', 'drums', 'bass', 'guitar', 'other',
+          'instrumental' o 'all' ('all' = los stems que se separaron; si el
+          upload pidió sólo algunos, el ZIP trae sólo esos)
         Requiere que el audio pertenezca al usuario autenticado.
         """
         # 1) Validar que el audio le pertenece al usuario
@@ -380,6 +442,12 @@ class DownloadStemView(APIView):
         # 4) Caso: un solo stem (vocals/drums/bass/other…)
         pista = archivo.pistas.filter(instrumento=stem).first()
         if not pista or not pista.ruta_pista_out or not os.path.exists(pista.ruta_pista_out):
+            solicitados = archivo.audio_in.stems_solicitados
+            if solicitados and stem not in solicitados:
+                return Response(
+                    {"error": f"La pista '{stem}' no se pidió para este audio.", "stems": solicitados},
+                    status=404,
+                )
             raise Http404("Pista no disponible")
 
         return FileResponse(
@@ -387,6 +455,66 @@ class DownloadStemView(APIView):
             as_attachment=True,
             filename=os.path.basename(pista.ruta_pista_out),
         )
+
+
+# -----------------
+# Re-render de guitarra (sin modelo)
+# -----------------
+
+class RerenderGuitarView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, audio_id):
+        """
+        POST /api/audios/<audio_id>/rerender
+        Body (opcional): gamma, high_start_ratio, high_boost_db
+        Reescribe guitar / other aplicando esos parámetros a la máscara
+        guardada en la separación (guitar_mask.npz), sin correr GuitarNet.
+        """
+        from .services.guitar_service import mask_file, others_file, rerender_guitar
+
+        try:
+            archivo = ArchivoAudio.objects.select_related("audio_in").get(
+                audio_in__id=audio_id,
+                usuario=request.user
+            )
+        except ArchivoAudio.DoesNotExist:
+            raise Http404("No autorizado o no existe")
+
+        if archivo.audio_in.estado != "procesado":
+            return Response({"error": "El audio todavía no está procesado."}, status=409)
+
+        pistas = {p.instrumento: p for p in archivo.pistas.filter(instrumento__in=("guitar", "other"))}
+        if "guitar" not in pistas:
+            return Response({"error": "El audio no tiene pistas de guitarra."}, status=404)
+
+        # Con un subconjunto de stems sin "other" la pista no se registra,
+        # pero other.wav sigue junto a guitar.wav
+        guitar_path = pistas["guitar"].ruta_pista_out
+        stems_dir = os.path.dirname(guitar_path)
+        others_path = pistas["other"].ruta_pista_out if "other" in pistas else others_file(stems_dir)
+        mask_path = mask_file(stems_dir)
+        if not os.path.exists(mask_path):
+            return Response({"error": "No hay máscara guardada para este audio."}, status=404)
+
+        try:
+            result = rerender_guitar(
+                guitar_path,
+                others_path,
+                mask_path,
+                gamma=request.data.get("gamma"),
+                high_start_ratio=request.data.get("high_start_ratio"),
+                high_boost_db=request.data.get("high_boost_db"),
+            )
+        except (TypeError, ValueError) as e:
+            # Parámetros fuera de rango o que no son números (listas, dicts...)
+            return Response({"error": f"Parámetros inválidos: {e}"}, status=400)
+        except FileNotFoundError:
+            raise Http404("Pistas no disponibles en el almacenamiento.")
+
+        return Response({"id": audio_id, **result})
+
+
 # -----------------
 # Eliminar audio
 # -----------------
@@ -416,6 +544,10 @@ class DeleteAudioView(APIView):
         user_id = request.user.id
         audio_pg_id = ai.id
 
+        # Si el audio sigue procesándose, avisar al job antes de borrar sus
+        # archivos (otro proceso lo detecta al ver que el registro ya no está)
+        cancellation.cancel(audio_pg_id)
+
         # 2) borrar archivos físicos
         safe_rm(ai.ruta_almacenamiento_in)
         for pista in archivo.pistas.all():
@@ -461,6 +593,9 @@ def procesar_audio_en_background(
     user_id,
     username,
     audio_id_mongo=None,
+    opciones_demucs=None,
+    stems=None,
+    quality=None,
 ):
     """
     Se ejecuta en un hilo aparte:
@@ -468,9 +603,16 @@ def procesar_audio_en_background(
     - Crea las pistas en Postgres
     - Actualiza tamaño total y estado
     - Actualiza Mongo (si audio_id_mongo no es None)
+
+    opciones_demucs: parámetros de Demucs de este job sobre los de settings
+    (p.ej. menos shifts para el plan gratuito, ver demucs_options)
+    stems: stems pedidos en el upload (None = todos, ver normalizar_stems)
+    quality: calidad de GuitarNet pedida en el upload, "full" | "fast"
+    (None = GUITARNET_QUALITY)
     """
     from .models import ProcesamientoAudio, ArchivoAudio, PistaSeparada
     from .services.pipeline import procesar_cancion
+    from .services.demucs_progress import ETAPA_COMPLETADO
     from .mongo_services import agregar_pista, get_collection
     from .views import safe_rm  # ya lo tienes más abajo en este mismo archivo
 
@@ -488,16 +630,33 @@ def procesar_audio_en_background(
         )
         os.makedirs(output_root, exist_ok=True)
 
-        # CHECK FUNCTION: Si el registro en DB ya no existe, cancelamos.
-        def is_cancelled():
-            return not ProcesamientoAudio.objects.filter(id=audio_pg_id).exists()
+        # CHECK FUNCTION: DeleteAudioView enciende el token en este proceso;
+        # si el DELETE llegó a otro proceso, el registro ya no existe en DB
+        # (se consulta cada CANCEL_DB_CHECK_INTERVAL, no por línea)
+        is_cancelled = cancellation.register(
+            audio_pg_id,
+            db_check=lambda: not ProcesamientoAudio.objects.filter(id=audio_pg_id).exists(),
+        )
+
+        # Etapa y porcentaje para AudioStatusView (el parser ya limita la frecuencia)
+        def actualizar_progreso(etapa, progreso):
+            try:
+                ProcesamientoAudio.objects.filter(id=audio_pg_id).update(etapa=etapa, progreso=progreso)
+            except Exception as e:
+                print(f"⚠️ No se pudo actualizar el progreso de {audio_pg_id}: {e}")
 
         # Ejecutar pipeline completo (Demucs + GuitarNet)
+        metricas = {}
         stems = procesar_cancion(
             nombre_archivo=nombre_audio,
             output_dir=output_root,
             usuario=username,
-            check_cancelled=is_cancelled
+            check_cancelled=is_cancelled,
+            metricas=metricas,
+            on_progress=actualizar_progreso,
+            opciones_demucs=opciones_demucs,
+            stems=stems,
+            quality=quality
         )
 
         # Cargar objetos desde DB
@@ -537,7 +696,10 @@ def procesar_audio_en_background(
 
         # Actualizar estado final y tamaño total en Postgres
         audio_pg.estado = "procesado"
+        audio_pg.etapa = ETAPA_COMPLETADO
+        audio_pg.progreso = 100
         audio_pg.tamano_mb = total_mb
+        audio_pg.metricas = metricas
         audio_pg.save()
 
         # Actualizar estado en Mongo (opcional pero recomendable)
@@ -578,6 +740,7 @@ def procesar_audio_en_background(
                 pass
 
     finally:
+        cancellation.unregister(audio_pg_id)
         # Intentar borrar el archivo original (como ya hacías)
         try:
             safe_rm(ruta_guardada)
@@ -594,13 +757,17 @@ def lanzar_procesamiento_asincrono(
     user_id,
     username,
     audio_id_mongo=None,
+    opciones_demucs=None,
+    stems=None,
+    quality=None,
 ):
     """
     Crea y lanza el hilo en background.
     """
     hilo = threading.Thread(
         target=procesar_audio_en_background,
-        args=(audio_pg_id, archivo_pg_id, nombre_audio, ruta_guardada, user_id, username, audio_id_mongo),
+        args=(audio_pg_id, archivo_pg_id, nombre_audio, ruta_guardada, user_id, username, audio_id_mongo,
+              opciones_demucs, stems, quality),
         daemon=True,
     )
     hilo.start()
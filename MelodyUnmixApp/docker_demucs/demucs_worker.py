@@ -0,0 +1,536 @@
+"""
+🧠 DEMUCS WORKER PERSISTENTE - Modelo residente, jobs por socket
+Proyecto: Melody Unmix
+
+Con `docker run --rm` por canción cada upload paga crear el contenedor,
+importar Python + torch y cargar mdx_extra_q desde el volumen de caché.
+Este worker carga el modelo UNA vez y atiende jobs de separación por un
+socket (Unix o TCP) en orden de llegada, uno a la vez.
+
+Corre dentro de la imagen demucs:optimized (entrypoint.sh --worker) o
+localmente. Con --model stub no necesita demucs ni torch: reparte la
+mezcla en cuatro stems iguales (para desarrollo y tests sin Docker).
+
+Las rutas de los jobs son relativas a --input-root / --output-root (los
+volúmenes montados en el contenedor), y la salida queda igual que con
+`demucs -o`: <output-root>/<output>/<modelo>/<nombre>/{vocals,drums,bass,other}.wav
+(con la opción two_stems="vocals", como `--two-stems=vocals`: vocals.wav y
+no_vocals.wav)
+
+Protocolo (JSON por línea, en ambos sentidos):
+    petición: {"op": "separate", "file": "cancion.mp3", "output": "user_1/audio_2",
+               "options": {"shifts": 1, "overlap": 0.25, "segment": 8, "jobs": 0, "threads": 4}}
+              {"op": "ping"}
+    respuesta: {"event": "line", "line": "..."}*  (progreso)
+               {"event": "done", "path": "user_1/audio_2/mdx_extra_q/cancion"}
+               {"event": "error", "error": "..."}
+    Si el cliente cierra la conexión, el job se descarta: no se ejecuta si
+    seguía en cola, y si ya estaba corriendo no se guardan sus stems.
+
+Uso:
+    python demucs_worker.py --socket /run/demucs/demucs.sock --input-root /input --output-root /output
+    python demucs_worker.py --listen 0.0.0.0:7777 --input-root ./input_audio --output-root ./output_audio
+    python demucs_worker.py --model stub --socket /tmp/demucs.sock ...
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import queue
+import select
+import socket
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_MODEL = "mdx_extra_q"
+STUB_MODEL = "stub"
+SOURCES = ("drums", "bass", "other", "vocals")
+
+# Parámetros de rendimiento por job: (tipo, mínimo, máximo). Los mismos
+# que la CLI (--segment, --shifts, --overlap, -j) más los hilos de torch
+DEMUCS_OPTIONS = {
+    "segment": (int, 1, 60),       # segundos por trozo (menos memoria)
+    "shifts": (int, 0, 10),        # predicciones con desplazamiento (calidad x tiempo)
+    "overlap": (float, 0.0, 0.99),  # solapamiento entre trozos
+    "jobs": (int, 0, 64),          # procesos en paralelo (memoria x jobs)
+    "threads": (int, 1, 256),      # hilos de torch (OMP_NUM_THREADS)
+}
+
+# Modo de dos stems (`--two-stems`): <stem>.wav y no_<stem>.wav
+TWO_STEMS = "two_stems"
+
+# Flags de la CLI de demucs / variables de entorno de entrypoint.sh
+CLI_FLAGS = {"segment": "--segment", "shifts": "--shifts", "overlap": "--overlap", "jobs": "-j",
+             TWO_STEMS: "--two-stems"}
+
+
+def validate_options(options):
+    """
+    Normaliza los parámetros de Demucs (acepta strings, p.ej. de variables
+    de entorno). None o "" = default de Demucs (se omite). Además de
+    DEMUCS_OPTIONS acepta two_stems (uno de SOURCES).
+
+    Raises:
+        ValueError: parámetro desconocido, de tipo inválido o fuera de rango
+    """
+    valid = {}
+    for key, value in (options or {}).items():
+        if key not in DEMUCS_OPTIONS and key != TWO_STEMS:
+            raise ValueError(f"Parámetro de Demucs desconocido: {key!r} "
+                             f"(opciones: {tuple(DEMUCS_OPTIONS) + (TWO_STEMS,)})")
+        if value is None or value == "":
+            continue
+        if key == TWO_STEMS:
+            if value not in SOURCES:
+                raise ValueError(f"{TWO_STEMS} debe ser uno de {SOURCES}, no {value!r}")
+            valid[key] = value
+            continue
+        kind, low, high = DEMUCS_OPTIONS[key]
+        try:
+            if isinstance(value, bool) or (kind is int and float(value) != int(float(value))):
+                raise ValueError
+            value = kind(float(value)) if kind is int else kind(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"{key} debe ser {kind.__name__}, no {value!r}") from None
+        if not low <= value <= high:
+            raise ValueError(f"{key} debe estar entre {low} y {high}, no {value}")
+        valid[key] = value
+    return valid
+
+
+def two_stem_sources(sources, stem):
+    """{stem: x, no_<stem>: suma del resto} a partir de {nombre: audio} (como --two-stems)"""
+    rest = [audio for name, audio in sources.items() if name != stem]
+    return {stem: sources[stem], f"no_{stem}": sum(rest[1:], rest[0])}
+
+
+def cli_args(options):
+    """Argumentos de `demucs` para `options` ya validadas (threads va por entorno)"""
+    args = []
+    for key, flag in CLI_FLAGS.items():
+        if key in options:
+            args += [flag, str(options[key])]
+    return args
+
+
+# =====================================================
+# 1) PROTOCOLO
+# =====================================================
+def send_event(wfile, message):
+    wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+    wfile.flush()
+
+
+def parse_address(address):
+    """'host:puerto' → (host, puerto) TCP; cualquier otra cosa es un socket Unix"""
+    address = str(address)
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit() and not address.startswith(("/", ".")):
+        return host, int(port)
+    return address
+
+
+def connect(address, timeout=None):
+    """Socket conectado al worker en `address` (ver parse_address)"""
+    target = parse_address(address)
+    family = socket.AF_INET if isinstance(target, tuple) else socket.AF_UNIX
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(target)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+# =====================================================
+# 2) SEPARADORES
+# =====================================================
+class ProgressWriter:
+    """
+    Archivo de texto que reenvía a `emit` cada redibujado de tqdm (separa
+    por '\r' y '\n'), así las barras de apply_model llegan al cliente con
+    el mismo formato que la CLI de demucs (ver DemucsProgressParser).
+    """
+
+    def __init__(self, emit):
+        self.emit = emit
+        self._partial = ""
+
+    def write(self, text):
+        parts = (self._partial + text).replace("\r", "\n").split("\n")
+        self._partial = parts.pop()
+        for part in parts:
+            if part.strip():
+                self.emit(part.strip())
+        return len(text)
+
+    def flush(self):
+        if self._partial.strip():
+            self.emit(self._partial.strip())
+        self._partial = ""
+
+
+class _ThreadStderr:
+    """
+    sys.stderr que reenvía la salida al writer del hilo actual (ver
+    capture_stderr); los demás hilos siguen escribiendo en el stderr real.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, "writer", None) or self.default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+_stderr_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def capture_stderr(writer):
+    """
+    Manda a `writer` lo que el hilo actual escriba en sys.stderr (las barras
+    de tqdm de apply_model se crean y dibujan en el hilo que lo llama).
+
+    A diferencia de contextlib.redirect_stderr no reemplaza el stderr del
+    resto del proceso: con el backend "local" Demucs corre dentro de Django
+    junto a requests y jobs de GuitarNet.
+    """
+    with _stderr_lock:
+        if not isinstance(sys.stderr, _ThreadStderr):
+            sys.stderr = _ThreadStderr(sys.stderr)
+        proxy = sys.stderr
+    previous = getattr(proxy.local, "writer", None)
+    proxy.local.writer = writer
+    try:
+        yield
+    finally:
+        proxy.local.writer = previous
+
+
+def progress_bar(percent):
+    """Línea con el formato de tqdm ('NN%|███   |')"""
+    return f"{percent:3d}%|{'█' * (percent // 10):<10}|"
+
+
+class DemucsSeparator:
+    """Modelo de Demucs cargado una sola vez (mismo resultado que `demucs -n <modelo>`)"""
+
+    def __init__(self, name=DEFAULT_MODEL, device="cpu", shifts=1, overlap=0.25, jobs=0):
+        import torch
+        from demucs.pretrained import get_model
+
+        self.torch = torch
+        self.name = name
+        self.device = device
+        self.shifts = shifts
+        self.overlap = overlap
+        self.jobs = jobs
+        self.threads = torch.get_num_threads()
+        self.model = get_model(name)
+        self.model.to(device)
+        self.model.eval()
+
+    @contextlib.contextmanager
+    def num_threads(self, threads=None):
+        """
+        Hilos de torch para un job (None = los del arranque). Son globales al
+        proceso: se restauran al terminar para no afectar a lo demás que
+        corra en él (con el backend "local", Django y GuitarNet).
+        """
+        previous = self.torch.get_num_threads()
+        self.torch.set_num_threads(threads or self.threads)
+        try:
+            yield
+        finally:
+            self.torch.set_num_threads(previous)
+
+    def separate(self, input_path, output_dir, emit, cancelled, options=None):
+        from demucs.apply import apply_model
+        from demucs.audio import AudioFile, save_audio
+
+        options = options or {}
+        # Mismo formato que la CLI de demucs (lo reconoce DemucsProgressParser)
+        models = getattr(self.model, "models", None)
+        if models:
+            emit(f"Selected model is a bag of {len(models)} models. "
+                 "You will see that many progress bars per track.")
+        emit(f"Separating track {input_path}")
+        wav = AudioFile(input_path).read(
+            streams=0, samplerate=self.model.samplerate, channels=self.model.audio_channels
+        )
+        ref = wav.mean(0)
+        wav = (wav - ref.mean()) / ref.std()
+        # tqdm escribe en sys.stderr: sólo lo de este hilo va a `emit`
+        writer = ProgressWriter(emit)
+        with self.torch.no_grad(), capture_stderr(writer), self.num_threads(options.get("threads")):
+            sources = apply_model(
+                self.model, wav[None], device=self.device, shifts=options.get("shifts", self.shifts),
+                split=True, overlap=options.get("overlap", self.overlap), progress=True,
+                num_workers=options.get("jobs", self.jobs), segment=options.get("segment")
+            )[0]
+        writer.flush()
+        sources = sources * ref.std() + ref.mean()
+        if cancelled():
+            return False
+
+        sources = dict(zip(self.model.sources, sources))
+        if TWO_STEMS in options:
+            sources = two_stem_sources(sources, options[TWO_STEMS])
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for name, source in sources.items():
+            save_audio(source, str(output_dir / f"{name}.wav"), samplerate=self.model.samplerate,
+                       clip="rescale", bits_per_sample=16)
+        return True
+
+
+class StubSeparator:
+    """
+    Reemplazo local de Demucs sin modelo: cada stem es 1/4 de la mezcla
+    (la suma reconstruye la entrada). Sólo para desarrollo y tests.
+    """
+
+    name = STUB_MODEL
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def separate(self, input_path, output_dir, emit, cancelled, options=None):
+        import soundfile as sf
+
+        emit(f"Separating track {input_path}")
+        data, sr = sf.read(str(input_path), dtype="float32", always_2d=True)
+        # Una barra como la de apply_model, repartiendo `delay`
+        for percent in range(0, 101, 25):
+            emit(progress_bar(percent))
+            if percent < 100:
+                time.sleep(self.delay / 4)
+        if cancelled():
+            return False
+
+        sources = {name: data / len(SOURCES) for name in SOURCES}
+        if options and TWO_STEMS in options:
+            sources = two_stem_sources(sources, options[TWO_STEMS])
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for name, source in sources.items():
+            sf.write(str(output_dir / f"{name}.wav"), source, sr, subtype="PCM_16")
+        return True
+
+
+def load_separator(name=DEFAULT_MODEL, device="cpu", delay=0.0):
+    """Separador residente: Demucs `name`, o StubSeparator si name == 'stub'"""
+    if name == STUB_MODEL:
+        return StubSeparator(delay=delay)
+    return DemucsSeparator(name, device=device)
+
+
+# =====================================================
+# 3) COLA DE JOBS
+# =====================================================
+class _Job:
+    def __init__(self, file, output, options=None):
+        self.file = file
+        self.output = output
+        self.options = options or {}
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+
+
+class JobRunner:
+    """Ejecuta los jobs de a uno, en orden de llegada, con el modelo residente"""
+
+    def __init__(self, separator, input_root, output_root):
+        self.separator = separator
+        self.input_root = Path(input_root).resolve()
+        self.output_root = Path(output_root).resolve()
+        self.queue = queue.Queue()
+        # Contadores que cambian los hilos de las conexiones y el del runner
+        self.stats = {"jobs": 0, "failed": 0, "cancelled": 0, "queued": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="demucs-worker", daemon=True)
+        self._thread.start()
+
+    def _resolve(self, root, relative):
+        """Ruta dentro de `root`; rechaza rutas que se salen del volumen"""
+        path = (root / relative).resolve()
+        if path != root and root not in path.parents:
+            raise ValueError(f"Ruta fuera de {root}: {relative}")
+        return path
+
+    def _count(self, key, delta=1):
+        with self._stats_lock:
+            self.stats[key] += delta
+
+    def snapshot(self):
+        """Copia consistente de los contadores (para ping)"""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def submit(self, file, output, options=None):
+        job = _Job(file, output, options)
+        self._count("queued")
+        self.queue.put(job)
+        return job
+
+    def _loop(self):
+        while True:
+            job = self.queue.get()
+            self._count("queued", -1)
+            if job.cancelled.is_set():
+                self._count("cancelled")
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        def emit(line):
+            job.events.put({"event": "line", "line": line})
+
+        try:
+            input_path = self._resolve(self.input_root, job.file)
+            if not input_path.is_file():
+                raise FileNotFoundError(f"No se encontró el archivo {job.file}")
+            relative = Path(job.output) / self.separator.name / input_path.stem
+            output_dir = self._resolve(self.output_root, relative)
+
+            if job.options:
+                emit(f"Parámetros: {json.dumps(job.options, sort_keys=True)}")
+            t0 = time.perf_counter()
+            done = self.separator.separate(input_path, output_dir, emit, job.cancelled.is_set, job.options)
+            if not done:
+                self._count("cancelled")
+                job.events.put({"event": "error", "error": "CANCELLED_BY_USER"})
+                return
+            emit(f"Separación completada en {time.perf_counter() - t0:.1f}s.")
+            self._count("jobs")
+            job.events.put({"event": "done", "path": relative.as_posix()})
+        except Exception as e:
+            self._count("failed")
+            job.events.put({"event": "error", "error": f"{type(e).__name__}: {e}"})
+
+
+# =====================================================
+# 4) SERVIDOR
+# =====================================================
+class _Handler(socketserver.StreamRequestHandler):
+    def _client_gone(self):
+        """El cliente cerró la conexión (se detecta sin esperar a enviarle algo)"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def handle(self):
+        runner = self.server.runner
+        for raw in self.rfile:
+            try:
+                request = json.loads(raw)
+            except ValueError:
+                send_event(self.wfile, {"event": "error", "error": "JSON inválido"})
+                return
+
+            if request.get("op") == "ping":
+                send_event(self.wfile, {"ok": True, "model": runner.separator.name, **runner.snapshot()})
+                continue
+            if request.get("op") != "separate" or not request.get("file"):
+                send_event(self.wfile, {"event": "error", "error": f"op inválida: {request.get('op')!r}"})
+                continue
+
+            try:
+                options = validate_options(request.get("options"))
+            except ValueError as e:
+                send_event(self.wfile, {"event": "error", "error": str(e)})
+                continue
+
+            job = runner.submit(request["file"], request.get("output", ""), options)
+            try:
+                while True:
+                    try:
+                        event = job.events.get(timeout=0.5)
+                    except queue.Empty:
+                        if self._client_gone():
+                            raise ConnectionAbortedError
+                        continue
+                    send_event(self.wfile, event)
+                    if event["event"] != "line":
+                        break
+            except OSError:
+                # El cliente se fue (cancelación): descartar el job
+                job.cancelled.set()
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(address, separator, input_root, output_root):
+    """Servidor del worker en `address` (socket Unix o 'host:puerto')"""
+    target = parse_address(address)
+    if isinstance(target, tuple):
+        server = _TCPServer(target, _Handler)
+    else:
+        if os.path.exists(target):
+            os.remove(target)
+        server = _UnixServer(target, _Handler)
+    server.runner = JobRunner(separator, input_root, output_root)
+    return server
+
+
+def close_server(server):
+    server.server_close()
+    if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
+
+
+# =====================================================
+# 5) CLI
+# =====================================================
+def main():
+    parser = argparse.ArgumentParser(description="🧠 Demucs - Worker persistente")
+    parser.add_argument("--socket", type=str, default=None, help="Ruta del socket Unix")
+    parser.add_argument("--listen", type=str, default=None, help="host:puerto TCP (p.ej. 0.0.0.0:7777)")
+    parser.add_argument("--input-root", type=str, default="/input")
+    parser.add_argument("--output-root", type=str, default="/output")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help=f"Modelo de Demucs o '{STUB_MODEL}'")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    address = args.listen or args.socket or "/tmp/demucs.sock"
+    print(f"Cargando modelo {args.model}...", flush=True)
+    separator = load_separator(args.model, device=args.device)
+    server = create_server(address, separator, args.input_root, args.output_root)
+    print(f"Worker Demucs escuchando en {address} (modelo {args.model})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_server(server)
+
+
+if __name__ == "__main__":
+    main()
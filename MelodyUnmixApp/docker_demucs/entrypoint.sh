@@ -1,6 +1,12 @@
 #!/bin/bash
 set -e
 
+# Worker persistente: modelo residente, jobs por socket (ver demucs_worker.py)
+if [ "$1" = "--worker" ]; then
+  shift
+  exec python /app/demucs_worker.py "$@"
+fi
+
 if [ -z "$1" ]; then
   echo "Debes indicar el nombre del archivo (por ejemplo: cancion.mp3)"
   exit 1
@@ -13,6 +19,20 @@ if [ ! -f "$INPUT_FILE" ]; then
   exit 1
 fi
 
+# Parámetros de rendimiento (docker run -e DEMUCS_SHIFTS=1 ...), ya
+# validados en Django (demucs_worker.validate_options). Vacío = default de Demucs
+ARGS=()
+if [ -n "$DEMUCS_SEGMENT" ]; then ARGS+=(--segment "$DEMUCS_SEGMENT"); fi
+if [ -n "$DEMUCS_SHIFTS" ]; then ARGS+=(--shifts "$DEMUCS_SHIFTS"); fi
+if [ -n "$DEMUCS_OVERLAP" ]; then ARGS+=(--overlap "$DEMUCS_OVERLAP"); fi
+if [ -n "$DEMUCS_JOBS" ]; then ARGS+=(-j "$DEMUCS_JOBS"); fi
+# Sólo vocals / no_vocals (karaoke): DEMUCS_TWO_STEMS=vocals
+if [ -n "$DEMUCS_TWO_STEMS" ]; then ARGS+=(--two-stems "$DEMUCS_TWO_STEMS"); fi
+if [ -n "$DEMUCS_THREADS" ]; then
+  export OMP_NUM_THREADS="$DEMUCS_THREADS" MKL_NUM_THREADS="$DEMUCS_THREADS"
+fi
+
 echo "Procesando $INPUT_FILE con Demucs (mdx_extra_q)..."
-demucs -n mdx_extra_q -o /output "$INPUT_FILE"
+echo "Parámetros: ${ARGS[*]:-default} (hilos: ${DEMUCS_THREADS:-default})"
+demucs -n mdx_extra_q -o /output "${ARGS[@]}" "$INPUT_FILE"
 echo "Separación completada. Archivos disponibles en /output/mdx_extra_q/"
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+🦄 Configuración de gunicorn - Melody Unmix
+
+Uso (desde la carpeta de manage.py):
+    gunicorn MelodyUnmixApp.wsgi -c gunicorn.conf.py
+
+preload_app carga Django (y con él GuitarNet, vía AudiosConfig.ready) una
+sola vez en el master antes del fork: los pesos quedan compartidos entre
+workers por copy-on-write y ningún worker paga torch.load en su primer
+upload. Cada worker hace su warm-up después del fork (los hilos de
+oneDNN/OpenMP y el allocator no sobreviven al fork).
+"""
+import os
+
+from decouple import config
+
+bind = config("GUNICORN_BIND", default="0.0.0.0:8000")
+workers = config("GUNICORN_WORKERS", default=2, cast=int)
+# Los jobs de separación corren en hilos en background dentro del worker
+threads = config("GUNICORN_THREADS", default=4, cast=int)
+timeout = config("GUNICORN_TIMEOUT", default=120, cast=int)
+preload_app = True
+
+# Precargar GuitarNet en el master (ver settings.GUITARNET_PRELOAD)
+os.environ.setdefault("GUITARNET_PRELOAD", "true")
+
+
+def post_fork(server, worker):
+    """Warm-up de GuitarNet en cada worker recién creado"""
+    try:
+        from audios.services.guitar_service import guitarnet_status, warmup_guitar_separator
+
+        if guitarnet_status["loaded"] and not guitarnet_status["warmed_up"]:
+            warmup_guitar_separator()
+    except Exception as e:
+        server.log.warning(f"Warm-up de GuitarNet falló en worker {worker.pid}: {e}")
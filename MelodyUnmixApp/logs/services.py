@@ -1,4 +1,6 @@
 # logs/services.py
+import os
+import threading
 from pymongo import MongoClient
 from django.conf import settings
 from datetime import datetime
@@ -8,12 +10,33 @@ MONGO_URI = getattr(settings, "MONGO_URI", "mongodb://localhost:27017/")
 MONGO_DB = getattr(settings, "MONGO_DB", "melody_unmix")
 MONGO_COLLECTION = getattr(settings, "MONGO_LOG_COLLECTION", "logs")
 
+# Un MongoClient por proceso (tiene su propio pool de conexiones); se
+# recrea tras un fork (gunicorn preload_app) porque no es fork-safe
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
 def get_collection():
     """Devuelve la colección de logs en MongoDB"""
-    client = MongoClient(MONGO_URI)
-    db = client[MONGO_DB]
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(MONGO_URI)
+            _client_pid = os.getpid()
+    db = _client[MONGO_DB]
     return db[MONGO_COLLECTION]
 
+
+def log_document(event: str, user: str = None, extra: dict = None, timestamp: datetime = None):
+    """Documento de log con el formato de write_log"""
+    return {
+        "event": event,
+        "user": user,
+        "extra": extra or {},
+        "timestamp": timestamp or datetime.utcnow()
+    }
+
 def write_log(event: str, user: str = None, extra: dict = None):
     """
     Inserta un log en MongoDB.
@@ -21,12 +44,20 @@ def write_log(event: str, user: str = None, extra: dict = None):
     user: username o id del usuario (opcional)
     extra: diccionario con datos adicionales (opcional)
     """
-    doc = {
-        "event": event,
-        "user": user,
-        "extra": extra or {},
-        "timestamp": datetime.utcnow()
-    }
     collection = get_collection()
-    result = collection.insert_one(doc)
+    result = collection.insert_one(log_document(event, user, extra))
     return str(result.inserted_id)
+
+
+def write_logs_batch(docs: list) -> int:
+    """
+    Inserta varios logs (ver log_document) en un solo insert_many, p.ej. la
+    salida completa de Demucs al terminar el job en lugar de un insert por
+    línea.
+    Devuelve la cantidad insertada.
+    """
+    if not docs:
+        return 0
+    collection = get_collection()
+    result = collection.insert_many(docs, ordered=False)
+    return len(result.inserted_ids)
@@ -0,0 +1,478 @@
+"""
+⏱️ GuitarNet BENCHMARK - Comparación de modos de inferencia
+Proyecto: Melody Unmix
+
+Suites disponibles (--suite):
+    batching  loop secuencial de process_long_audio_mask (un chunk por
+              forward, max_batch=1) contra el modo por lotes
+    optimize  forward eager contra el modelo optimizado (BN folding +
+              channels_last + inference_mode) en el shape de un chunk
+    stitching unión de chunks 'hann' (50% overlap) contra 'context'
+              (margen + crossfade): forwards, tiempo y diferencia de
+              máscara/salida sobre audios de referencia (--reference). Si
+              junto a cada archivo hay un guitar.wav de referencia, se
+              reporta además el SDR de cada modo contra él.
+    rtf       barrido de separate() completo sobre mezclas estéreo
+              sintéticas: duraciones × chunk_duration × unión/overlap ×
+              hilos × backend:precisión. Cada configuración corre en un
+              subproceso y reporta real-time factor (tiempo / duración del
+              audio), pico de RSS y tiempos por etapa. El resultado se
+              guarda como JSON (--output) y se puede comparar con una
+              corrida anterior (--compare).
+
+Si no se indica --model (o no existe), se usa un modelo con pesos
+aleatorios: el costo de cómputo es el mismo que con el checkpoint real.
+
+Uso:
+    python benchmark_guitarnet.py --suite batching --duration 300 --max-batch 4
+    python benchmark_guitarnet.py --suite optimize --chunk-duration 30
+    python benchmark_guitarnet.py --suite stitching --reference "../output_audio/**/other.wav"
+    python benchmark_guitarnet.py --suite rtf --durations 30 180 --chunk-durations 10 30 \
+        --stitch hann:0.5 hann:0.25 context --threads-list 1 4 \
+        --configs torch:fp32 torch:int8 onnx:fp32 --output rtf.json --compare rtf_prev.json
+"""
+
+import argparse
+import copy
+import glob
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from guitarnet_inference import (
+    EfficientGuitarNet,
+    GuitarSeparator,
+    export_torchscript,
+    int8_artifact_path,
+    quantize_int8,
+)
+
+
+def build_separator(model_path=None, device="cpu", **kwargs):
+    """
+    Crea un GuitarSeparator; si no hay checkpoint, guarda pesos aleatorios
+    en un directorio temporal y los carga (con precision='int8' también
+    calibra el artefacto int8 con mezclas sintéticas).
+    """
+    if model_path and Path(model_path).exists():
+        return GuitarSeparator(model_path, device=device, **kwargs)
+
+    from calibrate_guitarnet import synthetic_chunk_inputs
+
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = os.path.join(tmp, "guitarnet_model.pth")
+        torch.save(EfficientGuitarNet().state_dict(), tmp_path)
+        if kwargs.get("precision") == "int8":
+            fp32 = GuitarSeparator(tmp_path, device="cpu")
+            inputs = list(synthetic_chunk_inputs(fp32, 2, 4))
+            quantized = quantize_int8(copy.deepcopy(fp32.model), inputs)
+            export_torchscript(quantized, int8_artifact_path(tmp_path))
+        return GuitarSeparator(tmp_path, device=device, **kwargs)
+
+
+def synthetic_magnitude(separator, duration, seed=0):
+    """Espectrograma de magnitud mono de una mezcla sintética [1, F, T]"""
+    gen = torch.Generator().manual_seed(seed)
+    num_samples = int(duration * separator.target_sr)
+    t = torch.arange(num_samples) / separator.target_sr
+    wave = 0.3 * torch.sin(2 * torch.pi * 196.0 * t) + 0.05 * torch.randn(num_samples, generator=gen)
+    magnitude, _ = separator.audio_to_spectrogram(wave.unsqueeze(0))
+    return magnitude
+
+
+def time_call(fn, repeats):
+    """Mejor tiempo (s) de `repeats` ejecuciones"""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def bench_batching(separator, duration, chunk_duration, max_batch, repeats):
+    """Secuencial (max_batch=1) vs lotes de max_batch chunks"""
+    magnitude = synthetic_magnitude(separator, duration)
+    chunk_size = int(chunk_duration * separator.target_sr / separator.hop_length)
+
+    t_seq, mask_seq = time_call(
+        lambda: separator.process_long_audio_mask(magnitude, chunk_size, max_batch=1),
+        repeats,
+    )
+    t_batch, mask_batch = time_call(
+        lambda: separator.process_long_audio_mask(magnitude, chunk_size, max_batch=max_batch),
+        repeats,
+    )
+
+    return {
+        "duration_s": duration,
+        "chunk_duration_s": chunk_duration,
+        "max_batch": max_batch,
+        "sequential_s": round(t_seq, 3),
+        "batched_s": round(t_batch, 3),
+        "speedup": round(t_seq / t_batch, 3) if t_batch > 0 else None,
+        "max_abs_diff": float((mask_seq - mask_batch).abs().max()),
+    }
+
+
+def bench_optimize(model_path, chunk_duration, repeats):
+    """Forward eager vs optimizado sobre un chunk [1, 1, F, T] con padding"""
+    eager = build_separator(model_path)
+    optimized = build_separator(model_path, optimize=True)
+
+    chunk_size = int(chunk_duration * eager.target_sr / eager.hop_length)
+    freq_bins = eager.n_fft // 2 + 1
+    chunk = torch.rand(freq_bins, chunk_size, generator=torch.Generator().manual_seed(0))
+    mag_input = eager.prepare_chunk(chunk).unsqueeze(0).unsqueeze(0)
+
+    # Warm-up (reserva de memoria / selección de kernels)
+    eager.run_model(mag_input)
+    optimized.run_model(mag_input)
+
+    t_eager, mask_eager = time_call(lambda: eager.run_model(mag_input), repeats)
+    t_opt, mask_opt = time_call(lambda: optimized.run_model(mag_input), repeats)
+
+    return {
+        "input_shape": list(mag_input.shape),
+        "eager_s": round(t_eager, 3),
+        "optimized_s": round(t_opt, 3),
+        "speedup": round(t_eager / t_opt, 3) if t_opt > 0 else None,
+        "max_abs_diff": float((mask_eager - mask_opt).abs().max()),
+    }
+
+
+# =====================================================
+# Suite rtf
+# =====================================================
+# Métodos de GuitarSeparator que se cronometran en separate(). Los tiempos
+# son inclusivos: predict_mask contiene run_model.
+STAGE_METHODS = (
+    "load_audio", "stft", "predict_mask", "run_model",
+    "enhance_guitar_mask", "istft", "normalize_audio",
+)
+
+
+def synthetic_stereo_mixture(duration, sr=44100, seed=0):
+    """
+    Mezcla estéreo [N, 2]: arpegio con armónicos (tipo guitarra) paneado a
+    la izquierda, bajo a la derecha y ruido de fondo.
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(duration * sr)) / sr
+    notes = 110.0 * 2 ** (np.array([0, 4, 7, 12]) / 12)
+    note = notes[(t * 4).astype(int) % len(notes)]
+    envelope = np.exp(-6 * (t % 0.25))
+    guitar = sum(np.sin(2 * np.pi * k * note * t) / k for k in range(1, 6)) * envelope
+    bass = np.sin(2 * np.pi * 55.0 * t)
+    left = 0.3 * guitar + 0.1 * bass + 0.01 * rng.randn(t.size)
+    right = 0.1 * guitar + 0.3 * bass + 0.01 * rng.randn(t.size)
+    return np.stack([left, right], axis=1).astype(np.float32)
+
+
+def instrument_stages(separator):
+    """Envuelve STAGE_METHODS de la instancia y acumula segundos por etapa"""
+    stages = {name: 0.0 for name in STAGE_METHODS}
+
+    for name in STAGE_METHODS:
+        original = getattr(separator, name)
+
+        def wrapper(*args, _original=original, _name=name, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                stages[_name] += time.perf_counter() - t0
+
+        setattr(separator, name, wrapper)
+    return stages
+
+
+def peak_rss_mb():
+    """Pico de RSS del proceso actual (ru_maxrss está en KB en Linux)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_rtf_config(model_path, config):
+    """
+    Una configuración del barrido (corre dentro del subproceso): carga el
+    separador, escribe la mezcla sintética y mide separate().
+    """
+    backend, precision = config["backend"], config["precision"]
+    rss_start = peak_rss_mb()
+    t0 = time.perf_counter()
+    separator = build_separator(
+        model_path,
+        precision=precision,
+        backend=backend,
+        num_threads=config["threads"],
+        stitch=config["stitch"],
+        overlap=config["overlap"],
+        context_frames=config["context_frames"],
+    )
+    load_s = time.perf_counter() - t0
+    rss_model = peak_rss_mb()
+
+    stages = instrument_stages(separator)
+    stats = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "other.wav")
+        sf.write(input_path, synthetic_stereo_mixture(config["duration_s"]), 44100, subtype="FLOAT")
+        t0 = time.perf_counter()
+        separator.separate(input_path, tmp, chunk_duration=config["chunk_duration_s"], stats=stats)
+        wall = time.perf_counter() - t0
+
+    stages["other"] = max(0.0, wall - sum(stages[k] for k in STAGE_METHODS if k != "run_model"))
+    return {
+        **config,
+        "load_s": round(load_s, 3),
+        "wall_s": round(wall, 3),
+        "rtf": round(wall / config["duration_s"], 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "model_rss_mb": round(rss_model - rss_start, 1),
+        "forwards": stats.get("chunks_total", 0) - stats.get("chunks_skipped", 0),
+        "stages_s": {k: round(v, 4) for k, v in stages.items()},
+    }
+
+
+def rtf_configs(args):
+    """Producto cartesiano de las opciones del barrido"""
+    stitches = []
+    for item in args.stitch:
+        mode, _, overlap = item.partition(":")
+        stitches.append((mode, float(overlap) if overlap else 0.5))
+    configs = [c.split(":") for c in args.configs]
+    for duration, chunk, (stitch, overlap), threads, (backend, precision) in itertools.product(
+        args.durations, args.chunk_durations, stitches, args.threads_list, configs
+    ):
+        yield {
+            "duration_s": duration,
+            "chunk_duration_s": chunk,
+            "stitch": stitch,
+            "overlap": overlap,
+            "context_frames": args.context_frames,
+            "threads": threads,
+            "backend": backend,
+            "precision": precision,
+        }
+
+
+CONFIG_KEYS = (
+    "duration_s", "chunk_duration_s", "stitch", "overlap", "context_frames",
+    "threads", "backend", "precision",
+)
+
+
+def config_key(config):
+    return tuple(config.get(k) for k in CONFIG_KEYS)
+
+
+def bench_rtf(args):
+    """
+    Corre cada configuración en un subproceso nuevo (pico de RSS aislado y
+    sin kernels calientes de la configuración anterior).
+    """
+    results = []
+    for config in rtf_configs(args):
+        print(f"▶ {config}")
+        cmd = [sys.executable, __file__, "--run-config", json.dumps(config)]
+        if args.model:
+            cmd += ["--model", args.model]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")]
+        if proc.returncode == 0 and lines:
+            result = json.loads(lines[-1][len("RESULT "):])
+            print(f"   rtf={result['rtf']}  peak_rss={result['peak_rss_mb']}MB")
+        else:
+            error = (proc.stderr.strip().splitlines() or ["sin salida"])[-1]
+            result = {**config, "error": error}
+            print(f"   error: {error}")
+        results.append(result)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": args.model if args.model and Path(args.model).exists() else "random",
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare_results(previous, current):
+    """Cambio de RTF por configuración respecto a una corrida anterior"""
+    before = {config_key(r): r for r in previous["results"] if "rtf" in r}
+    rows = []
+    for result in current["results"]:
+        old = before.get(config_key(result))
+        if old is None or "rtf" not in result:
+            continue
+        rows.append({
+            "config": dict(zip(CONFIG_KEYS, config_key(result))),
+            "rtf_before": old["rtf"],
+            "rtf_after": result["rtf"],
+            "speedup": round(old["rtf"] / result["rtf"], 3) if result["rtf"] else None,
+            "peak_rss_delta_mb": round(result["peak_rss_mb"] - old["peak_rss_mb"], 1),
+        })
+    return rows
+
+
+def sdr_db(reference, estimate):
+    """Signal-to-distortion ratio simple (dB) entre dos señales [C, N]"""
+    noise = (reference - estimate).pow(2).sum()
+    signal = reference.pow(2).sum()
+    return float(10 * torch.log10(signal.clamp(min=1e-12) / noise.clamp(min=1e-12)))
+
+
+def bench_stitching(separator, reference_paths, duration, chunk_duration, context_frames):
+    """
+    'hann' vs 'context' sobre cada audio de referencia (o uno sintético).
+    La salida se compara sin enhance_guitar_mask para aislar la unión.
+    """
+    chunk_size = int(chunk_duration * separator.target_sr / separator.hop_length)
+    items = [(path, Path(path).with_name("guitar.wav")) for path in reference_paths]
+    if not items:
+        items = [(None, None)]
+
+    results = []
+    for path, guitar_path in items:
+        if path is None:
+            magnitude = synthetic_magnitude(separator, duration)
+            spec = None
+        else:
+            waveform, _, _ = separator.load_audio(path)
+            spec = separator.stft(waveform)
+            magnitude = spec.mean(dim=0, keepdim=True).abs()
+
+        modes = {}
+        for stitch in ("hann", "context"):
+            stats = {}
+            t0 = time.perf_counter()
+            mask = separator.process_long_audio_mask(
+                magnitude, chunk_size, stats=stats, stitch=stitch, context_frames=context_frames
+            )
+            modes[stitch] = {"mask": mask, "seconds": time.perf_counter() - t0,
+                             "forwards": stats["chunks_total"] - stats["chunks_skipped"]}
+
+        entry = {
+            "file": path or f"sintetico_{duration}s",
+            "frames": magnitude.shape[-1],
+            "hann_forwards": modes["hann"]["forwards"],
+            "context_forwards": modes["context"]["forwards"],
+            "hann_s": round(modes["hann"]["seconds"], 3),
+            "context_s": round(modes["context"]["seconds"], 3),
+            "mask_mae": float((modes["hann"]["mask"] - modes["context"]["mask"]).abs().mean()),
+            "mask_max_abs": float((modes["hann"]["mask"] - modes["context"]["mask"]).abs().max()),
+        }
+
+        if spec is not None:
+            length = waveform.shape[-1]
+            guitar = {k: separator.istft(spec * v["mask"], length=length) for k, v in modes.items()}
+            entry["output_sdr_vs_hann_db"] = round(sdr_db(guitar["hann"], guitar["context"]), 2)
+            if guitar_path.exists():
+                target, _, _ = separator.load_audio(str(guitar_path))
+                target = target[..., :length]
+                for k, estimate in guitar.items():
+                    entry[f"{k}_sdr_db"] = round(sdr_db(target, estimate[..., :target.shape[-1]]), 2)
+        results.append(entry)
+
+    return {
+        "context_frames": context_frames,
+        "chunk_duration_s": chunk_duration,
+        "files": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="⏱️ GuitarNet - Benchmark de inferencia")
+    parser.add_argument("--suite", choices=["batching", "optimize", "stitching", "rtf"], default="batching")
+    parser.add_argument("--model", type=str, default=None, help="Checkpoint (.pth); aleatorio si no existe")
+    parser.add_argument("--duration", type=float, default=300, help="Duración del audio sintético en segundos")
+    parser.add_argument("--chunk-duration", type=float, default=30, help="Duración de chunk en segundos")
+    parser.add_argument("--max-batch", type=int, default=4, help="Chunks por forward en modo lotes")
+    parser.add_argument("--repeats", type=int, default=1, help="Repeticiones (se reporta el mejor tiempo)")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--reference", type=str, nargs="*", default=[],
+                        help="Stems 'other' de referencia para --suite stitching (admite globs)")
+    parser.add_argument("--context-frames", type=int, default=128, help="Margen de contexto para 'context'")
+    # Barrido --suite rtf
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 180],
+                        help="Duraciones de las mezclas sintéticas (s)")
+    parser.add_argument("--chunk-durations", type=float, nargs="+", default=[30])
+    parser.add_argument("--stitch", type=str, nargs="+", default=["hann:0.5", "context"],
+                        help="Unión de chunks: hann:<overlap> o context")
+    parser.add_argument("--threads-list", type=int, nargs="+", default=[os.cpu_count() or 1])
+    parser.add_argument("--configs", type=str, nargs="+", default=["torch:fp32"],
+                        help="Pares backend:precisión (torch:fp32, torch:bf16, torch:int8, onnx:fp32)")
+    parser.add_argument("--output", type=str, default="guitarnet_rtf.json", help="JSON de resultados")
+    parser.add_argument("--compare", type=str, default=None, help="JSON de una corrida anterior")
+    parser.add_argument("--run-config", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Subproceso del barrido rtf: una configuración y salida como JSON
+    if args.run_config:
+        result = run_rtf_config(args.model, json.loads(args.run_config))
+        print("RESULT " + json.dumps(result))
+        return
+
+    if args.suite == "rtf":
+        report = bench_rtf(args)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados guardados en: {args.output}")
+        if args.compare:
+            with open(args.compare) as f:
+                rows = compare_results(json.load(f), report)
+            print("\n" + "=" * 60)
+            print(f"COMPARACIÓN con {args.compare}")
+            print("=" * 60)
+            for row in rows:
+                print(f"   {row['config']}: rtf {row['rtf_before']} → {row['rtf_after']} "
+                      f"(x{row['speedup']}, RSS {row['peak_rss_delta_mb']:+}MB)")
+        return
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.suite == "batching":
+        separator = build_separator(args.model, max_batch=args.max_batch)
+        result = bench_batching(
+            separator, args.duration, args.chunk_duration, args.max_batch, args.repeats
+        )
+    elif args.suite == "optimize":
+        result = bench_optimize(args.model, args.chunk_duration, args.repeats)
+    else:
+        separator = build_separator(args.model, max_batch=args.max_batch)
+        reference = sorted({p for pattern in args.reference for p in glob.glob(pattern, recursive=True)})
+        result = bench_stitching(
+            separator, reference, args.duration, args.chunk_duration, args.context_frames
+        )
+
+    print("\n" + "=" * 60)
+    print(f"RESULTADOS - {args.suite}")
+    print("=" * 60)
+    for key, value in result.items():
+        print(f"   {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
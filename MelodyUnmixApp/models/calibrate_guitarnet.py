@@ -0,0 +1,159 @@
+"""
+🎚️ GuitarNet CALIBRACIÓN int8 + reporte de precisión
+Proyecto: Melody Unmix
+
+1. Genera inputs de calibración con el mismo preprocesamiento de
+   process_chunk (espectrograma mono → chunks → normalización + padding).
+2. Cuantiza el modelo a int8 (estático, FX) y guarda el artefacto
+   <modelo>.int8.ts junto al checkpoint.
+3. Reporta, por modo de precisión (fp32 / bf16 / int8), el error de la
+   máscara respecto a fp32 y el tiempo por chunk.
+
+Uso:
+    python calibrate_guitarnet.py --model guitarnet_model.pth \
+        --audio ../output_audio/**/other.wav --report precision_report.json
+
+Sin --audio se calibra con mezclas sintéticas (sirve para probar el flujo,
+pero los rangos de activación reales requieren stems 'other' reales).
+"""
+
+import argparse
+import copy
+import glob
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from guitarnet_inference import (
+    GuitarSeparator,
+    bf16_supported,
+    export_torchscript,
+    int8_artifact_path,
+    quantize_int8,
+)
+
+
+def iter_chunk_inputs(separator, audio_paths, chunk_duration, max_chunks):
+    """
+    Inputs [1, 1, F', T'] listos para el modelo, uno por chunk,
+    con el mismo preprocesamiento que process_chunk.
+    """
+    chunk_size = int(chunk_duration * separator.target_sr / separator.hop_length)
+    count = 0
+    for path in audio_paths:
+        _, waveform_mono, _ = separator.load_audio(path)
+        magnitude, _ = separator.audio_to_spectrogram(waveform_mono)
+        magnitude = magnitude.squeeze(0)
+        for start in range(0, magnitude.shape[-1], chunk_size):
+            chunk = magnitude[:, start:start + chunk_size]
+            if chunk.shape[-1] < chunk_size:
+                chunk = torch.nn.functional.pad(chunk, (0, chunk_size - chunk.shape[-1]))
+            yield separator.prepare_chunk(chunk).unsqueeze(0).unsqueeze(0)
+            count += 1
+            if count >= max_chunks:
+                return
+
+
+def synthetic_chunk_inputs(separator, chunk_duration, num_chunks, seed=0):
+    """Chunks sintéticos (tono + ruido) cuando no hay stems reales"""
+    gen = torch.Generator().manual_seed(seed)
+    num_samples = int(chunk_duration * separator.target_sr)
+    t = torch.arange(num_samples) / separator.target_sr
+    for i in range(num_chunks):
+        freq = 110.0 * (i + 1)
+        wave = 0.3 * torch.sin(2 * torch.pi * freq * t) + 0.05 * torch.randn(num_samples, generator=gen)
+        magnitude, _ = separator.audio_to_spectrogram(wave.unsqueeze(0))
+        yield separator.prepare_chunk(magnitude.squeeze(0)).unsqueeze(0).unsqueeze(0)
+
+
+def precision_report(reference, candidates, inputs):
+    """
+    Error de máscara (vs fp32) y tiempo por chunk de cada separador.
+
+    Args:
+        reference: GuitarSeparator fp32
+        candidates: dict {modo: GuitarSeparator}
+        inputs: lista de [1, 1, F', T']
+    """
+    ref_masks = [reference.run_model(x) for x in inputs]
+    report = {}
+    for mode, separator in candidates.items():
+        separator.run_model(inputs[0])  # warm-up
+        abs_errors = []
+        t0 = time.perf_counter()
+        for x, ref in zip(inputs, ref_masks):
+            abs_errors.append((separator.run_model(x) - ref).abs())
+        elapsed = time.perf_counter() - t0
+        report[mode] = {
+            "mask_mae": float(torch.stack([e.mean() for e in abs_errors]).mean()),
+            "mask_max_abs": float(max(e.max() for e in abs_errors)),
+            "seconds_per_chunk": round(elapsed / len(inputs), 4),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="🎚️ GuitarNet - Calibración int8 y reporte de precisión")
+    parser.add_argument("--model", type=str, required=True, help="Checkpoint fp32 (.pth)")
+    parser.add_argument("--audio", type=str, nargs="*", default=[], help="Stems 'other' (admite globs)")
+    parser.add_argument("--chunk-duration", type=float, default=30, help="Duración de chunk en segundos")
+    parser.add_argument("--max-chunks", type=int, default=32, help="Máximo de chunks de calibración")
+    parser.add_argument("--eval-chunks", type=int, default=8, help="Chunks reservados para el reporte")
+    parser.add_argument("--report", type=str, default=None, help="Guardar el reporte como JSON")
+    args = parser.parse_args()
+
+    audio_paths = sorted({p for pattern in args.audio for p in glob.glob(pattern, recursive=True)})
+
+    separator = GuitarSeparator(args.model, device="cpu")
+    if audio_paths:
+        inputs = list(iter_chunk_inputs(
+            separator, audio_paths, args.chunk_duration, args.max_chunks + args.eval_chunks
+        ))
+    else:
+        print("Sin --audio: usando mezclas sintéticas")
+        inputs = list(synthetic_chunk_inputs(
+            separator, args.chunk_duration, args.max_chunks + args.eval_chunks
+        ))
+
+    # Reservar los últimos chunks para evaluar (no vistos en calibración)
+    eval_count = min(args.eval_chunks, max(1, len(inputs) // 4))
+    calibration, evaluation = inputs[:-eval_count] or inputs, inputs[-eval_count:]
+    print(f"Calibrando con {len(calibration)} chunks, evaluando con {len(evaluation)}")
+
+    quantized = quantize_int8(copy.deepcopy(separator.model), calibration)
+    int8_path = int8_artifact_path(args.model)
+    export_torchscript(quantized, int8_path)
+    print(f"Modelo int8 guardado en: {int8_path}")
+
+    candidates = {
+        "fp32": separator,
+        "int8": GuitarSeparator(args.model, device="cpu", precision="int8"),
+    }
+    if bf16_supported():
+        candidates["bf16"] = GuitarSeparator(args.model, device="cpu", precision="bf16")
+    else:
+        print("bf16 no soportado en este CPU, se omite del reporte")
+
+    report = precision_report(separator, candidates, evaluation)
+
+    print("\n" + "=" * 60)
+    print("REPORTE DE PRECISIÓN (error de máscara vs fp32)")
+    print("=" * 60)
+    for mode, values in report.items():
+        print(f"   {mode:5s} MAE={values['mask_mae']:.5f}  "
+              f"max={values['mask_max_abs']:.5f}  "
+              f"{values['seconds_per_chunk']:.3f}s/chunk")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"model": args.model, "int8_artifact": str(int8_path), "modes": report}, f, indent=2)
+        print(f"Reporte guardado en: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
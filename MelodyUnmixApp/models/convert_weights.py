@@ -0,0 +1,106 @@
+"""
+💾 GuitarNet CONVERSIÓN DE PESOS - .pth → .safetensors / .pth mmap-able
+Proyecto: Melody Unmix
+
+Convierte el checkpoint de entrenamiento a un formato que se puede mapear
+en memoria (ver load_state_dict_file en guitarnet_inference.py):
+
+    safetensors  guitarnet_model.safetensors (requiere `pip install safetensors`)
+    pth          re-guarda sólo los tensores, contiguos y en CPU, en el
+                 formato zip de torch.save (admite torch.load(mmap=True))
+
+Verifica que el resultado tenga las mismas claves y valores que el
+original y que se pueda cargar en EfficientGuitarNet.
+
+Uso:
+    python convert_weights.py guitarnet_model.pth
+    python convert_weights.py guitarnet_model.pth --format pth -o guitarnet_model.mmap.pth
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from guitarnet_inference import SAFETENSORS_SUFFIX, load_guitarnet, load_state_dict_file
+
+
+def convert_weights(input_path, output_path, fmt="safetensors"):
+    """
+    Convierte `input_path` a `output_path` y verifica el resultado.
+
+    Returns:
+        dict con tamaños y tiempos de carga (original vs convertido)
+    """
+    t0 = time.perf_counter()
+    state_dict = torch.load(str(input_path), map_location="cpu")
+    load_original = time.perf_counter() - t0
+
+    # Sólo tensores, contiguos y sin compartir storage (requisito de safetensors)
+    tensors = {k: v.detach().cpu().contiguous().clone() for k, v in state_dict.items()}
+
+    if fmt == "safetensors":
+        try:
+            from safetensors.torch import save_file
+        except ImportError as e:
+            raise ImportError("--format safetensors requiere safetensors (pip install safetensors)") from e
+        save_file(tensors, str(output_path), metadata={"source": Path(input_path).name})
+    else:
+        torch.save(tensors, str(output_path))
+
+    # Verificación: mismas claves/valores y carga en el modelo
+    t0 = time.perf_counter()
+    converted = load_state_dict_file(output_path)
+    load_converted = time.perf_counter() - t0
+    if converted.keys() != tensors.keys():
+        raise ValueError("Las claves del archivo convertido no coinciden con el original")
+    for key, value in tensors.items():
+        if not torch.equal(converted[key], value):
+            raise ValueError(f"El tensor {key} difiere del original")
+    load_guitarnet(output_path)
+
+    return {
+        "input_mb": round(Path(input_path).stat().st_size / 1e6, 2),
+        "output_mb": round(Path(output_path).stat().st_size / 1e6, 2),
+        "load_original_s": round(load_original, 4),
+        "load_converted_s": round(load_converted, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="💾 GuitarNet - Conversión de pesos para carga mmap")
+    parser.add_argument("input", type=str, help="Checkpoint original (.pth)")
+    parser.add_argument("--format", choices=["safetensors", "pth"], default="safetensors")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Archivo de salida (default: junto al original)")
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    if not input_path.exists():
+        print(f"Error: Modelo no encontrado: {input_path}")
+        sys.exit(1)
+
+    if args.output:
+        output_path = Path(args.output)
+    elif args.format == "safetensors":
+        output_path = input_path.with_suffix(SAFETENSORS_SUFFIX)
+    else:
+        output_path = input_path.with_name(input_path.stem + ".mmap.pth")
+    if output_path.resolve() == input_path.resolve():
+        print("Error: la salida no puede sobrescribir el checkpoint original")
+        sys.exit(1)
+
+    result = convert_weights(input_path, output_path, args.format)
+
+    print(f"Pesos convertidos: {output_path}")
+    for key, value in result.items():
+        print(f"   {key}: {value}")
+    print(f"Usar con GUITARNET_MODEL_FILE={output_path.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,19 +6,34 @@ Proyecto: Melody Unmix
 
 Uso:
     python inference.py input.wav output_folder/
+    python inference.py catalogo/ output_folder/ --batch          # carpeta, glob o manifest
     
 Output:
     - output_folder/guitar.wav
     - output_folder/others.wav
+    - con --batch: output_folder/<ruta relativa>/{guitar,others}.wav y
+      output_folder/batch_summary.json
 """
 
 import torch
 import torch.nn as nn
 import torchaudio
 import numpy as np
+import soundfile as sf
 from pathlib import Path
 import argparse
+import glob
+import json
+import math
+import os
+import pickle
+import resource
 import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
 
 # =====================================================
@@ -161,48 +176,732 @@ class EfficientGuitarNet(nn.Module):
         return mask
 
 
+# =====================================================
+# 1.1) OPTIMIZACIÓN PARA INFERENCIA
+# =====================================================
+TORCHSCRIPT_SUFFIX = ".ts"
+
+
+def fold_batchnorm(model):
+    """
+    Fusiona cada BatchNorm2d en la Conv2d que lo precede (in-place).
+    
+    En eval la BatchNorm es una transformación afín fija por canal, así
+    que se puede absorber en los pesos/bias de la convolución:
+    Conv → BN → LeakyReLU pasa a Conv → LeakyReLU (el BN queda Identity).
+    """
+    model.eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        layers = list(module)
+        for i in range(len(layers) - 1):
+            conv, bn = layers[i], layers[i + 1]
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                module[i] = torch.nn.utils.fusion.fuse_conv_bn_eval(conv, bn)
+                module[i + 1] = nn.Identity()
+    return model
+
+
+def optimize_for_inference(model):
+    """BN folding + formato channels_last"""
+    model = fold_batchnorm(model)
+    return model.to(memory_format=torch.channels_last)
+
+
+def export_torchscript(model, output_path, example_shape=(1, 1, 64, 64)):
+    """
+    Traza el modelo ya optimizado y guarda un artefacto TorchScript
+    congelado. Los workers lo cargan con torch.jit.load sin construir
+    el módulo Python.
+    
+    La U-Net no tiene control de flujo dependiente de datos, así que el
+    trazado sirve para cualquier [B, 1, F, T] con F y T múltiplos de 16.
+    """
+    example = torch.rand(example_shape).contiguous(memory_format=torch.channels_last)
+    with torch.inference_mode():
+        traced = torch.jit.trace(model.eval(), example)
+        traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, str(output_path))
+    return output_path
+
+
+# =====================================================
+# 1.2) PRECISIÓN REDUCIDA (CPU)
+# =====================================================
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def bf16_supported():
+    """True si el CPU tiene soporte nativo de bf16 en oneDNN (AVX512-BF16 / AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def int8_artifact_path(model_path):
+    """Ruta del artefacto int8 calibrado junto al checkpoint: modelo.int8.ts"""
+    model_path = Path(model_path)
+    return model_path.with_name(f"{model_path.stem}.int8{TORCHSCRIPT_SUFFIX}")
+
+
+def quantize_int8(model, calibration_inputs):
+    """
+    Cuantización estática int8 (FX graph mode) de las Conv2d/ConvTranspose2d.
+    
+    La cuantización dinámica de PyTorch sólo cubre Linear/LSTM, así que
+    para esta U-Net totalmente convolucional se usa cuantización estática:
+    los observers registran los rangos de activación sobre los inputs de
+    calibración (mismo preprocesamiento que process_chunk) y luego se
+    convierten los pesos y activaciones a int8. Conv+BN se fusionan
+    automáticamente en prepare_fx.
+    
+    Args:
+        model: EfficientGuitarNet en eval (fp32, CPU)
+        calibration_inputs: iterable de tensores [B, 1, F, T]
+    
+    Returns:
+        modelo cuantizado (GraphModule, sólo CPU)
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+    
+    calibration_inputs = list(calibration_inputs)
+    if not calibration_inputs:
+        raise ValueError("Se necesita al menos un input de calibración")
+    
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+    
+    model = model.cpu().eval()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (calibration_inputs[0],))
+    with torch.inference_mode():
+        for mag_input in calibration_inputs:
+            prepared(mag_input)
+    return convert_fx(prepared)
+
+
+# =====================================================
+# 1.3) BACKEND ONNX RUNTIME
+# =====================================================
+BACKENDS = ("torch", "onnx", "remote")
+ONNX_SUFFIX = ".onnx"
+
+
+def onnx_artifact_path(model_path):
+    """Ruta del modelo ONNX exportado junto al checkpoint: modelo.onnx"""
+    return Path(model_path).with_suffix(ONNX_SUFFIX)
+
+
+def export_onnx(model, output_path, example_shape=(1, 1, 64, 64), opset=17):
+    """
+    Exporta EfficientGuitarNet a ONNX con ejes dinámicos de batch,
+    frecuencia y tiempo (F y T deben seguir siendo múltiplos de 16).
+    """
+    example = torch.rand(example_shape)
+    dynamic = {0: "batch", 2: "freq", 3: "time"}
+    torch.onnx.export(
+        model.cpu().eval(),
+        example,
+        str(output_path),
+        input_names=["magnitude"],
+        output_names=["mask"],
+        dynamic_axes={"magnitude": dynamic, "mask": dynamic},
+        opset_version=opset,
+    )
+    return output_path
+
+
+def load_onnx_session(onnx_path, num_threads=None):
+    """
+    Sesión de onnxruntime en CPU con todas las optimizaciones de grafo
+    (fusión Conv+BN+activación, layout NCHWc, etc.).
+    """
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError(
+            "backend='onnx' requiere onnxruntime (pip install onnxruntime)"
+        ) from e
+    
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+
+
+# =====================================================
+# 1.4) UNIÓN DE CHUNKS
+# =====================================================
+STITCH_MODES = ("hann", "context")
+
+# Calidad de separación (ver GuitarSeparator.predict_mask):
+# "full" = modelo sobre la grilla STFT completa; "fast" = modelo sobre
+# frames agrupados en el tiempo y sólo bins bajo un corte de frecuencia
+QUALITIES = ("full", "fast")
+
+
+# =====================================================
+# 1.5) ESCRITURA DE STEMS
+# =====================================================
+def write_wav_atomic(path, waveform, sr):
+    """
+    Guarda un waveform [C, N] como WAV float32 de forma atómica: se escribe
+    <nombre>.tmp.wav en la misma carpeta y se renombra con os.replace, así
+    un lector nunca ve un archivo a medio escribir y, si algo falla, el
+    archivo previo (p.ej. el other.wav de Demucs) queda intacto.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.stem + ".tmp.wav")
+    try:
+        sf.write(str(tmp_path), waveform.detach().cpu().numpy().T, sr, subtype="FLOAT")
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return path
+
+
+# =====================================================
+# 1.6) CARGA DE PESOS (mmap / safetensors)
+# =====================================================
+SAFETENSORS_SUFFIX = ".safetensors"
+
+
+def load_state_dict_file(model_path):
+    """
+    Carga el state_dict sin copiarlo a memoria privada del proceso:
+    
+    - .safetensors: safetensors.torch.load_file (archivo mapeado en memoria)
+    - .pth: torch.load(mmap=True) si el checkpoint tiene formato zip (el
+      default de torch.save); los .pth en formato legacy se cargan enteros.
+      Si weights_only rechaza el checkpoint se carga sin esa restricción:
+      sólo para pesos de confianza.
+    
+    Con mmap los tensores apuntan al page cache: varios procesos que cargan
+    el mismo archivo (workers de gunicorn, pool de GuitarNet) comparten
+    esas páginas mientras no se escriban.
+    """
+    model_path = str(model_path)
+    if model_path.endswith(SAFETENSORS_SUFFIX):
+        try:
+            from safetensors.torch import load_file
+        except ImportError as e:
+            raise ImportError(
+                "Los pesos .safetensors requieren safetensors (pip install safetensors)"
+            ) from e
+        return load_file(model_path, device="cpu")
+    
+    try:
+        return torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, pickle.UnpicklingError):
+        # Checkpoint legacy (no zip, no admite mmap) o con objetos de Python
+        # que weights_only rechaza: se carga con pickle completo, así que
+        # `model_path` debe ser un checkpoint propio (de confianza)
+        return torch.load(
+            model_path, map_location="cpu", mmap=zipfile.is_zipfile(model_path), weights_only=False
+        )
+
+
+def load_guitarnet(model_path, device="cpu"):
+    """
+    EfficientGuitarNet en eval con los pesos de `model_path`. El modelo se
+    construye en el device 'meta' (sin inicializar pesos aleatorios) y los
+    tensores cargados se asignan directamente (assign=True), así en CPU
+    los parámetros siguen respaldados por el archivo mapeado.
+    """
+    state_dict = load_state_dict_file(model_path)
+    with torch.device("meta"):
+        model = EfficientGuitarNet()
+    model.load_state_dict(state_dict, assign=True)
+    return model.to(device).eval()
+
+
+# =====================================================
+# 1.7) INSTRUMENTACIÓN POR ETAPA
+# =====================================================
+class StageProfiler:
+    """
+    Colector de tiempos por etapa de la separación (decode, resample,
+    stft, model, enhance_mask, istft, normalize, save / write).
+    
+    Por etapa acumula:
+    - wall_s: tiempo de reloj
+    - cpu_s: tiempo de CPU del proceso (todos los hilos, incluidos los
+      intra-op de torch; con varios jobs en paralelo en el mismo proceso
+      incluye el CPU de los otros)
+    - mem_mb / peak_mem_mb: memoria de tensores del allocator CUDA (pico
+      dentro de la etapa) si CUDA está en uso; en CPU, RSS al terminar la
+      etapa y pico de RSS del proceso hasta ese momento
+    - calls: veces que se ejecutó (p.ej. por bloque en separate_stream)
+    
+    Args:
+        callback: función opcional callback(stage, record) llamada al
+                  terminar cada etapa con las mediciones de esa ejecución
+    """
+    
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}
+    
+    @staticmethod
+    def _memory_mb():
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            return (torch.cuda.memory_allocated() / 2**20,
+                    torch.cuda.max_memory_allocated() / 2**20)
+        try:
+            with open("/proc/self/statm") as f:
+                rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+        except (OSError, ValueError):
+            rss = 0.0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return rss, peak
+    
+    @contextmanager
+    def stage(self, name):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.reset_peak_memory_stats()
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield
+        finally:
+            mem, peak = self._memory_mb()
+            record = {
+                "wall_s": time.perf_counter() - wall0,
+                "cpu_s": time.process_time() - cpu0,
+                "mem_mb": mem,
+                "peak_mem_mb": peak,
+            }
+            total = self.stages.setdefault(
+                name, {"wall_s": 0.0, "cpu_s": 0.0, "mem_mb": 0.0, "peak_mem_mb": 0.0, "calls": 0}
+            )
+            total["wall_s"] += record["wall_s"]
+            total["cpu_s"] += record["cpu_s"]
+            total["mem_mb"] = max(total["mem_mb"], mem)
+            total["peak_mem_mb"] = max(total["peak_mem_mb"], peak)
+            total["calls"] += 1
+            if self.callback is not None:
+                self.callback(name, record)
+    
+    def as_dict(self):
+        """Totales por etapa (redondeados, serializables a JSON)"""
+        return {
+            name: {k: (round(v, 4) if isinstance(v, float) else v) for k, v in values.items()}
+            for name, values in self.stages.items()
+        }
+
+
+def profile_stage(profiler, name):
+    """profiler.stage(name), o un contexto vacío si no hay profiler"""
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+
+# =====================================================
+# 1.8) MEMORIA DISPONIBLE Y TAMAÑO DE CHUNK
+# =====================================================
+# Duraciones de chunk candidatas (s), de la preferida a la mínima
+CHUNK_DURATIONS = (30, 20, 15, 10, 5)
+
+# Activaciones de la U-Net por bin de entrada (cota conservadora: el
+# encoder mantiene vivas las skip connections, ~300 floats por bin)
+MODEL_BYTES_PER_BIN = 4 * 300
+
+# Memoria de la pista completa en separate_array por muestra y canal:
+# waveform + STFT compleja + máscaras + espectro enmascarado (2·C) + iSTFT
+# (medido en CPU: ~11.5 MB por segundo de audio estéreo)
+TRACK_BYTES_PER_SAMPLE = 144
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def meminfo_available():
+    """MemAvailable de /proc/meminfo en bytes (None si no se puede leer)"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        # Plataforma sin sysconf (Windows / macOS)
+        return None
+
+
+def cgroup_memory():
+    """
+    (límite, uso) en bytes del cgroup del proceso (v2 o v1), o
+    (None, None) si no hay límite (contenedor sin --memory, host).
+    """
+    # cgroup v2: /proc/self/cgroup → "0::/ruta"
+    relative = ""
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    relative = line.strip()[3:].lstrip("/")
+    except OSError:
+        pass
+    for base in (os.path.join("/sys/fs/cgroup", relative), "/sys/fs/cgroup"):
+        limit = _read_first_line(os.path.join(base, "memory.max"))
+        if limit is not None:
+            if limit == "max":
+                return None, None
+            usage = _read_first_line(os.path.join(base, "memory.current"))
+            return int(limit), int(usage) if usage else 0
+    
+    # cgroup v1: sin límite se reporta un valor enorme (~2^63)
+    limit = _read_first_line("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if limit is None or int(limit) >= 2**60:
+        return None, None
+    usage = _read_first_line("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    return int(limit), int(usage) if usage else 0
+
+
+def available_memory():
+    """
+    Memoria disponible para inferencia: el mínimo entre MemAvailable y lo
+    que queda bajo el límite del cgroup (lo que dispara el OOM killer en
+    Docker, aunque el host tenga RAM libre).
+    
+    Returns:
+        dict con available, meminfo, cgroup_limit y cgroup_usage en bytes
+        (None donde no aplica; available None si no se pudo medir nada)
+    """
+    meminfo = meminfo_available()
+    cgroup_limit, cgroup_usage = cgroup_memory()
+    candidates = [meminfo] if meminfo is not None else []
+    if cgroup_limit is not None:
+        candidates.append(max(0, cgroup_limit - cgroup_usage))
+    return {
+        "available": min(candidates) if candidates else None,
+        "meminfo": meminfo,
+        "cgroup_limit": cgroup_limit,
+        "cgroup_usage": cgroup_usage,
+    }
+
+
+def chunk_memory_bytes(freq_bins, chunk_size):
+    """Memoria estimada de un forward de un chunk [F, T] (con padding a 16)"""
+    f_pad = freq_bins + (16 - freq_bins % 16) % 16
+    t_pad = chunk_size + (16 - chunk_size % 16) % 16
+    return f_pad * t_pad * MODEL_BYTES_PER_BIN
+
+
+def plan_chunking(num_samples, num_channels, jobs=1, max_batch=4, memory_fraction=0.8,
+                  memory=None, n_fft=2048, hop_length=512, sr=None,
+                  durations=CHUNK_DURATIONS):
+    """
+    Elige duración de chunk y tamaño de lote según la memoria disponible.
+    
+    El presupuesto es memory_fraction de la memoria disponible (ver
+    available_memory) repartido entre los `jobs` de GuitarNet en curso,
+    menos lo que ocupa la pista completa en memoria. Se usa la mayor
+    duración de `durations` cuyo forward entra en el presupuesto y se
+    apilan tantos chunks como quepan (hasta max_batch). Si ni la mínima
+    entra se usa igual (fits=False): mejor lento que un OOM kill.
+    
+    Args:
+        num_samples: muestras (a target_sr) que se separan en memoria a la
+                     vez (la pista, o un bloque en separate_stream)
+        num_channels: canales del audio
+        jobs: separaciones de GuitarNet en curso, incluida ésta
+        memory: dict de available_memory() (se mide si es None)
+    
+    Returns:
+        dict con chunk_duration, max_batch, fits y los datos de la decisión
+        (MB disponibles, límite del cgroup, presupuesto por job, jobs)
+    """
+    sr = sr or TARGET_SR
+    memory = memory if memory is not None else available_memory()
+    freq_bins = n_fft // 2 + 1
+    total_frames = num_samples // hop_length + 1
+    jobs = max(1, int(jobs))
+    max_batch = max(1, int(max_batch))
+    
+    available = memory["available"]
+    if available is None:
+        # Sin forma de medir: comportamiento anterior
+        chunk_duration, batch, fits, budget = durations[0], max_batch, True, None
+    else:
+        budget = available * memory_fraction / jobs - num_samples * num_channels * TRACK_BYTES_PER_SAMPLE
+        chunk_duration, fits = durations[-1], False
+        for duration in durations:
+            chunk_size = min(int(duration * sr / hop_length), total_frames)
+            if chunk_memory_bytes(freq_bins, chunk_size) <= budget:
+                chunk_duration, fits = duration, True
+                break
+        chunk_size = min(int(chunk_duration * sr / hop_length), total_frames)
+        batch = max(1, min(max_batch, int(max(budget, 0) // chunk_memory_bytes(freq_bins, chunk_size))))
+    
+    def mb(value):
+        return None if value is None else round(value / 2**20, 1)
+    
+    return {
+        "chunk_duration": chunk_duration,
+        "max_batch": batch,
+        "fits": fits,
+        "jobs": jobs,
+        "available_mb": mb(available),
+        "meminfo_mb": mb(memory["meminfo"]),
+        "cgroup_limit_mb": mb(memory["cgroup_limit"]),
+        "budget_mb": mb(budget),
+    }
+
+
+# =====================================================
+# 1.9) BUFFERS REUTILIZABLES
+# =====================================================
+class BufferSlot:
+    """
+    Juego de buffers de un hilo (ver BufferArena.lease). Cada buffer es un
+    tensor plano que sólo crece; get() devuelve una vista con el shape
+    pedido sobre su comienzo.
+    """
+    
+    def __init__(self, arena):
+        self.arena = arena
+        self.buffers = {}
+    
+    def get(self, name, shape, device=None, dtype=torch.float32):
+        """Vista [shape] (contenido sin inicializar) del buffer `name`"""
+        numel = math.prod(shape)
+        device = torch.device(device or "cpu")
+        buffer = self.buffers.get(name)
+        if (buffer is None or buffer.numel() < numel
+                or buffer.device != device or buffer.dtype != dtype):
+            buffer = torch.empty(numel, device=device, dtype=dtype)
+            self.buffers[name] = buffer
+            self.arena.allocations += 1
+        return buffer[:numel].view(shape)
+
+
+class BufferArena:
+    """
+    Buffers preasignados para el procesamiento por chunks (entrada del
+    modelo con padding, acumuladores del overlap-add), reutilizados entre
+    chunks y entre jobs para no pedirle memoria nueva al allocator en cada
+    chunk (menos fragmentación del RSS en workers de larga vida).
+    
+    Cada llamada toma un BufferSlot libre con lease() y lo devuelve al
+    terminar, así los jobs concurrentes (hilos) nunca comparten buffers.
+    Se retiene un slot por llamada concurrente como máximo, del tamaño de
+    la pista más larga procesada (clear() los libera).
+    
+    Args:
+        enabled: False = un slot nuevo en cada lease (sin reutilización)
+    """
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.allocations = 0  # buffers creados (métrica / tests)
+        self._free = []
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def lease(self):
+        slot = None
+        if self.enabled:
+            with self._lock:
+                slot = self._free.pop() if self._free else None
+        slot = slot or BufferSlot(self)
+        try:
+            yield slot
+        finally:
+            if self.enabled:
+                with self._lock:
+                    self._free.append(slot)
+    
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+
+
+# =====================================================
+# 1.10) MÁSCARA PERSISTIDA (re-render sin modelo)
+# =====================================================
+# Junto a los stems se guarda la máscara CRUDA del modelo (antes de
+# enhance_guitar_mask) cuantizada a uint8, más la ganancia con que se
+# normalizó cada stem: guitar / g_guitar + others / g_others reconstruye
+# la entrada, así que se puede volver a aplicar la máscara con otros
+# parámetros sin correr la U-Net (ver MaskRenderer.rerender)
+MASK_FILE = "guitar_mask.npz"
+
+# Parámetros de enhance_guitar_mask por defecto en separate_array
+ENHANCE_DEFAULTS = {"gamma": 0.8, "high_start_ratio": 0.4, "high_boost_db": 5.0}
+
+
+def enhance_params(gamma=None, high_start_ratio=None, high_boost_db=None):
+    """ENHANCE_DEFAULTS con los valores dados (None = default), validados"""
+    params = dict(ENHANCE_DEFAULTS)
+    for key, value in (("gamma", gamma), ("high_start_ratio", high_start_ratio),
+                       ("high_boost_db", high_boost_db)):
+        if value is not None:
+            params[key] = float(value)
+    if not 0.1 <= params["gamma"] <= 4.0:
+        raise ValueError(f"gamma debe estar en [0.1, 4], no {params['gamma']}")
+    if not 0.0 <= params["high_start_ratio"] < 1.0:
+        raise ValueError(f"high_start_ratio debe estar en [0, 1), no {params['high_start_ratio']}")
+    if not -24.0 <= params["high_boost_db"] <= 24.0:
+        raise ValueError(f"high_boost_db debe estar en [-24, 24], no {params['high_boost_db']}")
+    return params
+
+
+def quantize_mask(mask):
+    """
+    Máscara [F, T] en [0, 1] → (uint8 [F, T], (lo, hi)). Se cuantiza sobre
+    el rango propio de la máscara: enhance_guitar_mask re-normaliza con
+    min/max, así que un paso fijo de 1/255 se amplificaría en máscaras de
+    poco rango.
+    """
+    mask = mask.detach().float().clamp(0, 1).cpu()
+    lo, hi = float(mask.min()), float(mask.max())
+    scale = 255 / (hi - lo) if hi > lo else 0.0
+    quantized = (mask - lo).mul_(scale).round_().to(torch.uint8).numpy()
+    return quantized, (lo, hi)
+
+
+def dequantize_mask(quantized, value_range):
+    """Inversa de quantize_mask → tensor float32 [F, T]"""
+    lo, hi = value_range
+    return torch.from_numpy(quantized).float().mul_((hi - lo) / 255).add_(lo)
+
+
+def save_mask(path, mask, gains, enhance, value_range=None):
+    """
+    Guarda la máscara cruda [F, T] como .npz comprimido, de forma atómica
+    (como write_wav_atomic). ~1/4 del tamaño de un stem estéreo float32.
+    
+    Args:
+        mask: tensor en [0, 1], o uint8 ya cuantizado con su value_range
+        gains: (g_guitar, g_others) de normalize_audio sobre cada stem
+        enhance: parámetros de enhance_guitar_mask con que se escribieron
+    """
+    path = Path(path)
+    if isinstance(mask, torch.Tensor):
+        mask, value_range = quantize_mask(mask)
+    tmp_path = path.with_name(path.stem + ".tmp.npz")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                mask=mask,
+                range=np.asarray(value_range, dtype=np.float64),
+                gains=np.asarray(gains, dtype=np.float64),
+                enhance=np.asarray([enhance[k] for k in ENHANCE_DEFAULTS], dtype=np.float64),
+            )
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return path
+
+
+def load_mask(path):
+    """
+    Lee un archivo de save_mask.
+    
+    Returns:
+        dict con mask (uint8 [F, T]) y su range (ver dequantize_mask),
+        gains (g_guitar, g_others) y enhance
+    """
+    with np.load(str(path)) as data:
+        return {
+            "mask": data["mask"],
+            "range": tuple(float(v) for v in data["range"]),
+            "gains": tuple(float(g) for g in data["gains"]),
+            "enhance": dict(zip(ENHANCE_DEFAULTS, (float(v) for v in data["enhance"]))),
+        }
+
+
+# =====================================================
+# 1.11) CANCELACIÓN ENTRE CHUNKS
+# =====================================================
+class SeparationCancelled(Exception):
+    """El job se canceló mientras GuitarNet separaba (ver check_cancelled)"""
+
+
+def check_cancelled(cancelled):
+    """
+    Lanza SeparationCancelled si `cancelled()` es True. Se llama entre
+    lotes de chunks y entre bloques de streaming, así que `cancelled` debe
+    ser barato (p.ej. threading.Event.is_set).
+    """
+    if cancelled is not None and cancelled():
+        raise SeparationCancelled("Separación cancelada")
+
+
 # =====================================================
 # 2) CLASE DE INFERENCIA
 # =====================================================
-class GuitarSeparator:
-    def __init__(self, model_path, device=None):
-        """
-        Inicializa el separador de guitarra
-        
-        Args:
-            model_path: Ruta al modelo entrenado (.pth)
-            device: 'mps', 'cuda', 'cpu' o None (auto-detect)
-        """
-        # Auto-detectar device
-        if device is None:
-            if torch.backends.mps.is_available():
-                device = torch.device("mps")
-            elif torch.cuda.is_available():
-                device = torch.device("cuda")
-            else:
-                device = torch.device("cpu")
-        else:
-            device = torch.device(device)
-        
-        self.device = device
-        print(f"Usando device: {device}")
-        
-        # Cargar modelo
-        self.model = EfficientGuitarNet().to(device)
-        self.model.load_state_dict(torch.load(model_path, map_location=device))
-        self.model.eval()
-        print(f"Modelo cargado desde: {model_path}")
-        
+# Sample rate del entrenamiento: toda entrada se resamplea a este valor
+TARGET_SR = 44100
+
+class MaskRenderer:
+    """
+    Todo lo que va después del modelo: STFT / iSTFT, enhance_guitar_mask,
+    aplicación de máscaras y normalización. No carga pesos, así que sirve
+    para re-renderizar stems desde una máscara guardada (ver rerender) en
+    procesos donde GuitarNet no está cargado.
+    """
+
+    def __init__(self):
         # Parámetros STFT (deben coincidir con el entrenamiento)
         self.n_fft = 2048
         self.hop_length = 512
         self.win_length = 2048
-        self.target_sr = 44100
+        self.target_sr = TARGET_SR
+        
+        # Ventana STFT/iSTFT precalculada (CPU, se mueve al device si hace falta)
+        self.window = torch.hann_window(self.win_length)
+        
+        # Cache de pesos por frecuencia de enhance_guitar_mask
+        # clave: (F, high_start_ratio, high_boost_db, device)
+        self._freq_weight_cache = {}
+
+    def frequency_weight(self, freq_bins, high_start_ratio, high_boost_db, device):
+        """
+        Vector de pesos [F, 1] de enhance_guitar_mask.
+        Se calcula una sola vez por combinación de parámetros y se reutiliza.
+        """
+        key = (freq_bins, float(high_start_ratio), float(high_boost_db), str(device))
+        weight = self._freq_weight_cache.get(key)
+        if weight is not None:
+            return weight
+        
+        freqs = torch.linspace(0, 1, freq_bins, device=device)  # 0 abajo, 1 arriba
+        start = high_start_ratio
+        weight = torch.ones_like(freqs)
+
+        # zona donde queremos empezar a aumentar
+        idx = freqs >= start
+        if idx.any():
+            boost_lin = 10 ** (high_boost_db / 20)  # pasar dB a factor lineal
+            # sube linealmente de 1 a boost_lin entre start y 1
+            weight[idx] = 1 + (boost_lin - 1) * (freqs[idx] - start) / (1 - start)
+
+        # expandir al eje temporal
+        weight = weight.view(freq_bins, 1)
+        self._freq_weight_cache[key] = weight
+        return weight
 
     def enhance_guitar_mask(self, mask,
                             gamma=0.8,
                             high_start_ratio=0.4,
-                            high_boost_db=3.0):
+                            high_boost_db=3.0,
+                            bounds=None):
         """
         Ajusta la máscara para favorecer ligeramente la guitarra,
         especialmente en frecuencias agudas.
@@ -212,6 +911,9 @@ class GuitarSeparator:
             gamma: <1 -> empuja valores hacia 1 (más agresivo)
             high_start_ratio: a partir de qué fracción de F empezar a subir (0-1)
             high_boost_db: cuántos dB extra para las altas
+            bounds: (min, max) fijos para la re-normalización final.
+                    None = min/max globales de la máscara (requiere la
+                    pista completa); en streaming se usan cotas fijas.
 
         Returns:
             mask_enhanced: [F, T] en [0, 1]
@@ -223,37 +925,338 @@ class GuitarSeparator:
         mask = mask ** gamma
 
         F, T = mask.shape
-        device = mask.device
 
-        # 2) Peso por frecuencia, subiendo en las altas
-        freqs = torch.linspace(0, 1, F, device=device)  # 0 abajo, 1 arriba
-        start = high_start_ratio
-        weight = torch.ones_like(freqs)
-
-        # zona donde queremos empezar a aumentar
-        idx = freqs >= start
-        if idx.any():
-            boost_lin = 10 ** (high_boost_db / 20)  # pasar dB a factor lineal
-            # sube linealmente de 1 a boost_lin entre start y 1
-            weight[idx] = 1 + (boost_lin - 1) * (freqs[idx] - start) / (1 - start)
-
-        # expandir al eje temporal
-        weight = weight.view(F, 1)
+        # 2) Peso por frecuencia, subiendo en las altas (precalculado)
+        weight = self.frequency_weight(F, high_start_ratio, high_boost_db, mask.device)
         mask = mask * weight
 
         # 3) Re-normalizar a [0, 1] para no romper la mixture consistency
-        m_min = mask.min()
-        m_max = mask.max()
+        if bounds is None:
+            m_min = mask.min()
+            m_max = mask.max()
+        else:
+            m_min, m_max = bounds
         if (m_max - m_min) > 1e-8:
-            mask = (mask - m_min) / (m_max - m_min)
+            mask = ((mask - m_min) / (m_max - m_min)).clamp(0, 1)
 
         return mask
 
+    def stft(self, waveform):
+        """
+        STFT compleja de todos los canales a la vez.
+        
+        Args:
+            waveform: [C, N]
+        
+        Returns:
+            spec: [C, F, T] complejo
+        """
+        return torch.stft(
+            waveform,
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            win_length=self.win_length,
+            window=self.window.to(waveform.device),
+            return_complex=True
+        )
+    
+    def istft(self, spec, length=None):
+        """
+        iSTFT por lotes: [B, F, T] complejo -> [B, N].
+        Se ejecuta en CPU (MPS no soporta bien operaciones complejas).
+        """
+        return torch.istft(
+            spec.cpu(),
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            win_length=self.win_length,
+            window=self.window,
+            length=length
+        )
+
+    def normalize_audio(self, waveform, target_level=-1.0):
+        """Normaliza audio para evitar clipping"""
+        # Peak normalization
+        peak = waveform.abs().max()
+        if peak > 0:
+            waveform = waveform / peak
+        
+        # Aplicar target level (en dB)
+        scale = 10 ** (target_level / 20)
+        waveform = waveform * scale
+        
+        return waveform
+
+    def normalization_gain(self, waveform, target_level=-1.0):
+        """Factor que normalize_audio aplica a `waveform`"""
+        scale = 10 ** (target_level / 20)
+        peak = float(waveform.abs().max()) if waveform.numel() else 0.0
+        return scale / peak if peak > 0 else scale
+
+    def apply_mask(self, spec, raw_mask, num_samples, enhance=None, profiler=None):
+        """
+        Mejora la máscara cruda del modelo y la aplica al espectro.
+        
+        Args:
+            spec: STFT compleja [C, F, T]
+            raw_mask: máscara de guitarra [F, T] (salida de predict_mask)
+            num_samples: largo de salida de la iSTFT
+            enhance: dict opcional con gamma / high_start_ratio /
+                     high_boost_db (ver enhance_params)
+            profiler: StageProfiler opcional (enhance_mask / istft / normalize)
+        
+        Returns:
+            guitar [C, N], others [C, N] normalizados y sus ganancias
+            (g_guitar, g_others)
+        """
+        params = enhance_params(**(enhance or {}))
+        num_channels = spec.shape[0]
+        
+        # Calcular máscara de others como complemento (como en entrenamiento)
+        # mejorar máscara para favorecer guitarra, sobre todo en agudos
+        with profile_stage(profiler, "enhance_mask"):
+            guitar_mask = self.enhance_guitar_mask(raw_mask, **params).to(spec.device)
+            # Training code: mask_others = 1 - mask_guitar
+            others_mask = (1 - guitar_mask).clamp(min=0)
+        
+        # Aplicar máscaras EXACTAMENTE como en entrenamiento, directamente
+        # sobre el espectro complejo (la máscara es real y >= 0, así que
+        # conserva la fase del mix):
+        # guitar = mask * mix
+        # others = (1 - mask) * mix
+        print("Aplicando máscaras a canales estéreo...")
+        with profile_stage(profiler, "istft"):
+            masked = torch.cat([spec * guitar_mask, spec * others_mask], dim=0)  # [2C, F, T]
+            
+            # Reconstruir los 2·C canales con una sola iSTFT
+            audio = self.istft(masked, length=num_samples)
+        guitar_audio = audio[:num_channels]
+        others_audio = audio[num_channels:]
+        
+        # Normalizar para evitar clipping
+        with profile_stage(profiler, "normalize"):
+            gains = (self.normalization_gain(guitar_audio), self.normalization_gain(others_audio))
+            guitar_audio = self.normalize_audio(guitar_audio).cpu()
+            others_audio = self.normalize_audio(others_audio).cpu()
+        
+        return guitar_audio, others_audio, gains
+
+    def rerender(self, guitar_path, others_path, mask_path, enhance=None, profiler=None):
+        """
+        Vuelve a aplicar la máscara de `mask_path` (ver save_mask) con otros
+        parámetros de enhance_guitar_mask, sin correr el modelo: reconstruye
+        la entrada desde los stems actuales y sus ganancias, y reescribe
+        guitar / others y la máscara (atómicamente).
+        
+        Returns:
+            dict con los parámetros aplicados (enhance) y las nuevas ganancias
+        """
+        params = enhance_params(**(enhance or {}))
+        with profile_stage(profiler, "decode"):
+            stored = load_mask(mask_path)
+            guitar, sr = sf.read(str(guitar_path), dtype="float32", always_2d=True)
+            others, _ = sf.read(str(others_path), dtype="float32", always_2d=True)
+        if guitar.shape != others.shape:
+            raise ValueError("guitar y others no tienen el mismo largo / canales")
+        g_guitar, g_others = stored["gains"]
+        waveform = torch.from_numpy((guitar / g_guitar + others / g_others).T.copy())
+        del guitar, others
+        
+        with profile_stage(profiler, "stft"):
+            spec = self.stft(waveform)
+        raw_mask = dequantize_mask(stored["mask"], stored["range"])
+        if tuple(raw_mask.shape) != tuple(spec.shape[1:]):
+            raise ValueError(
+                f"La máscara {tuple(raw_mask.shape)} no corresponde a los stems {tuple(spec.shape[1:])}"
+            )
+        
+        guitar_audio, others_audio, gains = self.apply_mask(
+            spec, raw_mask, waveform.shape[-1], params, profiler
+        )
+        with profile_stage(profiler, "save"):
+            write_wav_atomic(guitar_path, guitar_audio, sr)
+            write_wav_atomic(others_path, others_audio, sr)
+            save_mask(mask_path, stored["mask"], gains, params, stored["range"])
+        
+        return {"enhance": params, "gains": gains}
+
+
+class GuitarSeparator(MaskRenderer):
+    def __init__(self, model_path, device=None, max_batch=4, optimize=False,
+                 precision="fp32", backend="torch", num_threads=None,
+                 silence_threshold_db=-70.0, stitch="hann", context_frames=128,
+                 crossfade_frames=16, server_address=None, overlap=0.5, reuse_buffers=True,
+                 quality="full", fast_time_factor=2, fast_cutoff_hz=11025.0,
+                 fast_high_mask=None):
+        """
+        Inicializa el separador de guitarra
         
-    def load_audio(self, audio_path):
+        Args:
+            model_path: Ruta al modelo entrenado (.pth / .safetensors, ver
+                        load_state_dict_file) o artefacto
+                        TorchScript (.ts, ver export_torchscript)
+            device: 'mps', 'cuda', 'cpu' o None (auto-detect)
+            max_batch: Máximo de chunks que se apilan en un solo forward
+                       (1 = comportamiento secuencial original)
+            optimize: BN folding + channels_last + torch.inference_mode.
+                      Un artefacto .ts siempre se considera optimizado.
+            precision: 'fp32' (default), 'bf16' (autocast, CPUs con
+                       soporte bf16) o 'int8' (carga el artefacto calibrado
+                       modelo.int8.ts, ver calibrate_guitarnet.py)
+            backend: 'torch' (default) u 'onnx' (onnxruntime, CPU). Con
+                     'onnx' se usa modelo.onnx; si no existe se exporta
+                     desde el .pth la primera vez. 'remote' envía los
+                     forwards al servidor de guitarnet_server.py en
+                     `server_address` (model_path se ignora).
+            num_threads: Hilos intra-op del backend (None = default)
+            silence_threshold_db: Chunks con RMS (dBFS) por debajo de este
+                                  umbral no pasan por el modelo (máscara 0 =
+                                  guitarra en silencio). None = desactivado.
+            stitch: Unión de chunks en audios largos (ver STITCH_MODES):
+                    'hann' = 50% overlap con ventana Hann (cada frame pasa
+                    ~2 veces por el modelo); 'context' = margen de contexto
+                    + zona central válida + crossfade corto (~1.1x).
+            context_frames: Margen (frames STFT) a cada lado en 'context'.
+                            Por defecto 128 (~1.5 s), del orden de la mitad
+                            del campo receptivo temporal de la U-Net.
+            crossfade_frames: Largo del crossfade lineal entre chunks en 'context'
+            server_address: Socket Unix del servidor (backend='remote')
+            overlap: Fracción de solapamiento entre chunks en 'hann'
+            reuse_buffers: Reutilizar buffers de entrada / acumuladores
+                           entre chunks y jobs (ver BufferArena)
+            quality: Calidad por defecto ('full' o 'fast'); cada llamada
+                     a separate*/predict_mask puede elegir otra
+            fast_time_factor: En 'fast', frames STFT que se promedian en
+                              uno para el modelo (1 = sin reducción)
+            fast_cutoff_hz: En 'fast', el modelo sólo ve los bins bajo esta
+                            frecuencia (None = todos)
+            fast_high_mask: En 'fast', máscara fija sobre el corte: None =
+                            promedio por frame de la banda bajo el corte,
+                            o un valor constante en [0, 1]. El refuerzo de
+                            agudos de enhance_guitar_mask se aplica igual.
+        """
+        if stitch not in STITCH_MODES:
+            raise ValueError(f"stitch debe ser uno de {STITCH_MODES}, no {stitch!r}")
+        if quality not in QUALITIES:
+            raise ValueError(f"quality debe ser una de {QUALITIES}, no {quality!r}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision debe ser una de {PRECISIONS}, no {precision!r}")
+        if backend not in BACKENDS:
+            raise ValueError(f"backend debe ser uno de {BACKENDS}, no {backend!r}")
+        if backend == "onnx":
+            if precision != "fp32":
+                raise ValueError("backend='onnx' sólo soporta precision='fp32'")
+            device = "cpu"
+        if backend == "remote":
+            if not server_address:
+                raise ValueError("backend='remote' requiere server_address")
+            # La precisión la define el servidor; acá sólo corre STFT/iSTFT
+            device = "cpu"
+            precision = "fp32"
+        
+        # Auto-detectar device
+        if device is None:
+            if torch.backends.mps.is_available():
+                device = torch.device("mps")
+            elif torch.cuda.is_available():
+                device = torch.device("cuda")
+            else:
+                device = torch.device("cpu")
+        else:
+            device = torch.device(device)
+        
+        self.device = device
+        print(f"Usando device: {device}")
+        
+        if precision == "bf16" and device.type == "cpu" and not bf16_supported():
+            print("bf16 no soportado en este CPU, usando fp32")
+            precision = "fp32"
+        if precision == "int8":
+            if device.type != "cpu":
+                raise ValueError("precision='int8' sólo está disponible en CPU")
+            if not str(model_path).endswith(TORCHSCRIPT_SUFFIX):
+                quantized_path = int8_artifact_path(model_path)
+                if not quantized_path.exists():
+                    raise FileNotFoundError(
+                        f"Modelo int8 no encontrado: {quantized_path} "
+                        f"(generarlo con calibrate_guitarnet.py)"
+                    )
+                model_path = quantized_path
+        self.precision = precision
+        self.backend = backend
+        self.session = None
+        self.client = None
+        
+        if num_threads and backend == "torch":
+            torch.set_num_threads(num_threads)
+        
+        # Cargar modelo
+        if backend == "remote":
+            from guitarnet_server import GuitarNetClient
+            self.model = None
+            self.client = GuitarNetClient(server_address)
+            self.optimized = False
+            model_path = server_address
+        elif backend == "onnx":
+            onnx_path = Path(model_path)
+            if onnx_path.suffix != ONNX_SUFFIX:
+                onnx_path = onnx_artifact_path(model_path)
+                if not onnx_path.exists():
+                    print(f"Exportando modelo a ONNX: {onnx_path}")
+                    export_onnx(load_guitarnet(model_path), onnx_path)
+            self.model = None
+            self.session = load_onnx_session(onnx_path, num_threads)
+            self.optimized = False
+            model_path = onnx_path
+        elif str(model_path).endswith(TORCHSCRIPT_SUFFIX):
+            self.model = torch.jit.load(str(model_path), map_location=device)
+            self.optimized = True
+        else:
+            self.model = load_guitarnet(model_path, device)
+            self.optimized = optimize
+            if optimize:
+                self.model = optimize_for_inference(self.model)
+        if self.model is not None:
+            self.model.eval()
+        print(f"Modelo {'remoto en' if backend == 'remote' else 'cargado desde'}: {model_path}" + (" (optimizado)" if self.optimized else "")
+              + (f" [{precision}]" if precision != "fp32" else "")
+              + (f" [{backend}]" if backend != "torch" else ""))
+        
+        # Parámetros STFT, ventana y cache de pesos (ver MaskRenderer)
+        super().__init__()
+
+        # Máximo de chunks por forward pass en process_long_audio_mask
+        # (se acota además por la memoria disponible)
+        self.max_batch = max_batch
+        
+        # Compuerta de energía (ver frame_energy)
+        self.silence_threshold_db = silence_threshold_db
+        
+        # Estrategia de unión de chunks (ver stitch_plan)
+        self.stitch = stitch
+        self.context_frames = context_frames
+        self.crossfade_frames = crossfade_frames
+        self.overlap = overlap
+        
+        # Buffers reutilizables y ventanas de overlap-add ya calculadas
+        # clave del cache: argumentos de stitch_plan
+        self.arena = BufferArena(enabled=reuse_buffers)
+        self._plan_cache = {}
+        
+        # Modo rápido (ver predict_mask_fast)
+        self.quality = quality
+        self.fast_time_factor = max(1, int(fast_time_factor))
+        self.fast_cutoff_hz = fast_cutoff_hz
+        self.fast_high_mask = fast_high_mask
+
+    def load_audio(self, audio_path, profiler=None):
         """
         Carga audio preservando estéreo.
         
+        Args:
+            audio_path: Ruta al archivo
+            profiler: StageProfiler opcional (etapas decode / resample)
+        
         Returns:
             waveform_stereo: Audio original (1 o 2 canales)
             waveform_mono: Versión mono para el modelo
@@ -262,17 +1265,19 @@ class GuitarSeparator:
         print(f"Cargando audio: {audio_path}")
         
         # Cargar audio con backend explícito para evitar errores
-        try:
-            waveform, sr = torchaudio.load(audio_path, backend="soundfile")
-        except Exception:
-            # Fallback: intentar sin especificar backend
-            waveform, sr = torchaudio.load(audio_path)
+        with profile_stage(profiler, "decode"):
+            try:
+                waveform, sr = torchaudio.load(audio_path, backend="soundfile")
+            except Exception:
+                # Fallback: intentar sin especificar backend
+                waveform, sr = torchaudio.load(audio_path)
         
         # Resamplear si es necesario
         if sr != self.target_sr:
             print(f"Resampling {sr}Hz → {self.target_sr}Hz")
-            resampler = torchaudio.transforms.Resample(sr, self.target_sr)
-            waveform = resampler(waveform)
+            with profile_stage(profiler, "resample"):
+                resampler = torchaudio.transforms.Resample(sr, self.target_sr)
+                waveform = resampler(waveform)
         
         # Guardar versión estéreo original
         waveform_stereo = waveform
@@ -291,14 +1296,7 @@ class GuitarSeparator:
     def audio_to_spectrogram(self, waveform):
         """Convierte audio a espectrograma de magnitud"""
         # STFT
-        stft = torch.stft(
-            waveform,
-            n_fft=self.n_fft,
-            hop_length=self.hop_length,
-            win_length=self.win_length,
-            window=torch.hann_window(self.win_length).to(waveform.device),
-            return_complex=True
-        )
+        stft = self.stft(waveform)
         
         # Magnitud y fase
         magnitude = torch.abs(stft)
@@ -306,78 +1304,434 @@ class GuitarSeparator:
         
         return magnitude, phase
     
-    def spectrogram_to_audio(self, magnitude, phase):
-        """Reconstruye audio desde espectrograma"""
-        # Mover tensores a CPU para iSTFT (MPS no soporta bien operaciones complejas)
-        magnitude_cpu = magnitude.cpu()
-        phase_cpu = phase.cpu()
+    def spectrogram_to_audio(self, magnitude, phase):
+        """Reconstruye audio desde espectrograma"""
+        # Reconstruir STFT complejo usando torch.polar (más compatible)
+        stft_complex = torch.polar(magnitude.cpu(), phase.cpu())
+        
+        return self.istft(stft_complex)
+    
+    def frame_energy(self, magnitude):
+        """
+        Energía media por frame (RMS² de la señal ventaneada) a partir del
+        espectrograma de magnitud, vía Parseval:
+            sum_k |X[k]|² = n_fft · sum_n (x[n]·w[n])²
+        (el espectro one-sided cuenta doble los bins intermedios).
+        
+        Args:
+            magnitude: [F, T]
+        
+        Returns:
+            energy: [T]; 10·log10(energy) = RMS del frame en dBFS
+        """
+        power = magnitude.pow(2)
+        total = 2 * power.sum(dim=0) - power[0] - power[-1]
+        window_power = self.window.pow(2).sum().item()
+        return total / (self.n_fft * window_power)
+    
+    def is_silent(self, energy):
+        """True si la energía media (RMS²) está bajo silence_threshold_db"""
+        if self.silence_threshold_db is None:
+            return False
+        rms_db = 10 * math.log10(float(energy.mean()) + 1e-20)
+        return rms_db < self.silence_threshold_db
+    
+    @staticmethod
+    def padded_shape(freq_bins, frames):
+        """(F', T') divisibles por 16 (4 capas de pooling = 2^4 = 16)"""
+        return freq_bins + (16 - freq_bins % 16) % 16, frames + (16 - frames % 16) % 16
+    
+    def prepare_chunk(self, mag_chunk, out=None, chunk_size=None):
+        """
+        Normaliza un chunk de magnitud a [0, 1] y lo rellena para que
+        F y T sean divisibles por 16 (4 capas de pooling = 2^4 = 16).
+        
+        Con `out` ([F', T'], p.ej. una fila de un buffer de BufferArena) se
+        escribe ahí y la normalización se hace en el lugar, sin tensores
+        intermedios. `chunk_size` > T equivale a rellenar antes con ceros
+        hasta chunk_size (último chunk de una pista): esos ceros entran en
+        el mínimo de la normalización.
+
+        Returns:
+            mag_norm: [F', T'] listo para el modelo
+        """
+        orig_f, orig_t = mag_chunk.shape
+        full_t = max(orig_t, chunk_size or orig_t)
+        if out is None:
+            out = mag_chunk.new_empty(self.padded_shape(orig_f, full_t))
+        
+        # Normalizar: min/max por fila y luego global (sobre una vista no
+        # contigua, min() a secas copia el chunk entero)
+        mag_min = mag_chunk.amin(dim=-1).min()
+        mag_max = mag_chunk.amax(dim=-1).max()
+        if full_t > orig_t:
+            mag_min = mag_min.clamp(max=0)
+            mag_max = mag_max.clamp(min=0)
+        scale = mag_max - mag_min + 1e-8
+        
+        values = out[:orig_f, :orig_t]
+        values.copy_(mag_chunk)
+        values.sub_(mag_min).div_(scale)
+        
+        # Relleno hasta chunk_size (ceros normalizados) y padding a 16
+        if full_t > orig_t:
+            out[:orig_f, orig_t:full_t].copy_((0 - mag_min) / scale)
+        out[:orig_f, full_t:].zero_()
+        out[orig_f:].zero_()
+        
+        return out
+    
+    def process_chunk(self, mag_chunk):
+        """Procesa un chunk con el modelo"""
+        # Normalizar + padding + inferencia (entrada en buffer reutilizable)
+        mask = self.process_chunk_batch([mag_chunk])[0]  # [F, T]
+        
+        # Aplicar máscara (mover mag_chunk al mismo dispositivo que mask)
+        mag_chunk_device = mag_chunk.to(mask.device)
+        guitar_mag = mask * mag_chunk_device
+        
+        return guitar_mag, mask
+    
+    def run_model(self, mag_input):
+        """
+        Forward del modelo sobre [B, 1, F, T] (ya normalizado y con padding).
+        Único punto donde se invoca la red.
+        """
+        if self.client is not None:
+            return self.client.forward(mag_input)
+        if self.session is not None:
+            feed = {"magnitude": mag_input.detach().cpu().float().contiguous().numpy()}
+            return torch.from_numpy(self.session.run(["mask"], feed)[0])
+        
+        mag_input = mag_input.to(self.device)
+        autocast = torch.autocast(
+            self.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16"
+        )
+        if not self.optimized:
+            with torch.no_grad(), autocast:
+                return self.model(mag_input).float()
+        
+        mag_input = mag_input.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode(), autocast:
+            masks = self.model(mag_input)
+        # Devolver tensor normal (contiguo) para poder operar fuera de inference_mode
+        return masks.float().contiguous().clone()
+    
+    def process_chunk_batch(self, mag_chunks, chunk_size=None, slot=None):
+        """
+        Procesa varios chunks del MISMO shape en un solo forward pass.
         
-        # Reconstruir STFT complejo usando torch.polar (más compatible)
-        stft_complex = torch.polar(magnitude_cpu, phase_cpu)
+        Cada chunk se normaliza por separado (igual que process_chunk),
+        así que el resultado es equivalente a llamar process_chunk uno
+        por uno. La entrada [B, 1, F', T'] se arma en un buffer reutilizable
+        (ver BufferArena).
         
-        # iSTFT
-        waveform = torch.istft(
-            stft_complex,
-            n_fft=self.n_fft,
-            hop_length=self.hop_length,
-            win_length=self.win_length,
-            window=torch.hann_window(self.win_length)
-        )
+        Args:
+            mag_chunks: lista de tensores [F, T] (T <= chunk_size)
+            chunk_size: chunks más cortos se tratan como rellenos con ceros
+                        hasta chunk_size (default: T del primero)
+            slot: BufferSlot ya tomado por el llamador (opcional)
         
-        return waveform
+        Returns:
+            masks: [B, F, chunk_size]
+        """
+        orig_f = mag_chunks[0].shape[0]
+        chunk_size = chunk_size or mag_chunks[0].shape[1]
+        
+        with (nullcontext(slot) if slot is not None else self.arena.lease()) as slot:
+            # [B, 1, F', T'] en el buffer de entrada
+            mag_input = slot.get(
+                "input", (len(mag_chunks), 1, *self.padded_shape(orig_f, chunk_size)),
+                device=mag_chunks[0].device
+            )
+            for row, chunk in zip(mag_input, mag_chunks):
+                self.prepare_chunk(chunk, out=row[0], chunk_size=chunk_size)
+            
+            masks = self.run_model(mag_input)
+        
+        return masks[:, 0, :orig_f, :chunk_size]
     
-    def process_chunk(self, mag_chunk):
-        """Procesa un chunk con el modelo"""
-        # Normalizar
-        mag_min = mag_chunk.min()
-        mag_max = mag_chunk.max()
-        mag_norm = (mag_chunk - mag_min) / (mag_max - mag_min + 1e-8)
+    def warmup(self, chunk_durations=(30,), batch_sizes=(1,)):
+        """
+        Forwards de prueba con shapes representativos (chunk completo de
+        cada duración × cada tamaño de lote) para que oneDNN elija kernels
+        y el allocator reserve memoria antes del primer job real.
         
-        # Guardar dimensiones originales
-        orig_f, orig_t = mag_norm.shape
+        Returns:
+            segundos empleados (0 con backend='remote': el servidor se
+            calienta por su cuenta)
+        """
+        if self.client is not None:
+            return 0.0
+        
+        t0 = time.perf_counter()
+        freq_bins = self.n_fft // 2 + 1
+        gen = torch.Generator().manual_seed(0)
+        for duration in chunk_durations:
+            chunk_size = int(duration * self.target_sr / self.hop_length)
+            chunk = torch.rand(freq_bins, chunk_size, generator=gen)
+            for batch in batch_sizes:
+                self.process_chunk_batch([chunk] * batch)
+        elapsed = time.perf_counter() - t0
+        print(f"Warm-up GuitarNet: {elapsed:.2f}s "
+              f"(chunks {list(chunk_durations)}s, lotes {list(batch_sizes)})")
+        return elapsed
+    
+    def max_batch_for_memory(self, freq_bins, chunk_size, memory_fraction=0.5):
+        """
+        Estima cuántos chunks caben en un forward sin agotar la RAM.
         
-        # Calcular padding para que las dimensiones sean divisibles por 16
-        # (4 capas de pooling = 2^4 = 16)
-        pad_f = (16 - orig_f % 16) % 16
-        pad_t = (16 - orig_t % 16) % 16
+        La U-Net mantiene vivas las activaciones del encoder para las skip
+        connections: ~(32+32+64+48+16+16) canales a resolución completa más
+        los niveles inferiores. Se usa una cota conservadora de ~300 floats
+        por bin de entrada (ver chunk_memory_bytes).
         
-        # Aplicar padding si es necesario
-        if pad_f > 0 or pad_t > 0:
-            mag_norm = torch.nn.functional.pad(mag_norm, (0, pad_t, 0, pad_f))
+        Returns:
+            int >= 1 (limitado además por self.max_batch)
+        """
+        max_batch = max(1, int(self.max_batch))
+        if max_batch == 1:
+            return 1
         
-        # Agregar dimensiones de batch y canal
-        mag_input = mag_norm.unsqueeze(0).unsqueeze(0)  # [1, 1, F, T]
+        # MemAvailable o lo que queda bajo el límite del cgroup
+        available = available_memory()["available"]
+        if available is None:
+            return max_batch
         
-        # Inferencia
-        with torch.no_grad():
-            mask = self.model(mag_input.to(self.device))
+        fits = int(available * memory_fraction // chunk_memory_bytes(freq_bins, chunk_size))
+        return max(1, min(max_batch, fits))
+    
+    def predict_mask(self, magnitude_mono, chunk_duration=30, stats=None, max_batch=None,
+                     quality=None, cancelled=None):
+        """
+        Máscara de guitarra [F, T] para un espectrograma mono [1, F, T],
+        por chunks si excede chunk_duration.
         
-        # Remover dimensiones extra
-        mask = mask.squeeze(0).squeeze(0)  # [F, T]
+        Si todo el stem está bajo silence_threshold_db no se ejecuta el
+        modelo: la máscara es 0 (guitarra en silencio, others = mix).
         
-        # Recortar a dimensiones originales
-        mask = mask[:orig_f, :orig_t]
+        Args:
+            stats: dict opcional; se acumulan chunks_total, chunks_skipped
+                   y model_skipped (para ajustar el umbral por job)
+            max_batch: chunks por forward (None = self.max_batch acotado
+                       por la RAM libre)
+            quality: 'full' o 'fast' (None = self.quality, ver
+                     predict_mask_fast)
+            cancelled: función opcional; si devuelve True se lanza
+                       SeparationCancelled antes del siguiente lote de chunks
+        """
+        quality = quality or self.quality
+        if quality not in QUALITIES:
+            raise ValueError(f"quality debe ser una de {QUALITIES}, no {quality!r}")
+        if quality == "fast":
+            return self.predict_mask_fast(magnitude_mono, chunk_duration, stats, max_batch, cancelled)
+        
+        stats = stats if stats is not None else {}
+        for key in ("chunks_total", "chunks_skipped"):
+            stats.setdefault(key, 0)
+        stats.setdefault("model_skipped", False)
+        
+        chunk_size = int(chunk_duration * self.target_sr / self.hop_length)
+        magnitude = magnitude_mono.squeeze(0)
+        total_frames = magnitude.shape[-1]
+        num_chunks = self.num_chunks(total_frames, chunk_size) if total_frames > chunk_size else 1
         
-        # Aplicar máscara (mover mag_chunk al mismo dispositivo que mask)
-        mag_chunk_device = mag_chunk.to(mask.device)
-        guitar_mag = mask * mag_chunk_device
+        if self.is_silent(self.frame_energy(magnitude)):
+            print(f"Stem en silencio (< {self.silence_threshold_db} dBFS), se omite el modelo")
+            stats["chunks_total"] += num_chunks
+            stats["chunks_skipped"] += num_chunks
+            stats["model_skipped"] = True
+            return torch.zeros_like(magnitude)
         
-        return guitar_mag, mask
+        if total_frames > chunk_size:
+            print(f"Procesando en chunks de {chunk_duration}s...")
+            # Obtener la MÁSCARA, no la magnitud de guitarra
+            return self.process_long_audio_mask(
+                magnitude_mono, chunk_size, max_batch=max_batch, stats=stats, cancelled=cancelled
+            )
+        
+        check_cancelled(cancelled)
+        print("Procesando con el modelo...")
+        stats["chunks_total"] += 1
+        _, guitar_mask = self.process_chunk(magnitude)
+        return guitar_mask
+    
+    def fast_cutoff_bin(self, freq_bins):
+        """Bins que ve el modelo en 'fast' (redondeado a múltiplo de 16)"""
+        if self.fast_cutoff_hz is None:
+            return freq_bins
+        bin_hz = self.target_sr / self.n_fft
+        cutoff = math.ceil(math.ceil(self.fast_cutoff_hz / bin_hz) / 16) * 16
+        return max(16, min(freq_bins, cutoff))
+    
+    def predict_mask_fast(self, magnitude_mono, chunk_duration=30, stats=None, max_batch=None,
+                          cancelled=None):
+        """
+        Máscara [F, T] con resolución reducida (quality='fast'):
+        
+        1. Sólo los bins bajo fast_cutoff_hz pasan por el modelo (con el
+           default de 11 kHz, 512 de 1025 bins: ~2x menos cómputo).
+        2. Se promedian fast_time_factor frames en uno (avg pool) y la
+           máscara se interpola linealmente a la grilla original (~2x).
+        3. Sobre el corte la máscara es fija (ver fast_high_mask); el
+           refuerzo de agudos de enhance_guitar_mask actúa igual sobre ella.
+        
+        Los chunks duran los mismos segundos que en 'full' (chunk_duration),
+        con fast_time_factor veces menos frames.
+        """
+        magnitude = magnitude_mono.squeeze(0)
+        freq_bins, total_frames = magnitude.shape
+        cutoff = self.fast_cutoff_bin(freq_bins)
+        factor = self.fast_time_factor
+        
+        reduced = magnitude[:cutoff].unsqueeze(0)  # [1, Fc, T]
+        if factor > 1:
+            reduced = torch.nn.functional.avg_pool1d(reduced, factor, factor, ceil_mode=True)
+        print(f"Modo rápido: {cutoff}/{freq_bins} bins, {reduced.shape[-1]}/{total_frames} frames")
+        
+        low_mask = self.predict_mask(
+            reduced, chunk_duration / factor, stats=stats, max_batch=max_batch, quality="full",
+            cancelled=cancelled
+        )
+        if factor > 1:
+            low_mask = torch.nn.functional.interpolate(
+                low_mask.unsqueeze(0), size=total_frames, mode="linear", align_corners=False
+            ).squeeze(0)
+        
+        if cutoff == freq_bins:
+            return low_mask
+        mask = low_mask.new_empty(freq_bins, total_frames)
+        mask[:cutoff] = low_mask
+        if self.fast_high_mask is None:
+            # Promedio por frame del octavo superior de la banda calculada
+            edge = max(1, cutoff // 8)
+            mask[cutoff:] = low_mask[-edge:].mean(dim=0, keepdim=True)
+        else:
+            mask[cutoff:] = float(self.fast_high_mask)
+        return mask
+    
+    def export_torchscript(self, output_path):
+        """Guarda el modelo (optimizado) como artefacto TorchScript (.ts)"""
+        if self.model is None:
+            raise ValueError("export_torchscript requiere backend='torch'")
+        if not self.optimized:
+            self.model = optimize_for_inference(self.model)
+            self.optimized = True
+        return export_torchscript(self.model, output_path)
+    
+    def auto_chunking(self, num_samples, num_channels, jobs=1, stats=None):
+        """
+        plan_chunking con los parámetros de este separador; la decisión se
+        imprime y queda en stats["chunking"].
+        """
+        plan = plan_chunking(
+            num_samples, num_channels, jobs=jobs, max_batch=self.max_batch,
+            n_fft=self.n_fft, hop_length=self.hop_length, sr=self.target_sr
+        )
+        print(f"Chunks de {plan['chunk_duration']}s × {plan['max_batch']} por forward "
+              f"(disponible {plan['available_mb']} MB, {plan['jobs']} job(s))")
+        if stats is not None:
+            stats["chunking"] = plan
+        return plan
     
-    def separate(self, audio_path, output_dir, chunk_duration=30):
+    def separate_array(self, waveform, sr, chunk_duration=None, stats=None, profiler=None,
+                       max_batch=None, quality=None, enhance=None, mask_path=None, cancelled=None):
         """
-        Separa guitarra de un archivo de audio preservando estéreo.
+        Separa guitarra de un waveform en memoria preservando estéreo.
         
         IMPORTANTE: La inferencia coincide exactamente con el entrenamiento:
         - El modelo predice una máscara (0-1)
         - guitar = mask * mix
         - others = (1 - mask) * mix
         
+        Args:
+            waveform: Tensor [C, N] (o [N] mono) a `sr`
+            sr: Sample rate de `waveform` (se resamplea a target_sr)
+            chunk_duration: Duración de chunks en segundos (None = según la
+                            memoria disponible, ver auto_chunking)
+            stats: dict opcional con estadísticas de la compuerta de energía
+                   (ver predict_mask)
+            profiler: StageProfiler opcional (ver StageProfiler)
+            max_batch: chunks por forward (None = según la memoria)
+            quality: 'full' o 'fast' (None = self.quality, ver predict_mask_fast)
+            enhance: dict opcional con parámetros de enhance_guitar_mask
+                     (None = ENHANCE_DEFAULTS, ver enhance_params)
+            mask_path: si se da, guarda ahí la máscara cruda del modelo
+                       (ver save_mask) para re-renderizar sin el modelo
+            cancelled: función opcional que se consulta entre lotes de
+                       chunks (ver check_cancelled)
+        
+        Returns:
+            (guitar_audio, others_audio, target_sr), tensores [C, N'] en CPU
+            ya normalizados
+        """
+        enhance = enhance_params(**(enhance or {}))
+        waveform = torch.as_tensor(waveform, dtype=torch.float32)
+        if waveform.dim() == 1:
+            waveform = waveform.unsqueeze(0)
+        if sr != self.target_sr:
+            print(f"Resampling {sr}Hz → {self.target_sr}Hz")
+            with profile_stage(profiler, "resample"):
+                waveform = torchaudio.functional.resample(waveform, sr, self.target_sr)
+        
+        num_channels, num_samples = waveform.shape
+        print(f"Duración: {num_samples / self.target_sr:.2f}s, Canales: {num_channels}")
+        if chunk_duration is None:
+            plan = self.auto_chunking(num_samples, num_channels, stats=stats)
+            chunk_duration = plan["chunk_duration"]
+            max_batch = plan["max_batch"] if max_batch is None else max_batch
+        
+        # STFT compleja de todos los canales en una sola llamada: [C, F, T]
+        print("Generando espectrogramas...")
+        with profile_stage(profiler, "stft"):
+            spec = self.stft(waveform)
+            
+            # Espectrograma MONO para el modelo: la STFT es lineal, así que
+            # el promedio de las STFT por canal == STFT del downmix mono
+            magnitude_mono = spec.mean(dim=0, keepdim=True).abs().to(self.device)
+        print(f"   Shape mono: {magnitude_mono.shape}")
+        
+        # Procesar mono con el modelo (por chunks si es largo)
+        with profile_stage(profiler, "model"):
+            guitar_mask = self.predict_mask(
+                magnitude_mono, chunk_duration, stats=stats, max_batch=max_batch, quality=quality,
+                cancelled=cancelled
+            )
+        
+        guitar_audio, others_audio, gains = self.apply_mask(
+            spec, guitar_mask, num_samples, enhance, profiler
+        )
+        if mask_path is not None:
+            with profile_stage(profiler, "save_mask"):
+                save_mask(mask_path, guitar_mask, gains, enhance)
+        
+        return guitar_audio, others_audio, self.target_sr
+    
+    def separate(self, audio_path, output_dir, chunk_duration=None, stats=None, profiler=None,
+                 max_batch=None, quality=None, enhance=None, mask_path=None, cancelled=None):
+        """
+        Separa guitarra de un archivo de audio preservando estéreo
+        (load_audio + separate_array + guardado en output_dir).
+        
         Args:
             audio_path: Ruta al archivo de audio de entrada
             output_dir: Carpeta donde guardar los outputs
-            chunk_duration: Duración de chunks en segundos
+            chunk_duration: Duración de chunks en segundos (None = según la
+                            memoria disponible)
+            stats: dict opcional con estadísticas de la compuerta de energía
+                   (ver predict_mask) y los tiempos por etapa en
+                   stats["stages"] (ver StageProfiler)
+            profiler: StageProfiler opcional (None = uno interno); sus
+                      totales por etapa quedan en stats["stages"]
+            max_batch: chunks por forward (None = según la memoria)
+            quality: 'full' o 'fast' (None = self.quality)
+            enhance / mask_path / cancelled: ver separate_array
+        
+        Returns:
+            (guitar_path, others_path); los tiempos van en stats["stages"]
         """
+        if profiler is None:
+            profiler = StageProfiler()
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
         
@@ -385,90 +1739,202 @@ class GuitarSeparator:
         print("GUITARNET - Separación de Audio (Estéreo)")
         print("="*60)
         
-        # Cargar audio (estéreo + mono)
-        waveform_stereo, waveform_mono, sr = self.load_audio(audio_path)
-        duration = waveform_stereo.shape[-1] / sr
+        # Cargar audio (estéreo)
+        waveform_stereo, _, sr = self.load_audio(audio_path, profiler=profiler)
         num_channels = waveform_stereo.shape[0]
-        print(f"Duración: {duration:.2f}s, Canales: {num_channels}")
+        guitar_audio, others_audio, sr = self.separate_array(
+            waveform_stereo, sr, chunk_duration, stats=stats, profiler=profiler,
+            max_batch=max_batch, quality=quality, enhance=enhance, mask_path=mask_path,
+            cancelled=cancelled
+        )
         
-        # Generar espectrograma MONO para el modelo
-        print("Generando espectrograma mono para modelo...")
-        magnitude_mono, _ = self.audio_to_spectrogram(waveform_mono)
-        magnitude_mono = magnitude_mono.to(self.device)
-        print(f"   Shape mono: {magnitude_mono.shape}")
+        # Guardar
+        guitar_path = output_dir / "guitar.wav"
+        others_path = output_dir / "others.wav"
         
-        # Procesar mono con el modelo (por chunks si es largo)
-        chunk_size = int(chunk_duration * sr / self.hop_length)
-        total_frames = magnitude_mono.shape[-1]
+        print(f"Guardando resultados...")
+        with profile_stage(profiler, "save"):
+            torchaudio.save(str(guitar_path), guitar_audio, sr)
+            torchaudio.save(str(others_path), others_audio, sr)
         
-        if total_frames > chunk_size:
-            print(f"Procesando en chunks de {chunk_duration}s...")
-            # Obtener la MÁSCARA, no la magnitud de guitarra
-            guitar_mask = self.process_long_audio_mask(magnitude_mono, chunk_size)
-        else:
-            print("Procesando con el modelo...")
-            _, guitar_mask = self.process_chunk(magnitude_mono.squeeze(0))
+        if stats is not None:
+            stats["stages"] = profiler.as_dict()
         
-        # Calcular máscara de others como complemento (como en entrenamiento)
-        # mejorar máscara para favorecer guitarra, sobre todo en agudos
-        guitar_mask = self.enhance_guitar_mask(
-            guitar_mask,
-            gamma=0.8,            # más bajo = más agresivo
-            high_start_ratio=0.4, # a partir del 40% superior de F
-            high_boost_db=5     # prueba 3–6 dB
-        )
-        # Training code: mask_others = 1 - mask_guitar
-        others_mask = (1 - guitar_mask).clamp(min=0)
+        print(f"Guitar guardada en: {guitar_path} ({num_channels} canales)")
+        print(f"Others guardada en: {others_path} ({num_channels} canales)")
+        print("="*60 + "\n")
         
-        print("Aplicando máscaras a canales estéreo...")
-        guitar_channels = []
-        others_channels = []
-        
-        for ch in range(num_channels):
-            # Espectrograma del canal
-            channel_wave = waveform_stereo[ch:ch+1]
-            mag_ch, phase_ch = self.audio_to_spectrogram(channel_wave)
-            mag_ch = mag_ch.to(self.device).squeeze(0)
-            phase_ch = phase_ch.to(self.device)
-            
-            # Aplicar máscaras EXACTAMENTE como en entrenamiento:
-            # guitar = mask * mix
-            # others = (1 - mask) * mix
-            guitar_mag_ch = guitar_mask * mag_ch
-            others_mag_ch = others_mask * mag_ch
-            
-            # Reconstruir audio del canal
-            guitar_ch = self.spectrogram_to_audio(guitar_mag_ch.unsqueeze(0), phase_ch)
-            others_ch = self.spectrogram_to_audio(others_mag_ch.unsqueeze(0), phase_ch)
-            
-            guitar_channels.append(guitar_ch)
-            others_channels.append(others_ch)
+        return guitar_path, others_path
+    
+    def separate_stream(self, audio_path, output_dir, chunk_duration=None,
+                        block_duration=30, context_duration=2.0,
+                        normalize="two_pass", target_level=-1.0, stats=None,
+                        profiler=None, max_batch=None, quality=None, enhance=None,
+                        cancelled=None):
+        """
+        Separa guitarra bloque por bloque con memoria acotada.
+        
+        Pensado para grabaciones largas (sets en vivo de una hora): en lugar
+        de cargar la pista completa, lee bloques de `block_duration` con
+        soundfile, procesa cada uno con un margen de contexto a cada lado y
+        escribe guitar.wav / others.wav de forma incremental. El pico de
+        memoria depende sólo de block_duration, no de la duración total.
+        
+        Estado entre bloques: se conserva la cola del bloque anterior y se
+        adelanta la cabeza del siguiente (`context_duration` segundos). Como
+        el contexto cubre de sobra la ventana STFT (n_fft) y el filtro de
+        resampling, la zona central de cada bloque reconstruida con iSTFT es
+        idéntica a la que se obtendría sobre la señal completa con la misma
+        máscara; sólo se escribe esa zona.
+        
+        Diferencias con separate():
+        - enhance_guitar_mask usa cotas fijas (0, boost máximo) en lugar
+          del min/max global de la pista.
+        - normalize="two_pass": la primera pasada escribe audio float sin
+          normalizar y registra el pico; la segunda lo re-escala bloque a
+          bloque (mismo resultado que normalize_audio, sin cargar todo).
+          normalize="fixed": sólo aplica la ganancia de target_level y recorta
+          a [-1, 1], en una sola pasada.
         
-        # Combinar canales
-        if num_channels > 1:
-            guitar_audio = torch.stack(guitar_channels, dim=0)
-            others_audio = torch.stack(others_channels, dim=0)
-        else:
-            guitar_audio = guitar_channels[0].unsqueeze(0)
-            others_audio = others_channels[0].unsqueeze(0)
+        Args:
+            audio_path: Ruta al archivo de audio de entrada
+            output_dir: Carpeta donde guardar los outputs
+            chunk_duration: Duración de chunks del modelo en segundos (None =
+                            según la memoria disponible para un bloque)
+            block_duration: Duración de cada bloque leído del disco
+            context_duration: Contexto (s) a cada lado de cada bloque
+            normalize: "two_pass" o "fixed"
+            target_level: Nivel de pico en dB
+            stats: dict opcional (ver predict_mask), acumulado sobre bloques,
+                   con los tiempos por etapa en stats["stages"]
+            profiler: StageProfiler opcional (None = uno interno; etapas
+                      acumuladas sobre bloques, totales en stats["stages"])
+            max_batch: chunks por forward (None = según la memoria)
+            quality: 'full' o 'fast' (None = self.quality)
+            enhance: dict opcional con parámetros de enhance_guitar_mask
+                     (None = ENHANCE_DEFAULTS, ver enhance_params)
+            cancelled: función opcional que se consulta entre bloques y
+                       lotes de chunks (ver check_cancelled); al cancelar
+                       quedan sólo los .tmp / .unnorm en output_dir
+        """
+        if normalize not in ("two_pass", "fixed"):
+            raise ValueError(f"normalize debe ser 'two_pass' o 'fixed', no {normalize!r}")
+        enhance = enhance_params(**(enhance or {}))
+        if profiler is None:
+            profiler = StageProfiler()
         
-        # Asegurar que es 2D
-        if guitar_audio.dim() == 3:
-            guitar_audio = guitar_audio.squeeze(1)
-        if others_audio.dim() == 3:
-            others_audio = others_audio.squeeze(1)
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
         
-        # Normalizar para evitar clipping
-        guitar_audio = self.normalize_audio(guitar_audio)
-        others_audio = self.normalize_audio(others_audio)
+        print("\n" + "="*60)
+        print("GUITARNET - Separación en streaming")
+        print("="*60)
         
-        # Guardar
         guitar_path = output_dir / "guitar.wav"
         others_path = output_dir / "others.wav"
+        # Cota superior fija de máscara × peso (el peso máximo es el boost)
+        boost_lin = max(1.0, 10 ** (enhance["high_boost_db"] / 20))
+        scale = 10 ** (target_level / 20)
         
-        print(f"Guardando resultados...")
-        torchaudio.save(str(guitar_path), guitar_audio.cpu(), sr)
-        torchaudio.save(str(others_path), others_audio.cpu(), sr)
+        with sf.SoundFile(str(audio_path)) as src:
+            sr = src.samplerate
+            num_channels = src.channels
+            print(f"Duración: {src.frames / sr:.2f}s, Canales: {num_channels}, SR: {sr}Hz")
+            
+            # Alinear bloque y contexto para que sus bordes caigan en muestras
+            # exactas a target_sr y en múltiplos de hop_length (misma grilla de
+            # frames STFT que tendría la pista completa)
+            g = math.gcd(sr, self.target_sr)
+            unit = (sr // g) * (self.hop_length // math.gcd(self.hop_length, self.target_sr // g))
+            block_in = max(unit, int(block_duration * sr) // unit * unit)
+            ctx_in = max(unit, math.ceil(max(context_duration * sr, self.n_fft) / unit) * unit)
+            if chunk_duration is None:
+                # La memoria depende del segmento (bloque + contexto), no de la pista
+                plan = self.auto_chunking(
+                    (block_in + 2 * ctx_in) * self.target_sr // sr, num_channels, stats=stats
+                )
+                chunk_duration = plan["chunk_duration"]
+                max_batch = plan["max_batch"] if max_batch is None else max_batch
+            
+            # Los archivos finales se escriben como <nombre>.tmp.wav y se
+            # renombran al terminar (ver write_wav_atomic)
+            guitar_tmp = guitar_path.with_name("guitar.tmp.wav")
+            others_tmp = others_path.with_name("others.tmp.wav")
+            if normalize == "two_pass":
+                guitar_out = output_dir / ".guitar.unnorm.wav"
+                others_out = output_dir / ".others.unnorm.wav"
+            else:
+                guitar_out, others_out = guitar_tmp, others_tmp
+            
+            peaks = [0.0, 0.0]
+            with sf.SoundFile(str(guitar_out), "w", samplerate=self.target_sr,
+                              channels=num_channels, subtype="FLOAT") as g_dst, \
+                 sf.SoundFile(str(others_out), "w", samplerate=self.target_sr,
+                              channels=num_channels, subtype="FLOAT") as o_dst:
+                
+                tail = np.zeros((0, num_channels), dtype=np.float32)
+                with profile_stage(profiler, "decode"):
+                    current = src.read(block_in, dtype="float32", always_2d=True)
+                pos_in = 0
+                block_idx = 0
+                
+                while current.shape[0] > 0:
+                    check_cancelled(cancelled)
+                    with profile_stage(profiler, "decode"):
+                        following = src.read(block_in, dtype="float32", always_2d=True)
+                    head = following[:ctx_in]
+                    segment = np.concatenate([tail, current, head], axis=0)
+                    
+                    # Posición del bloque central dentro del segmento a target_sr
+                    left_out = tail.shape[0] * self.target_sr // sr
+                    start_out = pos_in * self.target_sr // sr
+                    end_out = math.ceil((pos_in + current.shape[0]) * self.target_sr / sr)
+                    
+                    guitar_seg, others_seg = self._separate_segment(
+                        torch.from_numpy(segment.T.copy()), sr, chunk_duration,
+                        enhance, bounds=(0.0, boost_lin), stats=stats, profiler=profiler,
+                        max_batch=max_batch, quality=quality, cancelled=cancelled
+                    )
+                    guitar_seg = guitar_seg[:, left_out:left_out + end_out - start_out]
+                    others_seg = others_seg[:, left_out:left_out + end_out - start_out]
+                    
+                    if normalize == "fixed":
+                        guitar_seg = (guitar_seg * scale).clamp(-1, 1)
+                        others_seg = (others_seg * scale).clamp(-1, 1)
+                    else:
+                        peaks[0] = max(peaks[0], float(guitar_seg.abs().max()))
+                        peaks[1] = max(peaks[1], float(others_seg.abs().max()))
+                    
+                    with profile_stage(profiler, "save"):
+                        g_dst.write(guitar_seg.T.numpy())
+                        o_dst.write(others_seg.T.numpy())
+                    
+                    # Estado para el siguiente bloque
+                    tail = np.concatenate([tail, current], axis=0)[-ctx_in:]
+                    pos_in += current.shape[0]
+                    current = following
+                    block_idx += 1
+                    print(f"   Bloque {block_idx} procesado ({pos_in / sr:.1f}s)")
+        
+        if normalize == "two_pass":
+            print("Normalizando (segunda pasada)...")
+            for tmp_path, final_path, peak in ((guitar_out, guitar_tmp, peaks[0]),
+                                               (others_out, others_tmp, peaks[1])):
+                gain = scale / peak if peak > 0 else scale
+                block_out = max(1, int(block_duration * self.target_sr))
+                with profile_stage(profiler, "normalize"), \
+                     sf.SoundFile(str(tmp_path)) as tmp_src, \
+                     sf.SoundFile(str(final_path), "w", samplerate=self.target_sr,
+                                  channels=num_channels, subtype="FLOAT") as dst:
+                    for block in tmp_src.blocks(blocksize=block_out, dtype="float32", always_2d=True):
+                        dst.write(block * gain)
+                os.remove(tmp_path)
+        
+        os.replace(guitar_tmp, guitar_path)
+        os.replace(others_tmp, others_path)
+        
+        if stats is not None:
+            stats["stages"] = profiler.as_dict()
         
         print(f"Guitar guardada en: {guitar_path} ({num_channels} canales)")
         print(f"Others guardada en: {others_path} ({num_channels} canales)")
@@ -476,79 +1942,449 @@ class GuitarSeparator:
         
         return guitar_path, others_path
     
-    def process_long_audio_mask(self, magnitude, chunk_size, overlap=0.5):
+    def _separate_segment(self, segment, sr, chunk_duration, enhance, bounds, stats=None,
+                          profiler=None, max_batch=None, quality=None, cancelled=None):
+        """
+        Separa un segmento [C, N] (a `sr`) y devuelve (guitar, others)
+        [C, N'] a target_sr, sin normalizar. `enhance`: parámetros de
+        enhance_guitar_mask ya validados (ver enhance_params).
+        """
+        if sr != self.target_sr:
+            with profile_stage(profiler, "resample"):
+                segment = torchaudio.functional.resample(segment, sr, self.target_sr)
+        num_channels, num_samples = segment.shape
+        
+        with profile_stage(profiler, "stft"):
+            spec = self.stft(segment)
+            magnitude_mono = spec.mean(dim=0, keepdim=True).abs().to(self.device)
+        with profile_stage(profiler, "model"):
+            guitar_mask = self.predict_mask(
+                magnitude_mono, chunk_duration, stats=stats, max_batch=max_batch, quality=quality,
+                cancelled=cancelled
+            )
+        with profile_stage(profiler, "enhance_mask"):
+            guitar_mask = self.enhance_guitar_mask(guitar_mask, bounds=bounds, **enhance).to(spec.device)
+            others_mask = (1 - guitar_mask).clamp(min=0)
+        
+        with profile_stage(profiler, "istft"):
+            masked = torch.cat([spec * guitar_mask, spec * others_mask], dim=0)
+            audio = self.istft(masked, length=num_samples)
+        return audio[:num_channels], audio[num_channels:]
+    
+    def stitch_plan(self, total_frames, chunk_size, stitch=None, overlap=None,
+                    context_frames=None, crossfade_frames=None, device=None):
         """
-        Procesa audio largo en chunks con overlap y retorna la MÁSCARA.
+        Posición y ventana de overlap-add de cada chunk.
+        
+        - 'hann': chunks cada chunk_size·(1-overlap) frames, ponderados con
+          una ventana Hann completa.
+        - 'context': cada chunk aporta sólo su zona central de
+          chunk_size - 2·context_frames frames; el margen a cada lado es
+          contexto para el modelo y se descarta, salvo un crossfade lineal
+          de crossfade_frames centrado en cada unión. En los bordes de la
+          pista no hay crossfade.
+        
+        Los planes se guardan en un cache (las ventanas son de sólo lectura)
+        para no recalcularlos en cada bloque / job con el mismo largo.
+        
+        Returns:
+            lista de (start, end, window) con window [end - start]
+        """
+        stitch = stitch or self.stitch
+        if stitch not in STITCH_MODES:
+            raise ValueError(f"stitch debe ser uno de {STITCH_MODES}, no {stitch!r}")
+        overlap = self.overlap if overlap is None else overlap
+        context = self.context_frames if context_frames is None else context_frames
+        crossfade = self.crossfade_frames if crossfade_frames is None else crossfade_frames
+        
+        key = (total_frames, chunk_size, stitch, overlap, context, crossfade, str(device))
+        plan = self._plan_cache.get(key)
+        if plan is None:
+            plan = self._build_stitch_plan(
+                total_frames, chunk_size, stitch, overlap, context, crossfade, device
+            )
+            if len(self._plan_cache) >= 32:
+                self._plan_cache.pop(next(iter(self._plan_cache)))
+            self._plan_cache[key] = plan
+        return plan
+    
+    def _build_stitch_plan(self, total_frames, chunk_size, stitch, overlap, context, crossfade,
+                           device):
+        if stitch == "hann":
+            hop = max(1, int(chunk_size * (1 - overlap)))
+            window = torch.hann_window(chunk_size, device=device)
+            num_chunks = max(1, (total_frames - 1) // hop + 1)
+            plan = []
+            for i in range(num_chunks):
+                start = i * hop
+                end = min(start + chunk_size, total_frames)
+                plan.append((start, end, window[:end - start]))
+            return plan
+        
+        # El margen nunca se come más de la mitad del chunk (chunks cortos)
+        context = max(0, min(int(context), chunk_size // 4))
+        core = chunk_size - 2 * context
+        half_fade = max(0, min(int(crossfade), 2 * context)) // 2
+        
+        frames = torch.arange(total_frames, device=device, dtype=torch.float32)
+        num_chunks = max(1, math.ceil(total_frames / core))
+        plan = []
+        for i in range(num_chunks):
+            core_start = i * core
+            core_end = min(core_start + core, total_frames)
+            # Al final de la pista el chunk se corre a la izquierda para que
+            # el contexto sea audio real y no padding
+            start = max(0, min(core_start - context, total_frames - chunk_size))
+            end = min(total_frames, start + chunk_size)
+            
+            # Trapecio: 1 en la zona central, rampas de 2·half_fade en las uniones
+            window = torch.ones(end - start, device=device)
+            pos = frames[start:end]
+            if core_start > 0:
+                if half_fade:
+                    rise = (pos - (core_start - half_fade) + 0.5) / (2 * half_fade)
+                else:
+                    rise = (pos >= core_start).float()
+                window = window * rise.clamp(0, 1)
+            if core_end < total_frames:
+                if half_fade:
+                    fall = ((core_end + half_fade) - pos - 0.5) / (2 * half_fade)
+                else:
+                    fall = (pos < core_end).float()
+                window = window * fall.clamp(0, 1)
+            plan.append((start, end, window))
+        return plan
+    
+    def num_chunks(self, total_frames, chunk_size, stitch=None, overlap=None, context_frames=None):
+        """
+        Número de chunks (forward passes) de process_long_audio_mask con los
+        mismos `stitch` / `overlap` / `context_frames` (None = los de la
+        instancia, ver stitch_plan)
+        """
+        stitch = stitch or self.stitch
+        if stitch == "hann":
+            overlap = self.overlap if overlap is None else overlap
+            hop = max(1, int(chunk_size * (1 - overlap)))
+            return max(1, (total_frames - 1) // hop + 1)
+        context = self.context_frames if context_frames is None else context_frames
+        context = max(0, min(int(context), chunk_size // 4))
+        return max(1, math.ceil(total_frames / (chunk_size - 2 * context)))
+    
+    def process_long_audio_mask(self, magnitude, chunk_size, overlap=None, max_batch=None,
+                                stats=None, stitch=None, context_frames=None, cancelled=None):
+        """
+        Procesa audio largo en chunks y retorna la MÁSCARA.
         
         Esta función coincide con el entrenamiento: el modelo predice
         una máscara (0-1) que luego se multiplica por el mix.
+        
+        La unión de chunks depende de `stitch` (default self.stitch, ver
+        stitch_plan): overlap-add Hann con `overlap` (default self.overlap), o margen de contexto
+        de `context_frames` con crossfade corto.
+        
+        Los chunks se agrupan de a `max_batch` en un solo forward pass
+        (todos tienen el mismo shape gracias al padding del último).
+        Si max_batch es None se usa self.max_batch acotado por memoria.
+        
+        Los chunks bajo silence_threshold_db no pasan por el modelo y
+        aportan máscara 0 al overlap-add; se cuentan en stats.
+        
+        Entrada del modelo y acumuladores salen de la arena (ver
+        BufferArena): el único tensor nuevo por llamada es la máscara.
+        
+        `cancelled` se consulta antes de cada lote (ver check_cancelled).
         """
         magnitude = magnitude.squeeze(0)  # [F, T]
+        with self.arena.lease() as slot:
+            return self._process_long_audio_mask(
+                magnitude, chunk_size, slot, overlap, max_batch, stats, stitch, context_frames,
+                cancelled
+            )
+    
+    def _process_long_audio_mask(self, magnitude, chunk_size, slot, overlap, max_batch, stats,
+                                 stitch, context_frames, cancelled=None):
         total_frames = magnitude.shape[-1]
-        hop = int(chunk_size * (1 - overlap))
-        
-        # Inicializar output de MÁSCARA
         device = magnitude.device
-        mask_output = torch.zeros_like(magnitude)
-        weight = torch.zeros(magnitude.shape[-1], device=device)
         
-        # Ventana Hann para overlap-add suave
-        window = torch.hann_window(chunk_size, device=device)
+        # Acumuladores de MÁSCARA y pesos en buffers reutilizables
+        mask_output = slot.get("mask_acc", magnitude.shape, device=device).zero_()
+        weight = slot.get("weight", (total_frames,), device=device).zero_()
         
-        # Calcular número de chunks
-        num_chunks = max(1, (total_frames - 1) // hop + 1)
-        
-        for i in range(num_chunks):
-            start = i * hop
-            end = min(start + chunk_size, total_frames)
-            actual_len = end - start
-            
-            # Extraer chunk de magnitud
-            chunk = magnitude[:, start:end]
-            
-            # Pad si es necesario
-            if chunk.shape[-1] < chunk_size:
-                pad_size = chunk_size - chunk.shape[-1]
-                chunk = torch.nn.functional.pad(chunk, (0, pad_size))
-            
-            # Procesar y obtener la MÁSCARA (no la magnitud de guitarra)
-            _, mask_chunk = self.process_chunk(chunk)
-            
-            # Recortar al tamaño actual
-            mask_chunk = mask_chunk[:, :actual_len]
+        # Posiciones y ventanas de overlap-add
+        plan = self.stitch_plan(
+            total_frames, chunk_size, stitch=stitch, overlap=overlap,
+            context_frames=context_frames, device=device
+        )
+        num_chunks = len(plan)
+        
+        # Compuerta de energía: separar chunks en silencio de los activos
+        energy = self.frame_energy(magnitude)
+        active = []
+        for i, (start, end, window) in enumerate(plan):
+            if self.is_silent(energy[start:end]):
+                # Máscara 0 (no suma a mask_output), sólo peso de ventana
+                weight[start:end] += window
+            else:
+                active.append(i)
+        skipped = num_chunks - len(active)
+        
+        if stats is not None:
+            stats["chunks_total"] = stats.get("chunks_total", 0) + num_chunks
+            stats["chunks_skipped"] = stats.get("chunks_skipped", 0) + skipped
+        if skipped:
+            print(f"   {skipped}/{num_chunks} chunks en silencio omitidos")
+        
+        if max_batch is None:
+            max_batch = self.max_batch_for_memory(magnitude.shape[0], chunk_size)
+        max_batch = max(1, min(int(max_batch), max(1, len(active))))
+        
+        for batch_start in range(0, len(active), max_batch):
+            check_cancelled(cancelled)
+            batch_ids = active[batch_start:batch_start + max_batch]
             
-            # Aplicar ventana para overlap-add
-            win_slice = window[:actual_len]
-            windowed_mask = mask_chunk * win_slice
+            # Vistas de los chunks de magnitud; el último (más corto) se
+            # rellena con ceros dentro del buffer de entrada
+            chunks = [magnitude[:, plan[i][0]:plan[i][1]] for i in batch_ids]
             
-            # Acumular
-            mask_output[:, start:end] += windowed_mask
-            weight[start:end] += win_slice
+            # Procesar y obtener las MÁSCARAS (no la magnitud de guitarra)
+            masks = self.process_chunk_batch(chunks, chunk_size=chunk_size, slot=slot).to(device)
             
-            if (i + 1) % 3 == 0 or i == num_chunks - 1:
-                print(f"   Chunk {i+1}/{num_chunks} procesado")
-        
-        # Promediar overlaps
-        weight = weight.clamp(min=1e-8)
-        mask_output = mask_output / weight
+            for mask_chunk, i in zip(masks, batch_ids):
+                start, end, window = plan[i]
+                
+                # Recortar al tamaño actual
+                mask_chunk = mask_chunk[:, :end - start]
+                
+                # Aplicar ventana para overlap-add y acumular (en el lugar)
+                mask_chunk.mul_(window)
+                mask_output[:, start:end] += mask_chunk
+                weight[start:end] += window
+                
+                if (i + 1) % 3 == 0 or i == num_chunks - 1:
+                    print(f"   Chunk {i+1}/{num_chunks} procesado")
+        
+        # Promediar overlaps: el único tensor nuevo es la máscara devuelta
+        # (los acumuladores vuelven a la arena)
+        weight.clamp_(min=1e-8)
+        mask_output = torch.div(mask_output, weight)
         
         # Clamp para asegurar que la máscara esté en [0, 1]
-        mask_output = mask_output.clamp(0, 1)
+        mask_output.clamp_(0, 1)
         
         return mask_output
     
-    def normalize_audio(self, waveform, target_level=-1.0):
-        """Normaliza audio para evitar clipping"""
-        # Peak normalization
-        peak = waveform.abs().max()
-        if peak > 0:
-            waveform = waveform / peak
-        
-        # Aplicar target level (en dB)
-        scale = 10 ** (target_level / 20)
-        waveform = waveform * scale
-        
-        return waveform
+
+
+# =====================================================
+# 2.1) PROCESAMIENTO POR LOTES (backfills de catálogo)
+# =====================================================
+BATCH_AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a", ".aif", ".aiff")
+BATCH_SUMMARY_FILE = "batch_summary.json"
+
+
+def collect_batch_inputs(source):
+    """
+    Archivos de un lote. `source` puede ser:
+    - una carpeta (se recorre recursivamente, por extensión de audio)
+    - un glob ("catalogo/**/*.wav")
+    - un manifest (archivo de texto, una ruta por línea; '#' comenta y las
+      rutas relativas son relativas al manifest)
+    
+    Returns:
+        Lista de Path sin duplicados, en orden. Las rutas del manifest que
+        no existen se devuelven igual (fallan al decodificar y quedan en el
+        resumen).
+    """
+    path = Path(source)
+    if path.is_dir():
+        files = sorted(
+            p for p in path.rglob("*")
+            if p.is_file() and p.suffix.lower() in BATCH_AUDIO_EXTENSIONS
+        )
+    elif path.is_file() and path.suffix.lower() in BATCH_AUDIO_EXTENSIONS:
+        files = [path]
+    elif path.is_file():
+        files = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                entry = Path(line)
+                files.append(entry if entry.is_absolute() else path.parent / entry)
+    else:
+        files = sorted(Path(p) for p in glob.glob(str(source), recursive=True) if Path(p).is_file())
+    
+    seen = set()
+    unique = []
+    for f in files:
+        key = os.path.abspath(f)
+        if key not in seen:
+            seen.add(key)
+            unique.append(f)
+    return unique
+
+
+def batch_output_dirs(inputs, output_root):
+    """
+    Carpeta de salida de cada archivo: su ruta relativa al ancestro común
+    de todas las entradas, sin extensión (catalogo/a/x.wav → out/a/x/), así
+    dos archivos con el mismo nombre en carpetas distintas no se pisan.
+    """
+    if not inputs:
+        return []
+    inputs = [Path(os.path.abspath(p)) for p in inputs]
+    base = Path(os.path.commonpath([str(p.parent) for p in inputs]))
+    return [Path(output_root) / p.relative_to(base).with_suffix("") for p in inputs]
+
+
+def _write_json_atomic(path, data):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def separate_batch(separator, inputs, output_root, io_workers=2, prefetch=2,
+                   chunk_duration=None, max_batch=None, quality=None,
+                   skip_existing=False, summary_path=None):
+    """
+    Separa una lista de archivos con el modelo ya cargado.
+    
+    La decodificación (+ resample) de los próximos `prefetch` archivos y la
+    escritura de los stems corren en un pool de `io_workers` hilos,
+    solapadas con la inferencia del archivo actual en el hilo que llama.
+    Un archivo que falla se registra en el resumen y el lote sigue.
+    
+    Args:
+        separator: GuitarSeparator ya inicializado
+        inputs: rutas (ver collect_batch_inputs)
+        output_root: carpeta raíz; cada archivo va a su subcarpeta (ver
+                     batch_output_dirs) con guitar.wav / others.wav
+        io_workers: hilos para decode / escritura
+        prefetch: archivos decodificados por adelantado (y escrituras en
+                  vuelo como máximo); acota la memoria del lote
+        chunk_duration / max_batch / quality: ver separate_array
+        skip_existing: omitir archivos que ya tienen ambos stems (para
+                       retomar un backfill interrumpido)
+        summary_path: JSON del resumen (default: output_root/BATCH_SUMMARY_FILE)
+    
+    Returns:
+        dict resumen: totales, tiempo de reloj, real-time factor, fallos y
+        un registro por archivo (decode_s, separate_s, write_s, ...)
+    """
+    inputs = [Path(p) for p in inputs]
+    output_root = Path(output_root)
+    output_root.mkdir(parents=True, exist_ok=True)
+    outputs = batch_output_dirs(inputs, output_root)
+    prefetch = max(1, int(prefetch))
+    
+    records = [{"input": str(p), "output": str(o), "status": "pending"}
+               for p, o in zip(inputs, outputs)]
+    todo = []
+    for i, out in enumerate(outputs):
+        if skip_existing and (out / "guitar.wav").exists() and (out / "others.wav").exists():
+            records[i]["status"] = "skipped"
+        else:
+            todo.append(i)
+    
+    def fail(record, stage, error):
+        record.update(status="failed", stage=stage, error=f"{type(error).__name__}: {error}")
+        print(f"Error en {record['input']} ({stage}): {error}")
+    
+    def decode(i):
+        t0 = time.perf_counter()
+        waveform, _, sr = separator.load_audio(str(inputs[i]))
+        return waveform, sr, time.perf_counter() - t0
+    
+    def write(i, guitar_audio, others_audio, sr):
+        t0 = time.perf_counter()
+        outputs[i].mkdir(parents=True, exist_ok=True)
+        write_wav_atomic(outputs[i] / "guitar.wav", guitar_audio, sr)
+        write_wav_atomic(outputs[i] / "others.wav", others_audio, sr)
+        return time.perf_counter() - t0
+    
+    def finish_write(i, future):
+        try:
+            records[i]["write_s"] = round(future.result(), 4)
+            records[i]["status"] = "ok"
+        except Exception as e:
+            fail(records[i], "write", e)
+    
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, io_workers), thread_name_prefix="guitarnet-io") as pool:
+        decodes = {}
+        writes = []
+        
+        def schedule(k):
+            if k < len(todo):
+                decodes[todo[k]] = pool.submit(decode, todo[k])
+        
+        for k in range(prefetch):
+            schedule(k)
+        
+        for k, i in enumerate(todo):
+            record = records[i]
+            print(f"[{k + 1}/{len(todo)}] {inputs[i]}")
+            future = decodes.pop(i)
+            schedule(k + prefetch)
+            try:
+                waveform, sr, decode_s = future.result()
+            except Exception as e:
+                fail(record, "decode", e)
+                continue
+            record["decode_s"] = round(decode_s, 4)
+            record["duration_s"] = round(waveform.shape[-1] / sr, 2)
+            
+            stats = {}
+            t0 = time.perf_counter()
+            try:
+                guitar_audio, others_audio, sr = separator.separate_array(
+                    waveform, sr, chunk_duration, stats=stats, max_batch=max_batch, quality=quality
+                )
+            except Exception as e:
+                fail(record, "separate", e)
+                continue
+            finally:
+                del waveform
+            record["separate_s"] = round(time.perf_counter() - t0, 4)
+            for key in ("chunks_total", "chunks_skipped"):
+                if key in stats:
+                    record[key] = stats[key]
+            
+            writes.append((i, pool.submit(write, i, guitar_audio, others_audio, sr)))
+            del guitar_audio, others_audio
+            while len(writes) > prefetch:
+                finish_write(*writes.pop(0))
+        
+        for i, future in writes:
+            finish_write(i, future)
+    wall_s = time.perf_counter() - t_start
+    
+    audio_s = sum(r.get("duration_s", 0.0) for r in records if r["status"] == "ok")
+    summary = {
+        "files": len(records),
+        "ok": sum(r["status"] == "ok" for r in records),
+        "failed": sum(r["status"] == "failed" for r in records),
+        "skipped": sum(r["status"] == "skipped" for r in records),
+        "wall_s": round(wall_s, 3),
+        "audio_s": round(audio_s, 2),
+        "rtf": round(wall_s / audio_s, 4) if audio_s else None,
+        "io_workers": io_workers,
+        "prefetch": prefetch,
+        "quality": quality or separator.quality,
+        "failures": [
+            {"input": r["input"], "stage": r["stage"], "error": r["error"]}
+            for r in records if r["status"] == "failed"
+        ],
+        "results": records,
+    }
+    summary_path = Path(summary_path) if summary_path else output_root / BATCH_SUMMARY_FILE
+    _write_json_atomic(summary_path, summary)
+    print(f"Lote: {summary['ok']} ok, {summary['failed']} con error, {summary['skipped']} omitidos "
+          f"en {summary['wall_s']}s (resumen: {summary_path})")
+    return summary
 
 
 # =====================================================
@@ -561,11 +2397,13 @@ def main():
     parser.add_argument(
         "input", 
         type=str,
-        help="Archivo de audio de entrada (.wav, .mp3, etc.)"
+        nargs="?",
+        help="Archivo de audio de entrada (.wav, .mp3, etc.); con --batch, carpeta, glob o manifest"
     )
     parser.add_argument(
         "output", 
         type=str,
+        nargs="?",
         help="Carpeta donde guardar los archivos separados"
     )
     parser.add_argument(
@@ -584,32 +2422,220 @@ def main():
     parser.add_argument(
         "--chunk-duration",
         type=int,
+        default=None,
+        help="Duración de chunks en segundos para audios largos (default: según la memoria disponible)"
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=4,
+        help="Máximo de chunks por forward pass; se acota por la RAM libre (default: 4)"
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="BN folding + channels_last + inference_mode"
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="fp32",
+        choices=PRECISIONS,
+        help="Precisión de inferencia; int8 requiere modelo.int8.ts (default: fp32)"
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="torch",
+        choices=BACKENDS,
+        help="Motor de inferencia: torch, onnx (onnxruntime CPU) o remote (servidor) (default: torch)"
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default="/tmp/guitarnet.sock",
+        help="Socket del servidor de inferencia para --backend remote (default: /tmp/guitarnet.sock)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Hilos intra-op para la inferencia (default: los del backend)"
+    )
+    parser.add_argument(
+        "--silence-db",
+        type=float,
+        default=-70.0,
+        help="Umbral RMS (dBFS) bajo el cual un chunk no pasa por el modelo (default: -70)"
+    )
+    parser.add_argument(
+        "--stitch",
+        type=str,
+        default="hann",
+        choices=STITCH_MODES,
+        help="Unión de chunks: hann (50%% overlap) o context (margen + crossfade, ~1.1x) (default: hann)"
+    )
+    parser.add_argument(
+        "--context-frames",
+        type=int,
+        default=128,
+        help="Margen de contexto en frames STFT para --stitch context (default: 128)"
+    )
+    parser.add_argument(
+        "--quality",
+        type=str,
+        default="full",
+        choices=QUALITIES,
+        help="full o fast (modelo sobre frames agrupados y bins bajo el corte, ~4x menos cómputo) (default: full)"
+    )
+    parser.add_argument(
+        "--fast-time-factor",
+        type=int,
+        default=2,
+        help="Frames STFT promediados en uno con --quality fast (default: 2)"
+    )
+    parser.add_argument(
+        "--fast-cutoff-hz",
+        type=float,
+        default=11025.0,
+        help="Frecuencia de corte del modelo con --quality fast; 0 = sin corte (default: 11025)"
+    )
+    parser.add_argument(
+        "--export-torchscript",
+        type=str,
+        default=None,
+        metavar="RUTA.ts",
+        help="Exporta el modelo optimizado como TorchScript y termina"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Procesar por bloques con memoria acotada (grabaciones largas)"
+    )
+    parser.add_argument(
+        "--block-duration",
+        type=int,
         default=30,
-        help="Duración de chunks en segundos para audios largos (default: 30)"
+        help="Duración de bloque en segundos para --stream (default: 30)"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Modo lote: input es una carpeta, un glob o un manifest; el modelo se carga una vez"
+    )
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=2,
+        help="Hilos de decodificación / escritura en --batch (default: 2)"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Archivos decodificados por adelantado en --batch (default: 2)"
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="En --batch, omitir archivos que ya tienen guitar.wav y others.wav"
+    )
+    parser.add_argument(
+        "--summary",
+        type=str,
+        default=None,
+        help=f"Resumen JSON de --batch (default: output/{BATCH_SUMMARY_FILE})"
     )
     
     args = parser.parse_args()
     
     # Validar entrada
-    if not Path(args.input).exists():
+    if not args.export_torchscript and (args.input is None or args.output is None):
+        parser.error("input y output son obligatorios (salvo con --export-torchscript)")
+    
+    if args.batch and args.stream:
+        parser.error("--stream no se puede combinar con --batch")
+    
+    inputs = None
+    if args.batch and args.input is not None:
+        inputs = collect_batch_inputs(args.input)
+        if not inputs:
+            print(f"Error: No se encontraron archivos de audio en: {args.input}")
+            sys.exit(1)
+        print(f"Lote: {len(inputs)} archivos")
+    elif args.input is not None and not Path(args.input).exists():
         print(f"Error: Archivo no encontrado: {args.input}")
         sys.exit(1)
     
-    if not Path(args.model).exists():
+    if args.backend != "remote" and not Path(args.model).exists():
         print(f"Error: Modelo no encontrado: {args.model}")
         print(f"   Asegúrate de haber entrenado el modelo primero.")
         sys.exit(1)
     
     # Inicializar separador
-    separator = GuitarSeparator(args.model, device=args.device)
+    separator = GuitarSeparator(
+        args.model,
+        device=args.device,
+        max_batch=args.max_batch,
+        optimize=args.optimize,
+        precision=args.precision,
+        backend=args.backend,
+        num_threads=args.threads,
+        silence_threshold_db=args.silence_db,
+        stitch=args.stitch,
+        context_frames=args.context_frames,
+        server_address=args.server,
+        quality=args.quality,
+        fast_time_factor=args.fast_time_factor,
+        fast_cutoff_hz=args.fast_cutoff_hz or None
+    )
     
-    # Separar
-    try:
-        guitar_path, others_path = separator.separate(
-            args.input,
+    if args.export_torchscript:
+        if not args.export_torchscript.endswith(TORCHSCRIPT_SUFFIX):
+            print(f"Error: el artefacto debe terminar en {TORCHSCRIPT_SUFFIX}")
+            sys.exit(1)
+        separator.export_torchscript(args.export_torchscript)
+        print(f"TorchScript guardado en: {args.export_torchscript}")
+        return
+    
+    if inputs is not None:
+        summary = separate_batch(
+            separator,
+            inputs,
             args.output,
-            chunk_duration=args.chunk_duration
+            io_workers=args.io_workers,
+            prefetch=args.prefetch,
+            chunk_duration=args.chunk_duration,
+            skip_existing=args.skip_existing,
+            summary_path=args.summary
         )
+        if summary["failed"]:
+            sys.exit(1)
+        return
+    
+    # Separar
+    stats = {}
+    try:
+        if args.stream:
+            guitar_path, others_path = separator.separate_stream(
+                args.input,
+                args.output,
+                chunk_duration=args.chunk_duration,
+                block_duration=args.block_duration,
+                stats=stats
+            )
+        else:
+            guitar_path, others_path = separator.separate(
+                args.input,
+                args.output,
+                chunk_duration=args.chunk_duration,
+                stats=stats
+            )
+        print(f"Chunks omitidos por silencio: {stats['chunks_skipped']}/{stats['chunks_total']}")
+        print("Tiempos por etapa:")
+        for name, record in stats["stages"].items():
+            print(f"   {name:<13} {record['wall_s']:8.3f}s wall  {record['cpu_s']:8.3f}s CPU  "
+                  f"pico {record['peak_mem_mb']:.0f} MB")
         print("¡Separación completada exitosamente!")
     except Exception as e:
         print(f"Error durante la separación: {e}")
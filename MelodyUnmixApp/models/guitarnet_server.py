@@ -0,0 +1,322 @@
+"""
+🛰️ GuitarNet SERVIDOR DE INFERENCIA - Batching dinámico entre jobs
+Proyecto: Melody Unmix
+
+Proceso independiente que carga el modelo UNA vez y atiende forwards de
+todos los workers de Django por un socket Unix. Las peticiones que llegan
+dentro de una ventana corta (--window-ms) y tienen el mismo shape se
+concatenan en un solo forward pass, aunque vengan de canciones distintas.
+
+Los clientes (GuitarSeparator con backend='remote') hacen STFT, chunking,
+overlap-add e iSTFT localmente y sólo envían el input del modelo
+[B, 1, F, T] ya normalizado; reciben la máscara del mismo shape.
+
+Protocolo (por conexión, petición → respuesta, en orden):
+    [4 bytes header_len][header JSON][8 bytes payload_len][payload]
+    header: {"op": "forward" | "ping", "shape": [...], "dtype": "float32"}
+    respuesta: mismo formato; si falla, header {"error": "..."} sin payload.
+
+Uso:
+    python guitarnet_server.py --model guitarnet_model.pth \
+        --socket /tmp/guitarnet.sock --max-batch 8 --window-ms 20
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from guitarnet_inference import BACKENDS, PRECISIONS, GuitarSeparator
+
+
+# =====================================================
+# 1) PROTOCOLO
+# =====================================================
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Conexión cerrada por el otro extremo")
+        received += n
+    return buf
+
+
+def send_message(sock, header, array=None):
+    """Envía header JSON + payload opcional (np.ndarray float32)"""
+    payload = b""
+    if array is not None:
+        array = np.ascontiguousarray(array, dtype=np.float32)
+        header = {**header, "shape": list(array.shape), "dtype": "float32"}
+        payload = array.tobytes()
+    header_bytes = json.dumps(header).encode("utf-8")
+    sock.sendall(
+        struct.pack("!I", len(header_bytes)) + header_bytes
+        + struct.pack("!Q", len(payload))
+    )
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """Recibe (header, array | None)"""
+    (header_len,) = struct.unpack("!I", _recv_exact(sock, 4))
+    header = json.loads(bytes(_recv_exact(sock, header_len)).decode("utf-8"))
+    (payload_len,) = struct.unpack("!Q", _recv_exact(sock, 8))
+    array = None
+    if payload_len:
+        array = np.frombuffer(_recv_exact(sock, payload_len), dtype=np.float32)
+        array = array.reshape(header["shape"])
+    return header, array
+
+
+# =====================================================
+# 2) BATCHING DINÁMICO
+# =====================================================
+class _Request:
+    def __init__(self, array):
+        self.array = array
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher:
+    """
+    Cola de forwards: agrupa peticiones del mismo shape [1, F, T] que
+    llegan dentro de `window_ms` hasta `max_batch` filas y las ejecuta en
+    un solo forward con separator.run_model.
+    """
+
+    def __init__(self, separator, max_batch=8, window_ms=20.0):
+        self.separator = separator
+        self.max_batch = max(1, int(max_batch))
+        self.window = window_ms / 1000.0
+        self.queue = queue.Queue()
+        self.pending = []  # peticiones de otro shape, para la siguiente ronda
+        self.stats = {"forwards": 0, "requests": 0, "rows": 0}
+        self._thread = threading.Thread(target=self._loop, name="guitarnet-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, array):
+        """Encola [B, 1, F, T] y bloquea hasta tener la máscara"""
+        request = _Request(array)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next(self, timeout=None):
+        if self.pending:
+            return self.pending.pop(0)
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _loop(self):
+        while True:
+            first = self._next()
+            batch = [first]
+            rows = first.array.shape[0]
+            shape = first.array.shape[1:]
+            deadline = time.monotonic() + self.window
+
+            # Juntar peticiones compatibles dentro de la ventana
+            skipped = []
+            while rows < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                request = self._next(timeout=remaining)
+                if request is None:
+                    break
+                if request.array.shape[1:] != shape or rows + request.array.shape[0] > self.max_batch:
+                    skipped.append(request)
+                    continue
+                batch.append(request)
+                rows += request.array.shape[0]
+            self.pending = skipped + self.pending
+
+            self._run(batch)
+
+    def _run(self, batch):
+        try:
+            stacked = torch.from_numpy(np.concatenate([r.array for r in batch], axis=0))
+            masks = self.separator.run_model(stacked).cpu().numpy()
+            offset = 0
+            for request in batch:
+                n = request.array.shape[0]
+                request.result = masks[offset:offset + n]
+                offset += n
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            self.stats["forwards"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["rows"] += sum(r.array.shape[0] for r in batch)
+            for request in batch:
+                request.done.set()
+
+
+# =====================================================
+# 3) SERVIDOR
+# =====================================================
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            try:
+                header, array = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                if header.get("op") == "ping":
+                    send_message(self.request, {"ok": True, **batcher.stats})
+                elif header.get("op") == "forward" and array is not None:
+                    send_message(self.request, {"ok": True}, batcher.submit(array))
+                else:
+                    send_message(self.request, {"error": f"op inválida: {header.get('op')!r}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                send_message(self.request, {"error": f"{type(e).__name__}: {e}"})
+
+
+class GuitarNetServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, separator, max_batch=8, window_ms=20.0):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.batcher = DynamicBatcher(separator, max_batch=max_batch, window_ms=window_ms)
+        super().__init__(socket_path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+# =====================================================
+# 4) CLIENTE
+# =====================================================
+class GuitarNetClient:
+    """
+    Cliente del servidor; una conexión por hilo (los jobs en threads
+    paralelos envían sus chunks de forma concurrente y el servidor los
+    agrupa). Reintenta una vez sólo si la conexión reutilizada estaba
+    caída al enviar (p. ej. el servidor se reinició); un timeout esperando
+    la respuesta no se reintenta.
+    """
+
+    def __init__(self, socket_path, timeout=600.0):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, header, array=None):
+        for attempt in range(2):
+            stale = getattr(self._local, "sock", None) is not None
+            try:
+                sock = self._connection()
+                send_message(sock, header, array)
+            except ConnectionError:
+                self._close()
+                if attempt or not stale:
+                    raise
+                continue
+            except OSError:
+                self._close()
+                raise
+            try:
+                response, result = recv_message(sock)
+            except OSError:
+                # El forward ya se envió: no se repite
+                self._close()
+                raise
+            break
+        if "error" in response:
+            raise RuntimeError(f"Servidor GuitarNet: {response['error']}")
+        return response, result
+
+    def ping(self):
+        response, _ = self._request({"op": "ping"})
+        return response
+
+    def forward(self, mag_input):
+        """[B, 1, F, T] → máscara [B, 1, F, T] (tensor)"""
+        array = mag_input.detach().cpu().float().numpy()
+        _, result = self._request({"op": "forward"}, array)
+        return torch.from_numpy(result.copy())
+
+
+# =====================================================
+# 5) CLI
+# =====================================================
+def main():
+    parser = argparse.ArgumentParser(description="🛰️ GuitarNet - Servidor de inferencia")
+    parser.add_argument("--model", type=str, default=str(Path(__file__).parent / "guitarnet_model.pth"))
+    parser.add_argument("--socket", type=str, default="/tmp/guitarnet.sock", help="Ruta del socket Unix")
+    parser.add_argument("--max-batch", type=int, default=8, help="Filas máximas por forward")
+    parser.add_argument("--window-ms", type=float, default=20.0, help="Ventana de espera para agrupar (ms)")
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--precision", type=str, default="fp32", choices=PRECISIONS)
+    parser.add_argument("--backend", type=str, default="torch", choices=[b for b in BACKENDS if b != "remote"])
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    separator = GuitarSeparator(
+        args.model,
+        device=args.device,
+        optimize=args.optimize,
+        precision=args.precision,
+        backend=args.backend,
+        num_threads=args.threads,
+    )
+    server = GuitarNetServer(args.socket, separator, max_batch=args.max_batch, window_ms=args.window_ms)
+    print(f"Servidor GuitarNet escuchando en {args.socket} "
+          f"(max_batch={args.max_batch}, ventana={args.window_ms}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()